@@ -0,0 +1,226 @@
+"""
+Control de admisión: cuántos comprobantes se procesan a la vez y quién espera.
+
+Hay un cupo fijo de comprobantes en proceso (extracción + guardado). Cuando
+está lleno, cada fuente (whatsapp, carpeta, api) espera en su propia cola y
+los cupos que se liberan se reparten por turnos entre las fuentes con
+espera: una ráfaga de WhatsApp no deja sin turno a la carpeta ni al revés.
+Si la cola de una fuente está llena, o la espera supera
+ADMISSION_MAX_WAIT, se rechaza con Sobrecarga y los segundos sugeridos para
+reintentar, calculados con el ritmo al que se están terminando comprobantes.
+
+Los turnos son concurrent.futures.Future, así que los usan tanto la API
+(asyncio) como el hilo del folder watcher (bloqueante).
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager, contextmanager
+from typing import Deque, Dict, Optional
+
+from app.config import ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Ventana (segundos) para medir el ritmo de comprobantes terminados
+VENTANA_DRENAJE = 60.0
+# Reintento sugerido cuando todavía no hay ritmo medido
+REINTENTO_SIN_DATOS = 5
+# Tope del reintento sugerido
+REINTENTO_MAX = 300
+
+
+class Sobrecarga(Exception):
+    """No hay cupo ni lugar en la cola de la fuente: reintentar más tarde."""
+
+    def __init__(self, fuente: str, reintentar_en: int, motivo: str):
+        self.fuente = fuente
+        self.reintentar_en = reintentar_en
+        self.motivo = motivo
+        super().__init__(f"Servicio saturado ({motivo}, fuente {fuente}), reintentar en {reintentar_en}s")
+
+
+class ControlAdmision:
+    """Cupo de comprobantes en proceso con colas por fuente atendidas por turnos."""
+
+    def __init__(self, max_en_vuelo: int = ADMISSION_MAX_IN_FLIGHT,
+                 max_cola: int = ADMISSION_MAX_QUEUE, espera_max: float = ADMISSION_MAX_WAIT):
+        """
+        Args:
+            max_en_vuelo: Comprobantes en proceso a la vez
+            max_cola: Esperas máximas por fuente antes de rechazar
+            espera_max: Segundos máximos de espera por un cupo
+        """
+        self.max_en_vuelo = max_en_vuelo
+        self.max_cola = max_cola
+        self.espera_max = espera_max
+        self._lock = threading.Lock()
+        self._en_vuelo = 0
+        self._colas: Dict[str, Deque[Future]] = {}
+        self._turnos: Deque[str] = deque()  # fuentes con espera, en orden de atención
+        self._terminados: Deque[float] = deque()
+        self._admitidos: Dict[str, int] = {}
+        self._rechazados: Dict[str, int] = {}
+
+    # --- Ritmo de drenaje ---
+
+    def _tasa_drenaje(self, ahora: float) -> float:
+        """Comprobantes terminados por segundo en la última ventana (con el lock tomado)."""
+        while self._terminados and self._terminados[0] < ahora - VENTANA_DRENAJE:
+            self._terminados.popleft()
+        if not self._terminados:
+            return 0.0
+        periodo = max(1.0, ahora - self._terminados[0])
+        return len(self._terminados) / periodo
+
+    def _estimar_espera(self, ahora: float) -> int:
+        """Segundos hasta que se atienda a alguien que llega ahora (con el lock tomado)."""
+        tasa = self._tasa_drenaje(ahora)
+        if tasa <= 0:
+            return REINTENTO_SIN_DATOS
+        en_cola = sum(len(cola) for cola in self._colas.values())
+        return max(1, min(REINTENTO_MAX, math.ceil((en_cola + 1) / tasa)))
+
+    # --- Turnos ---
+
+    def _reservar(self, fuente: str) -> Optional[Future]:
+        """
+        Toma un cupo si hay y nadie espera; si no, encola un turno.
+
+        Returns:
+            None si quedó admitido, o el Future que se completa al darle el cupo
+
+        Raises:
+            Sobrecarga si la cola de la fuente está llena
+        """
+        with self._lock:
+            if self._en_vuelo < self.max_en_vuelo and not self._turnos:
+                self._en_vuelo += 1
+                self._admitidos[fuente] = self._admitidos.get(fuente, 0) + 1
+                return None
+            cola = self._colas.setdefault(fuente, deque())
+            if len(cola) >= self.max_cola:
+                self._rechazados[fuente] = self._rechazados.get(fuente, 0) + 1
+                raise Sobrecarga(fuente, self._estimar_espera(time.monotonic()), "cola llena")
+            turno = Future()
+            cola.append(turno)
+            if fuente not in self._turnos:
+                self._turnos.append(fuente)
+            return turno
+
+    def _siguiente(self) -> Optional[Future]:
+        """Próximo turno, rotando entre fuentes (con el lock tomado)."""
+        while self._turnos:
+            fuente = self._turnos.popleft()
+            cola = self._colas.get(fuente)
+            if not cola:
+                continue
+            turno = cola.popleft()
+            if cola:
+                self._turnos.append(fuente)
+            self._admitidos[fuente] = self._admitidos.get(fuente, 0) + 1
+            return turno
+        return None
+
+    def liberar(self, terminado: bool = True):
+        """Devuelve un cupo; si hay espera, pasa directamente al siguiente turno."""
+        with self._lock:
+            if terminado:
+                self._terminados.append(time.monotonic())
+            turno = self._siguiente()
+            if turno is None:
+                self._en_vuelo -= 1
+        if turno is not None:
+            turno.set_result(True)
+
+    def _abandonar(self, fuente: str, turno: Future) -> int:
+        """
+        Saca un turno que dejó de esperar (timeout o cancelación). Si el cupo
+        llegó a dárselo justo antes, lo devuelve.
+
+        Returns:
+            Segundos sugeridos para reintentar
+        """
+        with self._lock:
+            cola = self._colas.get(fuente)
+            try:
+                cola.remove(turno)
+                otorgado = False
+            except (ValueError, AttributeError):
+                otorgado = True
+            if not otorgado:
+                self._rechazados[fuente] = self._rechazados.get(fuente, 0) + 1
+            espera = self._estimar_espera(time.monotonic())
+        if otorgado:
+            self.liberar(terminado=False)
+        return espera
+
+    @contextmanager
+    def ticket(self, fuente: str):
+        """Cupo para código sincrónico (bloquea el hilo mientras espera)."""
+        turno = self._reservar(fuente)
+        if turno is not None:
+            try:
+                turno.result(timeout=self.espera_max)
+            except FutureTimeoutError:
+                raise Sobrecarga(fuente, self._abandonar(fuente, turno), "espera agotada")
+        try:
+            yield
+        finally:
+            self.liberar()
+
+    @asynccontextmanager
+    async def ticket_async(self, fuente: str):
+        """Cupo para corrutinas: espera sin bloquear el event loop."""
+        turno = self._reservar(fuente)
+        if turno is not None:
+            try:
+                # shield: un timeout no debe cancelar el Future compartido con liberar()
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(turno)), self.espera_max)
+            except asyncio.TimeoutError:
+                raise Sobrecarga(fuente, self._abandonar(fuente, turno), "espera agotada")
+            except asyncio.CancelledError:
+                self._abandonar(fuente, turno)
+                raise
+        try:
+            yield
+        finally:
+            self.liberar()
+
+    def estimar_espera(self) -> int:
+        """Segundos sugeridos para reintentar con la carga actual."""
+        with self._lock:
+            return self._estimar_espera(time.monotonic())
+
+    def obtener_estado(self) -> dict:
+        """Cupo en uso, colas por fuente, ritmo de drenaje y rechazos."""
+        with self._lock:
+            ahora = time.monotonic()
+            return {
+                "en_vuelo": self._en_vuelo,
+                "max_en_vuelo": self.max_en_vuelo,
+                "en_cola": {fuente: len(cola) for fuente, cola in self._colas.items()},
+                "max_cola": self.max_cola,
+                "tasa_drenaje_por_segundo": round(self._tasa_drenaje(ahora), 3),
+                "espera_estimada_segundos": self._estimar_espera(ahora),
+                "admitidos": dict(self._admitidos),
+                "rechazados": dict(self._rechazados)
+            }
+
+
+# Instancia global para uso compartido
+_control_instance: Optional[ControlAdmision] = None
+_control_lock = threading.Lock()
+
+
+def get_control_admision() -> ControlAdmision:
+    """Obtiene el control de admisión global (API y folder watcher)."""
+    global _control_instance
+    with _control_lock:
+        if _control_instance is None:
+            _control_instance = ControlAdmision()
+    return _control_instance
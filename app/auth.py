@@ -0,0 +1,88 @@
+"""
+Autenticación de la API propia (header X-API-Key).
+
+Las claves se leen de la configuración una sola vez, al arrancar, y se
+guardan como SHA256: cada request sólo calcula el hash de la clave recibida
+y lo compara con hmac.compare_digest (tiempo constante, sin filtrar por
+timing cuántos caracteres coinciden). Sin claves configuradas la
+autenticación queda deshabilitada, como hasta ahora.
+
+El autenticador es intercambiable (configurar_autenticador) para poder
+usar otro esquema sin tocar las rutas.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+from typing import Iterable, Optional
+
+from fastapi import HTTPException, Request
+
+from app.config import API_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Header donde viaja la clave (el bot de WhatsApp ya lo envía)
+HEADER_API_KEY = "x-api-key"
+
+
+class ApiKeyAuth:
+    """Valida el header X-API-Key contra un conjunto fijo de claves."""
+
+    def __init__(self, claves: Iterable[str]):
+        self._hashes = tuple(hashlib.sha256(c.encode("utf-8")).digest() for c in claves if c)
+        if not self._hashes:
+            logger.warning("API sin autenticación: no hay api_key configurada")
+
+    @property
+    def habilitada(self) -> bool:
+        return bool(self._hashes)
+
+    def autenticar(self, request: Request) -> bool:
+        """True si el request trae una clave válida (o si no hay claves configuradas)."""
+        if not self._hashes:
+            return True
+        clave = request.headers.get(HEADER_API_KEY)
+        if not clave:
+            return False
+        recibida = hashlib.sha256(clave.encode("utf-8")).digest()
+        valida = False
+        for esperada in self._hashes:
+            # Sin cortocircuito: se comparan todas para no revelar cuál coincidió
+            valida |= hmac.compare_digest(recibida, esperada)
+        return valida
+
+
+# Instancia global para uso compartido
+_auth_instance: Optional[ApiKeyAuth] = None
+_auth_lock = threading.Lock()
+
+
+def get_autenticador():
+    """Obtiene el autenticador global (por defecto, X-API-Key con las claves de config)."""
+    global _auth_instance
+    with _auth_lock:
+        if _auth_instance is None:
+            _auth_instance = ApiKeyAuth(API_KEYS)
+    return _auth_instance
+
+
+def configurar_autenticador(autenticador):
+    """
+    Reemplaza el autenticador global. Debe tener un método
+    autenticar(request) -> bool.
+    """
+    global _auth_instance
+    with _auth_lock:
+        _auth_instance = autenticador
+
+
+def requerir_autenticacion(request: Request):
+    """Dependencia de FastAPI: 401 si el request no se autentica."""
+    autenticador = _auth_instance or get_autenticador()
+    if not autenticador.autenticar(request):
+        raise HTTPException(
+            status_code=401,
+            detail="API key inválida o ausente (header X-API-Key)",
+            headers={"WWW-Authenticate": "ApiKey"}
+        )
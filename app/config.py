@@ -4,6 +4,7 @@ Carga variables de entorno y define constantes.
 """
 import os
 import json
+import base64
 import shutil
 from dotenv import load_dotenv
 from app.paths import get_config_path, get_resource_dir
@@ -32,11 +33,43 @@ CONFIG_JSON = _load_json_config()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or CONFIG_JSON.get("openai_api_key", "")
 GOOGLE_CREDENTIALS_PATH = os.getenv("GOOGLE_CREDENTIALS_PATH") or CONFIG_JSON.get("google_credentials_path", "")
 
+
+def _desofuscar(clave: str) -> str:
+    """El launcher puede guardar la clave como "enc:<base64>"."""
+    if clave.startswith("enc:"):
+        try:
+            return base64.b64decode(clave[4:] + "==").decode("utf-8")
+        except Exception:
+            return clave
+    return clave
+
+
+# Clave(s) de la API propia, header X-API-Key (app/auth.py). La misma que el
+# launcher le pasa al bot. Sin claves, la API no pide autenticación
+_api_key = (os.getenv("API_KEY") or CONFIG_JSON.get("api_key", "")).strip()
+API_KEYS = [_desofuscar(_api_key)] if _api_key else []
+
 # Google Sheets
 _storage = CONFIG_JSON.get("storage", {})
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID") or _storage.get("sheets_id", "")
 GOOGLE_SHEET_NAME = os.getenv("GOOGLE_SHEET_NAME") or _storage.get("sheets_name", "Hoja 1")
 
+# Excel local (storage/excel_storage.py): el libro queda abierto en memoria y
+# se guarda cada excel_flush_segundos o al juntar excel_flush_filas filas sin
+# guardar. Con 0 segundos se guarda en cada comprobante
+EXCEL_FLUSH_SECONDS = float(_storage.get("excel_flush_segundos", 5))
+EXCEL_FLUSH_ROWS = int(_storage.get("excel_flush_filas", 200))
+
+# Escritura diferida a Google Sheets (storage/sheets_queue.py): las filas se
+# encolan (con respaldo en disco) y se envían juntas al juntar
+# sheets_flush_filas o cada sheets_flush_segundos, respetando la cuota de
+# escrituras por minuto de la API. Con sheets_escritura_diferida en false se
+# escribe en el momento, como antes
+SHEETS_QUEUE_ENABLED = bool(_storage.get("sheets_escritura_diferida", True))
+SHEETS_FLUSH_SECONDS = float(_storage.get("sheets_flush_segundos", 5))
+SHEETS_FLUSH_ROWS = int(_storage.get("sheets_flush_filas", 100))
+SHEETS_WRITES_PER_MINUTE = int(_storage.get("sheets_escrituras_por_minuto", 60))
+
 # Cuentas destino configurables
 # Agregar tus cuentas aquí con su CBU como clave
 CUENTAS_DESTINO = {
@@ -114,3 +147,115 @@ OPENAI_MODEL = "gpt-4o"
 
 # Nivel mínimo de confianza para aceptar extracción automática
 MIN_CONFIDENCE = 0.7
+
+# Concurrencia de extracción
+# max_concurrencia: llamadas simultáneas a OpenAI desde la API async
+# pdf_workers: hilos dedicados a convertir PDFs fuera del event loop
+_extraccion = CONFIG_JSON.get("extraccion", {})
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY") or _extraccion.get("max_concurrencia", 4))
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS") or _extraccion.get("pdf_workers", 2))
+
+# Cache de extracciones por hash del archivo (evita pagar dos veces el mismo comprobante)
+CACHE_ENABLED = bool(_extraccion.get("cache_enabled", True))
+CACHE_MAX_ENTRIES = int(_extraccion.get("cache_max_entradas", 5000))
+CACHE_TTL_DAYS = float(_extraccion.get("cache_ttl_dias", 30))
+
+# Duplicados perceptuales (bits distintos sobre 256 del dHash)
+# Hasta PHASH_DUPLICATE_DISTANCE se marca como posible duplicado; la
+# extracción no se reutiliza (comprobantes de la misma plantilla del banco
+# quedan a pocos bits aunque cambien monto, fecha y referencia)
+PHASH_DUPLICATE_DISTANCE = int(_extraccion.get("phash_distancia_duplicado", 12))
+
+# Preprocesamiento de imágenes antes del modelo (recorte, reducción, recompresión)
+# 768 px de lado corto es lo máximo que GPT-4o usa con detail "high"
+PREPROCESS_ENABLED = bool(_extraccion.get("preprocesar_imagenes", True))
+PREPROCESS_SHORT_SIDE = int(_extraccion.get("imagen_lado_corto_max", 768))
+PREPROCESS_JPEG_QUALITY = int(_extraccion.get("imagen_calidad_jpeg", 85))
+
+# PDFs digitales: leer la capa de texto y llamar al modelo sólo si el parseo
+# determinístico no alcanza MIN_CONFIDENCE
+PDF_TEXT_ENABLED = bool(_extraccion.get("pdf_texto_habilitado", True))
+
+# Renderizado de PDFs: "auto" (pdfium si está instalado), "pdfium",
+# "pdfium_pool" (procesos pre-calentados) o "poppler" (pdftoppm)
+PDF_RENDER_BACKEND = os.getenv("PDF_RENDER_BACKEND") or _extraccion.get("pdf_render_backend", "auto")
+PDF_GRAYSCALE = bool(_extraccion.get("pdf_escala_grises", True))
+PDF_MAX_DPI = int(_extraccion.get("pdf_dpi_max", 200))
+
+
+# PDFs con varios comprobantes (extractos, exportaciones con una transferencia
+# por página): cada página se extrae por separado, hasta PDF_MAX_PAGES
+PDF_MULTIPAGE = bool(_extraccion.get("pdf_multipagina", False))
+PDF_MAX_PAGES = int(_extraccion.get("pdf_max_paginas", 20))
+
+# Ruteo por niveles: primero un modelo más barato/rápido y, si el resultado
+# no es confiable (confianza baja, CBU/CUIL inválido, monto 0), se repite
+# con OPENAI_MODEL. detalle_economico "low" cobra sólo los tokens fijos por
+# imagen; con "high" gpt-4o-mini cobra ~25k tokens por una captura de
+# 768x1024 y termina costando el doble que gpt-4o
+ROUTING_ENABLED = bool(_extraccion.get("ruteo_habilitado", True))
+OPENAI_MODEL_ECONOMICO = os.getenv("OPENAI_MODEL_ECONOMICO") or _extraccion.get("modelo_economico", "gpt-4o-mini")
+OPENAI_DETAIL_ECONOMICO = _extraccion.get("detalle_economico", "low")
+
+# Backfill de carpetas con la Batch API de OpenAI (run.py --backfill)
+# batch_base_url permite apuntar a batch_server_local.py para probar sin conexión
+OPENAI_BATCH_BASE_URL = os.getenv("OPENAI_BATCH_BASE_URL") or _extraccion.get("batch_base_url") or None
+BATCH_POLL_SECONDS = float(_extraccion.get("batch_intervalo_consulta", 60))
+BATCH_MAX_REQUESTS = int(_extraccion.get("batch_max_solicitudes", 2000))
+
+# Resiliencia de las llamadas a OpenAI (app/resilience.py)
+# limite_rpm / limite_tpm: límites de la cuenta para cada modelo (0 = sin
+# límite local); OpenAI los aplica por modelo, y limites_por_modelo pisa los
+# de uno en particular, ej. {"gpt-4o-mini": {"rpm": 500, "tpm": 200000}}.
+# Antes de cada llamada se reservan los tokens estimados (imagen + prompt +
+# max_tokens; tokens_estimados_llamada si no hay estimación) y se corrige
+# con el uso real
+OPENAI_RPM_LIMIT = int(_extraccion.get("limite_rpm", 500))
+OPENAI_TPM_LIMIT = int(_extraccion.get("limite_tpm", 30000))
+OPENAI_MODEL_LIMITS = dict(_extraccion.get("limites_por_modelo", {}))
+OPENAI_TOKENS_PER_CALL = int(_extraccion.get("tokens_estimados_llamada", 2500))
+# Reintentos con backoff exponencial + jitter para 429/5xx/timeouts
+RETRY_MAX_ATTEMPTS = max(1, int(_extraccion.get("reintentos_max", 4)))
+RETRY_BASE_SECONDS = float(_extraccion.get("reintento_base_segundos", 1.0))
+RETRY_MAX_SECONDS = float(_extraccion.get("reintento_max_segundos", 30))
+# Circuit breaker: fallas reintentables seguidas para abrirlo y segundos abierto
+CIRCUIT_FAILURE_THRESHOLD = int(_extraccion.get("circuito_umbral_fallos", 5))
+CIRCUIT_OPEN_SECONDS = float(_extraccion.get("circuito_segundos_abierto", 30))
+
+# Prefiltro local de imágenes que no son comprobantes (app/receipt_filter.py)
+# Rechaza stickers antes de llamar al modelo; las imágenes dudosas (poco fondo,
+# o fotos según prefiltro_fondo_min/prefiltro_colorido_max) se rechazan sólo
+# si tesseract (prefiltro_ocr) confirma que no tienen texto; sin OCR van al modelo.
+# tesseract viene en Docker y en el instalador; con pip hay que instalarlo aparte
+PREFILTER_ENABLED = bool(_extraccion.get("prefiltro_habilitado", True))
+PREFILTER_OCR = bool(_extraccion.get("prefiltro_ocr", True))
+PREFILTER_MIN_BACKGROUND = float(_extraccion.get("prefiltro_fondo_min", 0.3))
+PREFILTER_MAX_COLORFULNESS = float(_extraccion.get("prefiltro_colorido_max", 35))
+
+# API asíncrona de trabajos (POST /jobs, GET /jobs/{id}; app/job_queue.py)
+# workers: trabajos procesados en paralelo; intentos_max: reintentos ante
+# errores transitorios de OpenAI; retencion_dias: cuánto se guardan los terminados
+_jobs = CONFIG_JSON.get("jobs", {})
+JOBS_WORKERS = int(_jobs.get("workers", 2))
+JOBS_MAX_ATTEMPTS = int(_jobs.get("intentos_max", 5))
+JOBS_RETENTION_DAYS = float(_jobs.get("retencion_dias", 7))
+JOBS_CALLBACK_TIMEOUT = float(_jobs.get("callback_timeout", 10))
+# callback_url: esquemas aceptados y hosts permitidos (nombre exacto, ej. "n8n").
+# Sin hosts permitidos sólo se aceptan hosts que resuelven a direcciones
+# públicas, para que un callback no sirva para llegar a servicios internos
+JOBS_CALLBACK_SCHEMES = tuple(s.lower() for s in _jobs.get("callback_esquemas", ["https", "http"]))
+JOBS_CALLBACK_HOSTS = {h.lower() for h in _jobs.get("callback_hosts_permitidos", [])}
+# Comprobantes máximos por request en POST /process-receipts/batch
+BATCH_MAX_ITEMS = int(_jobs.get("lote_max_items", 200))
+# Subida binaria (POST /process-receipt/upload): tamaño máximo por archivo y
+# hasta cuánto se mantiene en memoria antes de pasar a un archivo temporal
+UPLOAD_MAX_BYTES = int(float(_jobs.get("subida_max_mb", 20)) * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = int(float(_jobs.get("subida_memoria_mb", 2)) * 1024 * 1024)
+
+# Control de admisión (app/admission.py): comprobantes en proceso a la vez
+# (API y carpeta), esperas por fuente antes de responder 429 y espera máxima
+# por un cupo
+_admision = CONFIG_JSON.get("admision", {})
+ADMISSION_MAX_IN_FLIGHT = int(_admision.get("max_en_vuelo", OPENAI_MAX_CONCURRENCY * 2))
+ADMISSION_MAX_QUEUE = int(_admision.get("max_cola_por_fuente", 50))
+ADMISSION_MAX_WAIT = float(_admision.get("espera_max_segundos", 60))
@@ -0,0 +1,200 @@
+"""
+Cache persistente de extracciones.
+Guarda el resultado del modelo indexado por el SHA256 de los bytes del archivo
+y la versión de extracción (modelo + prompt), así un comprobante reenviado
+no vuelve a pagar una llamada a GPT-4o.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from app.config import CACHE_ENABLED, CACHE_MAX_ENTRIES, CACHE_TTL_DAYS
+from app.paths import get_extraction_cache_path
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántas escrituras se ejecuta la limpieza por TTL/tamaño
+EVICCION_CADA = 50
+
+
+def calcular_hash_bytes(contenido: bytes) -> str:
+    """Calcula el hash SHA256 de un contenido en memoria."""
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def calcular_hash_archivo(ruta_archivo: str) -> str:
+    """Calcula el hash SHA256 de un archivo leyéndolo por bloques."""
+    sha256 = hashlib.sha256()
+    with open(ruta_archivo, 'rb') as f:
+        for bloque in iter(lambda: f.read(65536), b''):
+            sha256.update(bloque)
+    return sha256.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Cache SQLite de resultados de extracción.
+    Evicción por antigüedad (TTL) y por cantidad máxima de entradas (LRU).
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_entradas: int = CACHE_MAX_ENTRIES,
+        ttl_dias: float = CACHE_TTL_DAYS
+    ):
+        """
+        Args:
+            db_path: Ruta al archivo SQLite (default: data/extraction_cache.db)
+            max_entradas: Cantidad máxima de resultados guardados
+            ttl_dias: Días que un resultado sigue siendo válido
+        """
+        self.db_path = db_path or get_extraction_cache_path()
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_dias * 86400
+        self.hits = 0
+        self.misses = 0
+        self._escrituras = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._inicializar()
+
+    def _inicializar(self):
+        """Crea la tabla si no existe."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS extracciones (
+                    hash TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    resultado TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    ultimo_uso REAL NOT NULL,
+                    usos INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (hash, version)
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_extracciones_uso ON extracciones (ultimo_uso)"
+            )
+            self._conn.commit()
+
+    def obtener(self, hash_contenido: str, version: str) -> Optional[dict]:
+        """
+        Busca un resultado cacheado.
+
+        Args:
+            hash_contenido: SHA256 de los bytes del archivo
+            version: Versión de extracción (modelo + prompt)
+
+        Returns:
+            Dict con el resultado o None si no está (o expiró)
+        """
+        ahora = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT resultado, creado FROM extracciones WHERE hash = ? AND version = ?",
+                (hash_contenido, version)
+            ).fetchone()
+
+            if row is None or ahora - row[1] > self.ttl_segundos:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE extracciones SET ultimo_uso = ?, usos = usos + 1 WHERE hash = ? AND version = ?",
+                (ahora, hash_contenido, version)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def guardar(self, hash_contenido: str, version: str, resultado: dict):
+        """
+        Guarda un resultado de extracción exitoso.
+
+        Args:
+            hash_contenido: SHA256 de los bytes del archivo
+            version: Versión de extracción (modelo + prompt)
+            resultado: Dict devuelto por el extractor
+
+        Returns:
+            Entradas eliminadas por la limpieza (0 si no corrió)
+        """
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extracciones (hash, version, resultado, creado, ultimo_uso, usos) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (hash_contenido, version, json.dumps(resultado, ensure_ascii=False), ahora, ahora)
+            )
+            self._conn.commit()
+            self._escrituras += 1
+            if self._escrituras % EVICCION_CADA == 0:
+                return self._evictar(ahora)
+        return 0
+
+    def _evictar(self, ahora: float) -> int:
+        """Elimina entradas expiradas y las menos usadas si se supera el máximo."""
+        eliminadas = self._conn.execute(
+            "DELETE FROM extracciones WHERE creado < ?",
+            (ahora - self.ttl_segundos,)
+        ).rowcount
+        total = self._conn.execute("SELECT COUNT(*) FROM extracciones").fetchone()[0]
+        sobrantes = total - self.max_entradas
+        if sobrantes > 0:
+            self._conn.execute(
+                "DELETE FROM extracciones WHERE rowid IN "
+                "(SELECT rowid FROM extracciones ORDER BY ultimo_uso ASC LIMIT ?)",
+                (sobrantes,)
+            )
+            eliminadas += sobrantes
+            logger.info(f"Cache de extracciones: {sobrantes} entradas eliminadas por tamaño")
+        self._conn.commit()
+        return eliminadas
+
+    def obtener_estadisticas(self) -> dict:
+        """Retorna hits, misses y tamaño actual del cache."""
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM extracciones").fetchone()[0]
+        consultas = self.hits + self.misses
+        return {
+            "entradas": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / consultas, 4) if consultas else 0.0
+        }
+
+    def limpiar(self):
+        """Vacía el cache (para testing o reset)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM extracciones")
+            self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+
+# Instancia global para uso compartido
+_cache_instance: Optional[ExtractionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Obtiene la instancia global del cache (None si está deshabilitado)."""
+    global _cache_instance
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache_instance is None:
+            try:
+                _cache_instance = ExtractionCache()
+            except Exception as e:
+                logger.error(f"No se pudo abrir el cache de extracciones: {e}")
+                return None
+    return _cache_instance
@@ -2,95 +2,169 @@
 Extractor de datos de comprobantes usando GPT-4o Vision.
 Envía la imagen directamente al modelo para mejor precisión.
 Soporta imágenes (JPEG, PNG) y PDFs.
+
+Expone dos variantes con el mismo resultado:
+- extraer_datos_comprobante: sincrónica (folder watcher, scripts)
+- extraer_datos_comprobante_async: para la API FastAPI, no bloquea el event loop
+
+Para PDFs con un comprobante por página, extraer_comprobantes_pdf y
+extraer_comprobantes_pdf_async devuelven una transferencia por página.
+
+Si el mismo archivo ya se está extrayendo (por ejemplo, llegó a la vez por
+WhatsApp y por la carpeta), la llamada espera ese resultado en vez de
+repetirlo y lo recibe con "coalescida": True (ver app/single_flight.py).
 """
+import asyncio
 import base64
+import hashlib
 import json
-import io
 import logging
-import os
-from typing import Optional, Tuple
-from openai import OpenAI
-from app.config import OPENAI_API_KEY, OPENAI_MODEL
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterator, Optional, Tuple
+from openai import OpenAI, AsyncOpenAI
+from app.config import (
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MAX_CONCURRENCY, PDF_RENDER_WORKERS,
+    PHASH_DUPLICATE_DISTANCE, PDF_TEXT_ENABLED, MIN_CONFIDENCE,
+    PDF_MAX_PAGES, PREPROCESS_SHORT_SIDE
+)
 from app.validator import validar_cbu, validar_cuil, validar_monto, detectar_banco_por_cbu, normalizar_fecha_operacion
+from app.extraction_cache import get_extraction_cache, calcular_hash_bytes
+from app.perceptual_hash import get_perceptual_index, calcular_dhash
+from app.image_preprocess import preprocesar_imagen, estimar_tokens_imagen
+from app.pdf_text import extraer_texto_pdf, parsear_comprobante
+from app.pdf_render import get_pdf_renderer
+from app.model_router import (
+    obtener_niveles, motivo_escalado, uso_respuesta, uso_vacio, sumar_usos, get_router_stats
+)
+from app.receipt_schema import RESPONSE_FORMAT, RespuestaInvalida, validar_respuesta
+from app.single_flight import get_single_flight
+from app.receipt_filter import evaluar_imagen, get_prefiltro_stats
+from app.metrics import medir_etapa
+from billing.cost_tracker import calcular_costo_tokens
+from app.resilience import (
+    llamar_con_reintentos, llamar_con_reintentos_async, es_reintentable, get_circuito
+)
 
 logger = logging.getLogger(__name__)
 
-# Cliente OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Cliente OpenAI (los reintentos los maneja app/resilience.py, no el SDK)
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# Cliente OpenAI asíncrono (usado por la API)
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# Pool acotado para trabajo de CPU (PDFs, hashes de imagen) fuera del event loop
+_cpu_executor = ThreadPoolExecutor(
+    max_workers=PDF_RENDER_WORKERS,
+    thread_name_prefix="extractor-cpu"
+)
+
+# Límite de llamadas simultáneas al modelo (se crea al primer uso dentro del loop)
+_semaforo_modelo: Optional[asyncio.Semaphore] = None
+
+
+def _get_semaforo_modelo() -> asyncio.Semaphore:
+    """Obtiene el semáforo global que limita las llamadas concurrentes a OpenAI."""
+    global _semaforo_modelo
+    if _semaforo_modelo is None:
+        _semaforo_modelo = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    return _semaforo_modelo
+
 
+def _es_pdf(mime_type: str) -> bool:
+    """Indica si el MIME type corresponde a un PDF."""
+    return mime_type == "application/pdf" or mime_type.endswith("pdf")
 
-def _convertir_pdf_a_imagen(pdf_base64: str) -> Tuple[str, str]:
+
+def _convertir_pdf_a_imagen(pdf_bytes: bytes, pagina: int = 0) -> Tuple[bytes, str]:
     """
-    Convierte un PDF en base64 a una imagen JPEG en base64.
-    Solo convierte la primera página.
+    Convierte una página de un PDF (por defecto la primera) a una imagen
+    JPEG con el backend configurado (ver app/pdf_render.py).
     
     Returns:
-        Tuple[str, str]: (imagen_base64, mime_type)
+        Tuple[bytes, str]: (imagen_bytes, mime_type)
     """
     try:
-        from pdf2image import convert_from_bytes
-        from PIL import Image
-        
-        # Decodificar PDF
-        pdf_bytes = base64.b64decode(pdf_base64)
-        
-        poppler_path = os.environ.get("POPPLER_PATH")
-
-        # Convertir primera página a imagen
-        if poppler_path:
-            images = convert_from_bytes(
-                pdf_bytes,
-                first_page=1,
-                last_page=1,
-                dpi=200,
-                poppler_path=poppler_path
-            )
-        else:
-            images = convert_from_bytes(
-                pdf_bytes,
-                first_page=1,
-                last_page=1,
-                dpi=200
-            )
-        
-        if not images:
-            raise ValueError("No se pudo extraer ninguna página del PDF")
-        
-        # Convertir a JPEG en base64
-        img = images[0]
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=95)
-        buffer.seek(0)
-        
-        imagen_base64 = base64.b64encode(buffer.read()).decode('utf-8')
+        with medir_etapa("render_pdf"):
+            imagen = get_pdf_renderer().renderizar(pdf_bytes, pagina)
         logger.info(f"PDF convertido a imagen JPEG exitosamente")
-        
-        return imagen_base64, "image/jpeg"
+        return imagen, "image/jpeg"
         
     except ImportError:
-        logger.error("pdf2image no está instalado. Ejecutar: pip install pdf2image")
-        raise ValueError("Librería pdf2image no disponible")
+        logger.error(
+            "No hay backend para renderizar PDFs. Ejecutar: pip install pypdfium2 "
+            "(o pip install pdf2image con poppler instalado)"
+        )
+        raise ValueError("Ni pypdfium2 ni pdf2image están disponibles para renderizar PDFs")
     except Exception as e:
         logger.error(f"Error al convertir PDF: {e}")
         raise ValueError(f"Error al convertir PDF a imagen: {e}")
 
-# Prompt optimizado para comprobantes argentinos
+
+def _extraer_desde_texto_pdf(pdf_bytes: bytes, pagina: int = 0) -> Optional[dict]:
+    """
+    Intenta extraer el comprobante desde la capa de texto de una página del PDF.
+    
+    Returns:
+        Resultado en el mismo formato que la extracción con el modelo, o None
+        si el PDF no tiene texto o el parseo no alcanza MIN_CONFIDENCE
+    """
+    if not PDF_TEXT_ENABLED:
+        return None
+    
+    texto = extraer_texto_pdf(pdf_bytes, desde=pagina)
+    if not texto:
+        return None
+    
+    datos = parsear_comprobante(texto)
+    if datos is None or datos["confianza"] < MIN_CONFIDENCE:
+        logger.info("PDF con texto pero parseo incompleto, se usa el modelo")
+        return None
+    
+    datos = _validar_y_enriquecer(datos)
+    if not datos.get("monto_numerico"):
+        return None
+    
+    logger.info(f"PDF extraído desde la capa de texto (confianza {datos['confianza']}), sin llamar al modelo")
+    return {
+        "success": True,
+        "data": datos,
+        "raw_response": texto,
+        "metodo": "texto_pdf",
+        "uso": uso_vacio()
+    }
+
+
+def _preparar_imagen(contenido: bytes, mime_type: str) -> Tuple[bytes, str, dict]:
+    """
+    Deja el archivo listo para el modelo: convierte PDFs a imagen y
+    preprocesa (recorte, reducción, recompresión).
+    
+    Returns:
+        Tuple (imagen_bytes, mime_type, estadisticas_preprocesamiento)
+    """
+    if _es_pdf(mime_type):
+        logger.info("Detectado PDF, convirtiendo a imagen...")
+        contenido, mime_type = _convertir_pdf_a_imagen(contenido)
+    with medir_etapa("preprocesamiento"):
+        return preprocesar_imagen(contenido, mime_type)
+
+# Prompt optimizado para comprobantes argentinos. La lista de campos y su
+# formato viajan en el JSON schema (app/receipt_schema.py), no en el prompt
 EXTRACTION_PROMPT = """Sos un experto en extraer datos de comprobantes de transferencias bancarias argentinas.
-Analizá la imagen del comprobante y extraé los siguientes datos en formato JSON.
+Extraé los datos del comprobante de la imagen.
 
 REGLAS CRÍTICAS PARA IDENTIFICAR AL EMISOR (QUIEN ENVÍA):
 1. El EMISOR es quien ENVÍA/TRANSFIERE el dinero, NO quien lo recibe
-2. Buscar estas palabras clave para el EMISOR:
-   - "De:", "Origen", "Envía", "Remitente", "Titular origen"
-   - "Ordenante", "Desde cuenta", "Cuenta origen"
+2. Palabras clave del EMISOR: "De:", "Origen", "Envía", "Remitente", "Titular origen", "Ordenante", "Desde cuenta", "Cuenta origen"
    - El nombre que aparece PRIMERO o ARRIBA generalmente es el emisor
    - En apps como Mercado Pago, Brubank, Ualá: el emisor es el dueño de la cuenta de la app
-3. El RECEPTOR es quien RECIBE el dinero:
-   - "Para:", "Destino", "Recibe", "Beneficiario", "Destinatario"
+3. Palabras clave del RECEPTOR: "Para:", "Destino", "Recibe", "Beneficiario", "Destinatario"
 4. SI NO PODÉS IDENTIFICAR CLARAMENTE al emisor, dejá el campo vacío
-5. Si hay CBU de 22 dígitos, extraerlo completo
-6. El CUIL/CUIT tiene formato XX-XXXXXXXX-X (11 dígitos total)
-7. El monto principal es el que dice "Importe", "Monto", "$" (ignorar comisiones/retenciones)
+5. El monto principal es el que dice "Importe", "Monto", "$" (ignorar comisiones/retenciones)
 
 IDENTIFICACIÓN DE BANCOS POR DISEÑO/LOGO:
 - Logo naranja con "NX" o "Naranja X" → Naranja X
@@ -105,31 +179,207 @@ IDENTIFICACIÓN DE BANCOS POR DISEÑO/LOGO:
 - "BBVA" azul → BBVA Argentina
 - "Supervielle" → Banco Supervielle
 
-Respondé ÚNICAMENTE con un JSON válido, sin explicaciones ni markdown:
-
-{
-    "emisor_nombre": "Nombre y apellido completo del que ENVÍA el dinero",
-    "emisor_cuil": "XX-XXXXXXXX-X o vacío si no está visible",
-    "emisor_cbu": "22 dígitos o vacío si no está visible",
-    "banco_emisor": "Nombre del banco/app desde donde se envía",
-    "receptor_nombre": "Nombre y apellido del que RECIBE el dinero",
-    "receptor_cuil": "XX-XXXXXXXX-X o vacío",
-    "receptor_cbu": "22 dígitos o vacío",
-    "banco_receptor": "Nombre del banco/app que recibe",
-    "monto": "Solo número sin símbolos, ej: 650000",
-    "fecha_operacion": "DD/MM/YYYY HH:mm",
-    "referencia": "Código/número de operación o vacío",
-    "concepto": "Concepto/motivo de la transferencia o vacío",
-    "confianza": 0.95
-}
-
-NIVEL DE CONFIANZA:
-- 0.95-1.0: Todos los datos son claros, legibles y seguros
-- 0.7-0.94: Algunos datos incompletos pero el monto es claro
-- 0.5-0.69: Datos dudosos, requiere revisión manual
-- <0.5: Imagen ilegible o no es un comprobante de transferencia
-
-RECUERDA: Es CRÍTICO identificar correctamente al EMISOR (quien envía). Si no estás seguro, dejalo vacío."""
+CONFIANZA: 0.95-1.0 todo claro; 0.7-0.94 datos incompletos pero monto claro; 0.5-0.69 dudoso, requiere revisión; <0.5 ilegible o no es un comprobante."""
+
+# Pedido de corrección cuando la respuesta no cumple el esquema (no reenvía la imagen)
+REPAIR_PROMPT = """Tu respuesta anterior para un comprobante de transferencia no cumple el esquema JSON requerido.
+Errores: {errores}
+
+Respuesta anterior:
+{respuesta}
+
+Devolvé el mismo contenido corregido para que cumpla el esquema. Si un dato no está, usá "" (o 0 en confianza)."""
+
+# Versión de extracción: cambia con los modelos (niveles de ruteo) o el
+# prompt e invalida el cache
+_MODELOS_VERSION = ",".join(f"{n['modelo']}/{n['detalle']}" for n in obtener_niveles())
+VERSION_EXTRACCION = hashlib.sha256(
+    f"{_MODELOS_VERSION}\n{EXTRACTION_PROMPT}\n{json.dumps(RESPONSE_FORMAT, sort_keys=True)}".encode("utf-8")
+).hexdigest()[:16]
+
+# Tokens de texto de cada llamada (prompt + esquema), a ~3 caracteres por token
+TOKENS_TEXTO_LLAMADA = len(EXTRACTION_PROMPT + json.dumps(RESPONSE_FORMAT)) // 3
+# Imagen típica que se envía: lado corto de image_preprocess, captura 3:4
+TAMANO_IMAGEN_TIPICO = (PREPROCESS_SHORT_SIDE, PREPROCESS_SHORT_SIDE * 4 // 3)
+# Tokens de salida de una extracción típica (el JSON del comprobante)
+TOKENS_SALIDA_TIPICOS = 300
+# Tope de tokens de salida de cada llamada
+MAX_TOKENS_RESPUESTA = 1000
+
+
+def estimar_tokens_entrada(nivel: dict, tamano: Tuple[int, int] = TAMANO_IMAGEN_TIPICO) -> int:
+    """Tokens de entrada de una llamada del nivel: texto + imagen según modelo y detalle."""
+    return TOKENS_TEXTO_LLAMADA + estimar_tokens_imagen(*tamano, nivel["modelo"], nivel["detalle"])
+
+
+def _tokens_a_reservar(nivel: dict, preprocesamiento: Optional[dict] = None) -> int:
+    """Tokens que se reservan en el límite del modelo: entrada estimada + max_tokens."""
+    tamano = (preprocesamiento or {}).get("tamano_enviado") or TAMANO_IMAGEN_TIPICO
+    return estimar_tokens_entrada(nivel, tuple(tamano)) + MAX_TOKENS_RESPUESTA
+
+
+def _tokens_reparacion(parametros: dict) -> int:
+    """Tokens que se reservan para un pedido de corrección (texto + esquema + max_tokens)."""
+    texto = parametros["messages"][0]["content"] + json.dumps(RESPONSE_FORMAT)
+    return len(texto) // 3 + MAX_TOKENS_RESPUESTA
+
+
+def _construir_parametros_modelo(
+    imagen: bytes,
+    mime_type: str,
+    modelo: str = OPENAI_MODEL,
+    detalle: str = "high"
+) -> dict:
+    """
+    Arma los parámetros de chat.completions.create para una imagen.
+    Compartido por la variante sincrónica y la asíncrona.
+    Es el único punto donde la imagen se codifica en base64.
+    
+    El prompt va en el mensaje de sistema, antes de la imagen, para que el
+    prefijo (esquema + prompt) sea idéntico en todas las llamadas y OpenAI lo
+    sirva desde su cache de prompts; prompt_cache_key agrupa esas llamadas.
+    """
+    imagen_base64 = base64.b64encode(imagen).decode("ascii")
+    return {
+        "model": modelo,
+        "messages": [
+            {
+                "role": "system",
+                "content": EXTRACTION_PROMPT
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{imagen_base64}",
+                            "detail": detalle
+                        }
+                    }
+                ]
+            }
+        ],
+        "response_format": RESPONSE_FORMAT,
+        "prompt_cache_key": f"comprobantes-{VERSION_EXTRACCION}",
+        "max_tokens": MAX_TOKENS_RESPUESTA,
+        "temperature": 0.1  # Baja temperatura para respuestas más consistentes
+    }
+
+
+def _construir_parametros_reparacion(content: Optional[str], error: RespuestaInvalida, modelo: str) -> dict:
+    """Arma el pedido de corrección de una respuesta que no cumple el esquema."""
+    return {
+        "model": modelo,
+        "messages": [
+            {
+                "role": "user",
+                "content": REPAIR_PROMPT.format(errores=error, respuesta=(content or "")[:4000])
+            }
+        ],
+        "response_format": RESPONSE_FORMAT,
+        "max_tokens": MAX_TOKENS_RESPUESTA,
+        "temperature": 0
+    }
+
+
+def _procesar_respuesta(content: str, datos: Optional[dict] = None) -> dict:
+    """
+    Parsea, valida y enriquece la respuesta del modelo. Si ya se validó
+    (datos del esquema), no se vuelve a parsear.
+    """
+    if datos is None:
+        datos = _parsear_respuesta_json(content)
+    
+    # Validar y enriquecer datos
+    datos = _validar_y_enriquecer(datos)
+    
+    return {
+        "success": True,
+        "data": datos,
+        "raw_response": content
+    }
+
+
+def _sin_costo(resultado: dict) -> dict:
+    """Pone en cero el uso de un resultado servido desde el cache (no se vuelve a cobrar)."""
+    resultado["uso"] = uso_vacio()
+    for pagina in resultado.get("paginas", []):
+        pagina["uso"] = uso_vacio()
+    return resultado
+
+
+def _consultar_cache(
+    contenido: bytes,
+    mime_type: str,
+    version: str = VERSION_EXTRACCION,
+    hash_contenido: Optional[str] = None
+) -> Tuple[dict, Optional[dict]]:
+    """
+    Busca el archivo en el cache de extracciones.
+    
+    Primero por SHA256 exacto; si no está y es una imagen, busca una imagen
+    casi idéntica en el índice perceptual (reenvíos recomprimidos por WhatsApp).
+    Un hit perceptual sólo marca el posible duplicado: comprobantes distintos
+    de la misma plantilla del banco quedan a pocos bits de distancia, así que
+    la extracción nunca se reutiliza y siempre se llama al modelo.
+    
+    Returns:
+        Tuple (claves, resultado_cacheado). claves tiene "hash", "dhash" y
+        "duplicado_de" (None si no aplican); resultado es None si no hubo hit.
+    """
+    claves = {"hash": None, "dhash": None, "duplicado_de": None}
+    cache = get_extraction_cache()
+    if cache is None:
+        return claves, None
+    
+    claves["hash"] = hash_contenido or calcular_hash_bytes(contenido)
+    resultado = cache.obtener(claves["hash"], version)
+    if resultado is not None:
+        logger.info(f"Cache hit para comprobante {claves['hash'][:12]}, se omite la llamada al modelo")
+        resultado["cache"] = "hit"
+        return claves, _sin_costo(resultado)
+    
+    # Duplicados perceptuales (sólo imágenes: los PDFs no se recomprimen)
+    indice = get_perceptual_index()
+    if indice is None or _es_pdf(mime_type):
+        return claves, None
+    
+    claves["dhash"] = calcular_dhash(contenido)
+    if claves["dhash"] is None:
+        return claves, None
+    
+    similar = indice.buscar(claves["dhash"], PHASH_DUPLICATE_DISTANCE)
+    if similar is None:
+        return claves, None
+    
+    hash_original, distancia = similar
+    claves["duplicado_de"] = {"hash_original": hash_original, "distancia": distancia}
+    logger.info(f"Posible duplicado de {hash_original[:12]} (distancia {distancia})")
+    return claves, None
+
+
+def _guardar_en_cache(claves: dict, resultado: dict, version: str = VERSION_EXTRACCION):
+    """Guarda en el cache un resultado exitoso y registra su hash perceptual."""
+    if claves.get("duplicado_de"):
+        resultado["duplicado_perceptual"] = claves["duplicado_de"]
+    
+    if not claves.get("hash") or not resultado.get("success"):
+        return
+    cache = get_extraction_cache()
+    if cache is None:
+        return
+    try:
+        eliminadas = cache.guardar(claves["hash"], version, resultado)
+        indice = get_perceptual_index()
+        if indice is not None:
+            if claves.get("dhash") is not None:
+                indice.agregar(claves["dhash"], claves["hash"])
+            # Los hashes de extracciones que salieron del cache ya no se comparan
+            if eliminadas:
+                indice.purgar()
+    except Exception as e:
+        logger.warning(f"No se pudo guardar en el cache de extracciones: {e}")
 
 
 def extraer_datos_comprobante(
@@ -139,6 +389,8 @@ def extraer_datos_comprobante(
     """
     Extrae datos de un comprobante usando GPT-4o Vision.
     Soporta imágenes (JPEG, PNG) y PDFs.
+    Si el mismo archivo ya fue procesado, devuelve el resultado cacheado
+    (una imagen casi idéntica sólo se marca como posible duplicado).
     
     Args:
         imagen_base64: Imagen o PDF codificado en base64
@@ -148,94 +400,691 @@ def extraer_datos_comprobante(
         Dict con los datos extraídos
     """
     try:
-        # Si es PDF, convertir a imagen primero
-        if mime_type == "application/pdf" or mime_type.endswith("pdf"):
-            logger.info("Detectado PDF, convirtiendo a imagen...")
-            imagen_base64, mime_type = _convertir_pdf_a_imagen(imagen_base64)
+        contenido, hash_contenido = _decodificar(imagen_base64)
+    except Exception as e:
+        return _resultado_error(f"Archivo base64 inválido: {e}")
+    return extraer_datos_comprobante_bytes(contenido, mime_type, hash_contenido)
+
+
+def extraer_datos_comprobante_bytes(
+    contenido: bytes,
+    mime_type: str = "image/jpeg",
+    hash_contenido: Optional[str] = None
+) -> dict:
+    """
+    Igual que extraer_datos_comprobante pero con el archivo en binario
+    (subidas multipart/octet-stream, carpeta): no pasa por base64 hasta
+    armar el request al modelo.
+    
+    Args:
+        contenido: Bytes de la imagen o PDF
+        mime_type: Tipo MIME del archivo
+        hash_contenido: SHA256 del contenido si ya se calculó (ej. al recibirlo)
+    """
+    hash_contenido = hash_contenido or calcular_hash_bytes(contenido)
+    # Llamadas simultáneas con el mismo archivo comparten una sola extracción
+    return get_single_flight().ejecutar(
+        f"{VERSION_EXTRACCION}:{hash_contenido}",
+        lambda: _extraer_contenido(contenido, mime_type, hash_contenido)
+    )
+
+
+def _decodificar(archivo_base64: str) -> Tuple[bytes, str]:
+    """Decodifica el archivo y calcula su SHA256 (clave de cache y de coalescencia)."""
+    with medir_etapa("decodificacion"):
+        contenido = base64.b64decode(archivo_base64)
+        return contenido, calcular_hash_bytes(contenido)
+
+
+def _extraer_contenido(contenido: bytes, mime_type: str, hash_contenido: str) -> dict:
+    """Extracción de un archivo ya decodificado: cache y, si no está, el modelo."""
+    claves, cacheado = _consultar_cache(contenido, mime_type, hash_contenido=hash_contenido)
+    if cacheado is not None:
+        return cacheado
+    
+    resultado = _extraer_con_modelo(contenido, mime_type)
+    _guardar_en_cache(claves, resultado)
+    return resultado
+
+
+def _resultado_error(error: str, reintentable: bool = False) -> dict:
+    """
+    Arma el resultado estándar de una extracción fallida.
+    
+    Con reintentable=True (rate limit, 5xx, circuito abierto) el archivo no
+    debe darse por procesado: conviene volver a intentarlo en reintentar_en segundos.
+    """
+    resultado = {
+        "success": False,
+        "error": error,
+        "data": None
+    }
+    if reintentable:
+        resultado["reintentable"] = True
+        resultado["reintentar_en"] = max(round(get_circuito().segundos_para_reintento()), 1)
+    return resultado
+
+
+def _resultado_excepcion(error: Exception) -> dict:
+    """Resultado de error a partir de una excepción (marca las transitorias)."""
+    return _resultado_error(str(error), reintentable=es_reintentable(error))
+
+
+def _prefiltrar(contenido: bytes, mime_type: str) -> Optional[dict]:
+    """
+    Evalúa la imagen con el prefiltro local (app/receipt_filter.py).
+    
+    Returns:
+        Resultado de error si claramente no es un comprobante, None si sigue
+        hacia el modelo. Los PDFs no se prefiltran.
+    """
+    if _es_pdf(mime_type):
+        return None
+    with medir_etapa("prefiltro"):
+        evaluacion = evaluar_imagen(contenido)
+    # Costo que se evita: una llamada típica del primer nivel (con su modelo y detalle)
+    nivel = obtener_niveles()[0]
+    costo_evitado = calcular_costo_tokens(nivel["modelo"], estimar_tokens_entrada(nivel), TOKENS_SALIDA_TIPICOS)
+    get_prefiltro_stats().registrar(evaluacion, costo_evitado)
+    if evaluacion["es_comprobante"]:
+        return None
+    
+    logger.info(
+        f"Imagen rechazada por el prefiltro ({evaluacion['motivo']}, {evaluacion['tiempo_ms']} ms), "
+        f"no se llama al modelo"
+    )
+    resultado = _resultado_error(f"La imagen no parece un comprobante ({evaluacion['motivo']})")
+    resultado["metodo"] = "prefiltro"
+    resultado["prefiltro"] = evaluacion
+    resultado["uso"] = dict(uso_vacio(), rechazado_prefiltro=True, costo_evitado_usd=round(costo_evitado, 6))
+    return resultado
+
+
+def _extraer_con_modelo(contenido: bytes, mime_type: str) -> dict:
+    """Prepara la imagen y llama al modelo de forma sincrónica."""
+    try:
+        if _es_pdf(mime_type):
+            resultado = _extraer_desde_texto_pdf(contenido)
+            if resultado is not None:
+                return resultado
+        else:
+            rechazo = _prefiltrar(contenido, mime_type)
+            if rechazo is not None:
+                return rechazo
         
-        # Preparar el mensaje con la imagen
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": EXTRACTION_PROMPT
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{imagen_base64}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=1000,
-            temperature=0.1  # Baja temperatura para respuestas más consistentes
-        )
+        imagen, mime_type, preprocesamiento = _preparar_imagen(contenido, mime_type)
+        return _llamar_modelo(imagen, mime_type, preprocesamiento)
         
-        # Extraer el contenido JSON de la respuesta
-        content = response.choices[0].message.content
+    except Exception as e:
+        return _resultado_excepcion(e)
+
+
+def _contenido_respuesta(response) -> Optional[str]:
+    """Texto de la respuesta (None si el modelo se negó o no devolvió nada)."""
+    return response.choices[0].message.content
+
+
+def _sin_respuesta_util(response) -> Optional[str]:
+    """
+    Motivo por el que no hay nada que reparar (negativa del modelo, filtro de
+    contenido o respuesta vacía); None si hay texto.
+    """
+    choice = response.choices[0]
+    if getattr(choice.message, "refusal", None):
+        return f"el modelo se negó ({choice.message.refusal})"
+    if choice.finish_reason == "content_filter":
+        return "respuesta bloqueada por el filtro de contenido"
+    if not choice.message.content:
+        return "respuesta vacía"
+    return None
+
+
+def _evaluar_nivel(
+    nivel: dict,
+    respuestas: list,
+    content: Optional[str],
+    datos: Optional[dict],
+    inicio: float,
+    ruteo: list
+) -> Tuple[dict, Optional[str]]:
+    """
+    Procesa la respuesta de un nivel, registra su latencia y costo y decide
+    si hay que escalar al siguiente.
+    
+    Args:
+        respuestas: Respuestas del nivel (la original y, si hubo, la reparación)
+        content: Texto ya validado (o None si ni la reparación cumplió el esquema)
+        datos: Campos que devolvió la validación de content
+    
+    Returns:
+        Tuple (resultado, motivo_escalado o None)
+    """
+    latencia_ms = (time.perf_counter() - inicio) * 1000
+    uso = sumar_usos([uso_respuesta(nivel["modelo"], r) for r in respuestas])
+    uso["latencia_ms"] = round(latencia_ms, 1)
+    costo = uso["costo_usd"]
+    get_router_stats().registrar_llamada(nivel["nombre"], latencia_ms, costo, uso=uso)
+    
+    if content is None:
+        resultado = _resultado_error("La respuesta del modelo no cumple el esquema del comprobante")
+        motivo = "respuesta_invalida"
+    else:
+        resultado = _procesar_respuesta(content, datos)
+        motivo = motivo_escalado(resultado["data"])
+    ruteo.append({
+        "nivel": nivel["nombre"],
+        "modelo": nivel["modelo"],
+        "detalle": nivel["detalle"],
+        "latencia_ms": round(latencia_ms, 1),
+        "costo_usd": round(costo, 6),
+        "reparada": len(respuestas) > 1,
+        "uso": uso,
+        "motivo_escalado": motivo
+    })
+    return resultado, motivo
+
+
+def _validar_o_reparar(nivel: dict, response) -> Tuple[list, Optional[str], Optional[dict]]:
+    """
+    Valida la respuesta contra el esquema y, si no cumple, pide una
+    corrección (sólo texto, sin reenviar la imagen). Si el modelo se negó o
+    no devolvió texto no se pide corrección: el nivel falla y se escala.
+    
+    Returns:
+        Tuple (respuestas, content validado o None, datos validados o None)
+    """
+    content = _contenido_respuesta(response)
+    sin_respuesta = _sin_respuesta_util(response)
+    if sin_respuesta:
+        # Sin texto no hay qué corregir: la reparación inventaría los datos
+        logger.warning(f"Sin respuesta utilizable de {nivel['modelo']}: {sin_respuesta}. No se pide corrección")
+        return [response], None, None
+    try:
+        with medir_etapa("validacion"):
+            datos = validar_respuesta(content)
+        return [response], content, datos
+    except RespuestaInvalida as e:
+        logger.warning(f"Respuesta fuera de esquema ({nivel['modelo']}): {e}. Pidiendo corrección")
+        error = e
+    parametros = _construir_parametros_reparacion(content, error, nivel["modelo"])
+    reparada = llamar_con_reintentos(lambda: _crear(parametros), nivel["modelo"], _tokens_reparacion(parametros))
+    return ([response, reparada],) + _contenido_valido(reparada)
+
+
+async def _validar_o_reparar_async(nivel: dict, response) -> Tuple[list, Optional[str], Optional[dict]]:
+    """Variante asíncrona de _validar_o_reparar."""
+    content = _contenido_respuesta(response)
+    sin_respuesta = _sin_respuesta_util(response)
+    if sin_respuesta:
+        # Sin texto no hay qué corregir: la reparación inventaría los datos
+        logger.warning(f"Sin respuesta utilizable de {nivel['modelo']}: {sin_respuesta}. No se pide corrección")
+        return [response], None, None
+    try:
+        with medir_etapa("validacion"):
+            datos = validar_respuesta(content)
+        return [response], content, datos
+    except RespuestaInvalida as e:
+        logger.warning(f"Respuesta fuera de esquema ({nivel['modelo']}): {e}. Pidiendo corrección")
+        error = e
+    parametros = _construir_parametros_reparacion(content, error, nivel["modelo"])
+    reparada = await llamar_con_reintentos_async(
+        lambda: _crear_async(parametros), nivel["modelo"], _tokens_reparacion(parametros)
+    )
+    return ([response, reparada],) + _contenido_valido(reparada)
+
+
+def _contenido_valido(response) -> Tuple[Optional[str], Optional[dict]]:
+    """Texto de la respuesta y sus datos si cumple el esquema, (None, None) si no."""
+    content = _contenido_respuesta(response)
+    try:
+        with medir_etapa("validacion"):
+            return content, validar_respuesta(content)
+    except RespuestaInvalida as e:
+        logger.error(f"La corrección tampoco cumple el esquema: {e}")
+        return None, None
+
+
+def _registrar_error_nivel(nivel: dict, inicio: float, ruteo: list, error: Exception):
+    """Registra un nivel cuya llamada falló (se escala al siguiente, si hay)."""
+    latencia_ms = (time.perf_counter() - inicio) * 1000
+    get_router_stats().registrar_llamada(nivel["nombre"], latencia_ms, 0.0, error=True)
+    logger.warning(f"Falló el nivel {nivel['nombre']} ({nivel['modelo']}): {error}")
+    ruteo.append({
+        "nivel": nivel["nombre"],
+        "modelo": nivel["modelo"],
+        "detalle": nivel["detalle"],
+        "latencia_ms": round(latencia_ms, 1),
+        "costo_usd": 0.0,
+        "uso": dict(uso_vacio(), llamadas=1, latencia_ms=round(latencia_ms, 1)),
+        "motivo_escalado": "error"
+    })
+
+
+def _cerrar_ruteo(resultado: dict, ruteo: list, preprocesamiento: dict) -> dict:
+    """Completa el resultado con el modelo usado y registra la extracción."""
+    motivos = [paso["motivo_escalado"] for paso in ruteo[:-1]]
+    get_router_stats().registrar_extraccion(sum(paso["latencia_ms"] for paso in ruteo), motivos)
+    if motivos:
+        logger.info(f"Extracción escalada a {ruteo[-1]['modelo']} ({', '.join(motivos)})")
+    resultado["metodo"] = "modelo"
+    resultado["modelo"] = ruteo[-1]["modelo"]
+    resultado["ruteo"] = ruteo
+    resultado["preprocesamiento"] = preprocesamiento
+    resultado["uso"] = sumar_usos([paso["uso"] for paso in ruteo])
+    return resultado
+
+
+def _crear(parametros: dict):
+    """Una llamada sincrónica a chat.completions (medida como etapa "modelo")."""
+    with medir_etapa("modelo"):
+        return client.chat.completions.create(**parametros)
+
+
+def _llamar_modelo(imagen: bytes, mime_type: str, preprocesamiento: dict) -> dict:
+    """
+    Envía una imagen ya preparada al modelo (sincrónico).
+    Empieza por el nivel económico y escala sólo si el resultado no es confiable.
+    """
+    niveles = obtener_niveles()
+    ruteo = []
+    for nivel in niveles:
+        es_ultimo = nivel is niveles[-1]
+        inicio = time.perf_counter()
+        try:
+            parametros = _construir_parametros_modelo(imagen, mime_type, nivel["modelo"], nivel["detalle"])
+            response = llamar_con_reintentos(
+                lambda: _crear(parametros), nivel["modelo"], _tokens_a_reservar(nivel, preprocesamiento)
+            )
+            respuestas, content, datos = _validar_o_reparar(nivel, response)
+        except Exception as e:
+            _registrar_error_nivel(nivel, inicio, ruteo, e)
+            if es_ultimo:
+                raise
+            continue
+        resultado, motivo = _evaluar_nivel(nivel, respuestas, content, datos, inicio, ruteo)
+        if motivo is None or es_ultimo:
+            return _cerrar_ruteo(resultado, ruteo, preprocesamiento)
+
+
+async def extraer_datos_comprobante_async(
+    imagen_base64: str,
+    mime_type: str = "image/jpeg"
+) -> dict:
+    """
+    Variante asíncrona de extraer_datos_comprobante.
+    
+    La conversión de PDF y el preprocesamiento corren en un pool de hilos acotado y la llamada al
+    modelo usa AsyncOpenAI, limitada por OPENAI_MAX_CONCURRENCY. Así N
+    comprobantes en paralelo tardan aproximadamente lo que tarda uno.
+    
+    Args:
+        imagen_base64: Imagen o PDF codificado en base64
+        mime_type: Tipo MIME del archivo
         
-        # Intentar parsear el JSON
-        datos = _parsear_respuesta_json(content)
+    Returns:
+        Dict con los datos extraídos (mismo formato que la versión sincrónica)
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        contenido, hash_contenido = await loop.run_in_executor(_cpu_executor, _decodificar, imagen_base64)
+    except Exception as e:
+        return _resultado_error(f"Archivo base64 inválido: {e}")
+    return await extraer_datos_comprobante_bytes_async(contenido, mime_type, hash_contenido)
+
+
+async def extraer_datos_comprobante_bytes_async(
+    contenido: bytes,
+    mime_type: str = "image/jpeg",
+    hash_contenido: Optional[str] = None
+) -> dict:
+    """Variante asíncrona de extraer_datos_comprobante_bytes."""
+    if hash_contenido is None:
+        loop = asyncio.get_running_loop()
+        hash_contenido = await loop.run_in_executor(_cpu_executor, calcular_hash_bytes, contenido)
+    return await get_single_flight().ejecutar_async(
+        f"{VERSION_EXTRACCION}:{hash_contenido}",
+        lambda: _extraer_contenido_async(contenido, mime_type, hash_contenido)
+    )
+
+
+async def _extraer_contenido_async(contenido: bytes, mime_type: str, hash_contenido: str) -> dict:
+    """Variante asíncrona de _extraer_contenido."""
+    loop = asyncio.get_running_loop()
+    claves, cacheado = await loop.run_in_executor(
+        _cpu_executor, partial(_consultar_cache, contenido, mime_type, hash_contenido=hash_contenido)
+    )
+    if cacheado is not None:
+        return cacheado
+    
+    resultado = await _extraer_con_modelo_async(contenido, mime_type)
+    _guardar_en_cache(claves, resultado)
+    return resultado
+
+
+async def _extraer_con_modelo_async(contenido: bytes, mime_type: str) -> dict:
+    """Prepara la imagen en el pool de hilos y llama al modelo con AsyncOpenAI."""
+    try:
+        loop = asyncio.get_running_loop()
+        if _es_pdf(mime_type):
+            resultado = await loop.run_in_executor(_cpu_executor, _extraer_desde_texto_pdf, contenido)
+            if resultado is not None:
+                return resultado
+        else:
+            rechazo = await loop.run_in_executor(_cpu_executor, _prefiltrar, contenido, mime_type)
+            if rechazo is not None:
+                return rechazo
         
-        # Validar y enriquecer datos
-        datos = _validar_y_enriquecer(datos)
+        imagen, mime_type, preprocesamiento = await loop.run_in_executor(
+            _cpu_executor, _preparar_imagen, contenido, mime_type
+        )
+        return await _llamar_modelo_async(imagen, mime_type, preprocesamiento)
         
-        return {
-            "success": True,
-            "data": datos,
-            "raw_response": content
-        }
+    except Exception as e:
+        return _resultado_excepcion(e)
+
+
+async def _crear_async(parametros: dict):
+    """Una llamada a chat.completions dentro del límite global de concurrencia."""
+    async with _get_semaforo_modelo():
+        with medir_etapa("modelo"):
+            return await async_client.chat.completions.create(**parametros)
+
+
+async def _llamar_modelo_async(imagen: bytes, mime_type: str, preprocesamiento: dict) -> dict:
+    """
+    Envía una imagen ya preparada al modelo, respetando el límite global de
+    concurrencia. Mismo ruteo por niveles que _llamar_modelo.
+    """
+    niveles = obtener_niveles()
+    ruteo = []
+    for nivel in niveles:
+        es_ultimo = nivel is niveles[-1]
+        inicio = time.perf_counter()
+        try:
+            parametros = _construir_parametros_modelo(imagen, mime_type, nivel["modelo"], nivel["detalle"])
+            response = await llamar_con_reintentos_async(
+                lambda: _crear_async(parametros), nivel["modelo"], _tokens_a_reservar(nivel, preprocesamiento)
+            )
+            respuestas, content, datos = await _validar_o_reparar_async(nivel, response)
+        except Exception as e:
+            _registrar_error_nivel(nivel, inicio, ruteo, e)
+            if es_ultimo:
+                raise
+            continue
+        resultado, motivo = _evaluar_nivel(nivel, respuestas, content, datos, inicio, ruteo)
+        if motivo is None or es_ultimo:
+            return _cerrar_ruteo(resultado, ruteo, preprocesamiento)
+
+
+# --- PDFs con varios comprobantes (una transferencia por página) ---
+
+# Versión de cache para el resultado completo de un PDF multipágina
+VERSION_EXTRACCION_MULTIPAGINA = f"{VERSION_EXTRACCION}:multipagina"
+
+
+def _contar_paginas_pdf(pdf_bytes: bytes) -> int:
+    """Cantidad de páginas a procesar (acotada por PDF_MAX_PAGES)."""
+    total = get_pdf_renderer().contar_paginas(pdf_bytes)
+    if total > PDF_MAX_PAGES:
+        logger.warning(f"PDF con {total} páginas, se procesan sólo las primeras {PDF_MAX_PAGES}")
+    return min(total, PDF_MAX_PAGES)
+
+
+def _iterar_paginas_pdf(pdf_bytes: bytes, total: int) -> Iterator[dict]:
+    """
+    Genera las páginas de un PDF de a una, listas para el modelo.
+    
+    Cada página se resuelve recién cuando se pide: si la capa de texto
+    alcanza, trae el resultado y no se renderiza; si no, trae la imagen
+    renderizada y preprocesada. Así nunca hay más páginas en memoria que
+    las que se están enviando al modelo.
+    
+    Yields:
+        Dict con "pagina" (1..N), "resultado" (o None), "imagen", "mime_type",
+        "preprocesamiento" y "preparacion_ms"
+    """
+    for indice in range(total):
+        inicio = time.perf_counter()
+        pagina = {"pagina": indice + 1, "resultado": None}
+        try:
+            resultado = _extraer_desde_texto_pdf(pdf_bytes, indice)
+            if resultado is not None:
+                pagina["resultado"] = resultado
+            else:
+                imagen, mime_type = _convertir_pdf_a_imagen(pdf_bytes, indice)
+                with medir_etapa("preprocesamiento"):
+                    imagen, mime_type, preprocesamiento = preprocesar_imagen(imagen, mime_type)
+                pagina.update(imagen=imagen, mime_type=mime_type, preprocesamiento=preprocesamiento)
+        except Exception as e:
+            pagina["resultado"] = _resultado_error(str(e))
+        pagina["preparacion_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        yield pagina
+
+
+def _cerrar_pagina(pagina: dict, resultado: dict, inicio_modelo: Optional[float]) -> dict:
+    """Agrega número de página y tiempos al resultado de una página."""
+    modelo_ms = round((time.perf_counter() - inicio_modelo) * 1000, 1) if inicio_modelo else 0.0
+    resultado["pagina"] = pagina["pagina"]
+    resultado["tiempos"] = {
+        "preparacion_ms": pagina["preparacion_ms"],
+        "modelo_ms": modelo_ms,
+        "total_ms": round(pagina["preparacion_ms"] + modelo_ms, 1)
+    }
+    return resultado
+
+
+def _extraer_pagina(pagina: dict) -> dict:
+    """Extrae una página generada por _iterar_paginas_pdf (sincrónico)."""
+    if pagina["resultado"] is not None:
+        return _cerrar_pagina(pagina, pagina["resultado"], None)
+    inicio = time.perf_counter()
+    try:
+        resultado = _llamar_modelo(pagina["imagen"], pagina["mime_type"], pagina["preprocesamiento"])
+    except Exception as e:
+        resultado = _resultado_excepcion(e)
+    return _cerrar_pagina(pagina, resultado, inicio)
+
+
+async def _extraer_pagina_async(pagina: dict) -> dict:
+    """Extrae una página generada por _iterar_paginas_pdf con AsyncOpenAI."""
+    if pagina["resultado"] is not None:
+        return _cerrar_pagina(pagina, pagina["resultado"], None)
+    inicio = time.perf_counter()
+    try:
+        resultado = await _llamar_modelo_async(
+            pagina["imagen"], pagina["mime_type"], pagina["preprocesamiento"]
+        )
+    except Exception as e:
+        resultado = _resultado_excepcion(e)
+    return _cerrar_pagina(pagina, resultado, inicio)
+
+
+def _resultado_multipagina(paginas: list, inicio: float) -> dict:
+    """Arma el resultado de un PDF multipágina a partir de los resultados por página."""
+    paginas.sort(key=lambda r: r["pagina"])
+    exitosas = [r for r in paginas if r.get("success")]
+    resultado = {
+        "success": bool(exitosas),
+        "transferencias": [dict(r["data"], pagina=r["pagina"]) for r in exitosas],
+        "paginas": [
+            {
+                "pagina": r["pagina"],
+                "success": bool(r.get("success")),
+                "metodo": r.get("metodo", ""),
+                "error": r.get("error"),
+                "uso": r.get("uso"),
+                **r["tiempos"]
+            }
+            for r in paginas
+        ],
+        "uso": sumar_usos([r.get("uso") for r in paginas]),
+        "tiempo_total_ms": round((time.perf_counter() - inicio) * 1000, 1)
+    }
+    if not exitosas:
+        resultado["error"] = "No se pudo extraer ninguna página del PDF"
+    # Si alguna página falló por un error transitorio (429, timeout) se
+    # reintenta el PDF completo, aunque otras páginas hayan salido bien
+    reintentables = [r for r in paginas if r.get("reintentable")]
+    if reintentables:
+        resultado["reintentable"] = True
+        resultado["reintentar_en"] = max(r["reintentar_en"] for r in reintentables)
+        resultado.setdefault("error", f"Páginas con error transitorio: {len(reintentables)} de {len(paginas)}")
+    return resultado
+
+
+def _guardar_multipagina_en_cache(claves: dict, resultado: dict):
+    """Cachea un PDF multipágina sólo si salieron todas las páginas."""
+    if all(pagina["success"] for pagina in resultado["paginas"]):
+        _guardar_en_cache(claves, resultado, VERSION_EXTRACCION_MULTIPAGINA)
+
+
+def extraer_comprobantes_pdf(pdf_base64: str) -> dict:
+    """
+    Extrae un comprobante por página de un PDF (sincrónico).
+    
+    Las páginas se generan de a una y se envían al modelo en paralelo, con
+    hasta OPENAI_MAX_CONCURRENCY páginas en vuelo.
+    
+    Args:
+        pdf_base64: PDF codificado en base64
         
+    Returns:
+        Dict con "success", "transferencias" (datos de cada página exitosa),
+        "paginas" (estado y tiempos por página) y "tiempo_total_ms"
+    """
+    inicio = time.perf_counter()
+    try:
+        contenido, hash_contenido = _decodificar(pdf_base64)
     except Exception as e:
-        return {
-            "success": False,
-            "error": str(e),
-            "data": None
-        }
+        return _resultado_error(f"Archivo base64 inválido: {e}")
+    return extraer_comprobantes_pdf_bytes(contenido, hash_contenido, inicio)
 
 
-def _parsear_respuesta_json(content: str) -> dict:
+def extraer_comprobantes_pdf_bytes(
+    contenido: bytes,
+    hash_contenido: Optional[str] = None,
+    inicio: Optional[float] = None
+) -> dict:
+    """Igual que extraer_comprobantes_pdf pero con el PDF en binario."""
+    inicio = inicio or time.perf_counter()
+    hash_contenido = hash_contenido or calcular_hash_bytes(contenido)
+    return get_single_flight().ejecutar(
+        f"{VERSION_EXTRACCION_MULTIPAGINA}:{hash_contenido}",
+        lambda: _extraer_paginas(contenido, hash_contenido, inicio)
+    )
+
+
+def _extraer_paginas(contenido: bytes, hash_contenido: str, inicio: float) -> dict:
+    """Extracción multipágina de un PDF ya decodificado (ver extraer_comprobantes_pdf)."""
+    claves, cacheado = _consultar_cache(
+        contenido, "application/pdf", VERSION_EXTRACCION_MULTIPAGINA, hash_contenido
+    )
+    if cacheado is not None:
+        return cacheado
+    
+    try:
+        total = _contar_paginas_pdf(contenido)
+    except Exception as e:
+        return _resultado_error(f"Error al leer el PDF: {e}")
+    
+    # La ventana limita las páginas renderizadas en memoria a las que están en vuelo
+    ventana = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+    futuros = []
+    with ThreadPoolExecutor(max_workers=OPENAI_MAX_CONCURRENCY, thread_name_prefix="extractor-pagina") as pool:
+        generador = _iterar_paginas_pdf(contenido, total)
+        while True:
+            ventana.acquire()
+            pagina = next(generador, None)
+            if pagina is None:
+                ventana.release()
+                break
+            futuro = pool.submit(_extraer_pagina, pagina)
+            futuro.add_done_callback(lambda _: ventana.release())
+            futuros.append(futuro)
+    
+    resultado = _resultado_multipagina([f.result() for f in futuros], inicio)
+    _guardar_multipagina_en_cache(claves, resultado)
+    return resultado
+
+
+async def extraer_comprobantes_pdf_async(pdf_base64: str) -> dict:
     """
-    Parsea la respuesta del modelo intentando extraer JSON válido.
+    Variante asíncrona de extraer_comprobantes_pdf.
+    
+    El generador de páginas avanza en el pool de hilos de CPU y cada página
+    se envía al modelo apenas está lista, bajo el mismo semáforo global que
+    el resto de las extracciones.
     """
-    # Intentar parsear directamente
+    inicio = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        contenido, hash_contenido = await loop.run_in_executor(_cpu_executor, _decodificar, pdf_base64)
+    except Exception as e:
+        return _resultado_error(f"Archivo base64 inválido: {e}")
+    return await extraer_comprobantes_pdf_bytes_async(contenido, hash_contenido, inicio)
+
+
+async def extraer_comprobantes_pdf_bytes_async(
+    contenido: bytes,
+    hash_contenido: Optional[str] = None,
+    inicio: Optional[float] = None
+) -> dict:
+    """Variante asíncrona de extraer_comprobantes_pdf_bytes."""
+    inicio = inicio or time.perf_counter()
+    if hash_contenido is None:
+        loop = asyncio.get_running_loop()
+        hash_contenido = await loop.run_in_executor(_cpu_executor, calcular_hash_bytes, contenido)
+    return await get_single_flight().ejecutar_async(
+        f"{VERSION_EXTRACCION_MULTIPAGINA}:{hash_contenido}",
+        lambda: _extraer_paginas_async(contenido, hash_contenido, inicio)
+    )
+
+
+async def _extraer_paginas_async(contenido: bytes, hash_contenido: str, inicio: float) -> dict:
+    """Variante asíncrona de _extraer_paginas."""
+    loop = asyncio.get_running_loop()
+    claves, cacheado = await loop.run_in_executor(
+        _cpu_executor, _consultar_cache, contenido, "application/pdf", VERSION_EXTRACCION_MULTIPAGINA, hash_contenido
+    )
+    if cacheado is not None:
+        return cacheado
+    
     try:
-        return json.loads(content)
-    except json.JSONDecodeError:
-        pass
-    
-    # Buscar JSON dentro del texto
-    import re
-    json_match = re.search(r'\{[\s\S]*\}', content)
-    if json_match:
+        total = await loop.run_in_executor(_cpu_executor, _contar_paginas_pdf, contenido)
+    except Exception as e:
+        return _resultado_error(f"Error al leer el PDF: {e}")
+    
+    ventana = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    generador = _iterar_paginas_pdf(contenido, total)
+    tareas = []
+    
+    async def _procesar(pagina: dict) -> dict:
         try:
-            return json.loads(json_match.group())
-        except json.JSONDecodeError:
-            pass
+            return await _extraer_pagina_async(pagina)
+        finally:
+            ventana.release()
     
-    # Retornar estructura vacía si no se puede parsear
-    return {
-        "emisor_nombre": "",
-        "emisor_cuil": "",
-        "emisor_cbu": "",
-        "banco_emisor": "",
-        "receptor_nombre": "",
-        "receptor_cuil": "",
-        "receptor_cbu": "",
-        "banco_receptor": "",
-        "monto": "",
-        "fecha_operacion": "",
-        "referencia": "",
-        "concepto": "",
-        "confianza": 0.0
-    }
+    while True:
+        await ventana.acquire()
+        pagina = await loop.run_in_executor(_cpu_executor, next, generador, None)
+        if pagina is None:
+            ventana.release()
+            break
+        tareas.append(asyncio.create_task(_procesar(pagina)))
+    
+    resultado = _resultado_multipagina(list(await asyncio.gather(*tareas)), inicio)
+    _guardar_multipagina_en_cache(claves, resultado)
+    return resultado
+
+
+def _parsear_respuesta_json(content: str) -> dict:
+    """
+    Parsea la respuesta del modelo validándola contra el esquema.
+    
+    Raises:
+        RespuestaInvalida: si no es JSON válido o no cumple el esquema
+    """
+    return validar_respuesta(content)
 
 
 def _validar_y_enriquecer(datos: dict) -> dict:
@@ -0,0 +1,175 @@
+"""
+Preprocesamiento de imágenes antes de enviarlas a GPT-4o Vision.
+Rota según EXIF, recorta bordes uniformes, reduce la resolución a lo que el
+modelo realmente usa y recomprime en JPEG. Menos bytes para subir y menos
+tiles de imagen para pagar.
+"""
+import io
+import logging
+import math
+from typing import Tuple
+
+from app.config import PREPROCESS_ENABLED, PREPROCESS_SHORT_SIDE, PREPROCESS_JPEG_QUALITY
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    Image = None
+    ImageChops = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Tolerancia (0-255) para considerar un píxel igual al color del borde
+TOLERANCIA_BORDE = 12
+# Margen que se deja alrededor del contenido al recortar
+MARGEN_RECORTE = 16
+# Reducción extra máxima aceptada para ahorrar una fila/columna de tiles
+ESCALA_MINIMA_TILES = 0.85
+
+
+# Tokens por imagen de cada modelo: (fijos, por tile de 512 px). gpt-4o-mini
+# cobra la imagen ~33 veces más tokens a un precio ~17 veces menor
+TOKENS_IMAGEN = {
+    "gpt-4o": (85, 170),
+    "gpt-4o-mini": (2833, 5667),
+    "gpt-4.1": (85, 170)
+}
+
+
+def estimar_tokens_imagen(ancho: int, alto: int, modelo: str = "gpt-4o", detalle: str = "high") -> int:
+    """
+    Estima los tokens que cobra OpenAI por una imagen.
+
+    Con detail "low" se cobran sólo los tokens fijos. Con "high" el modelo
+    escala la imagen para que entre en 2048x2048, luego lleva el lado corto
+    a 768 px y cobra los tokens fijos más un monto por cada tile de 512 px.
+    Los modelos sin valores conocidos se estiman como gpt-4o.
+    """
+    if ancho <= 0 or alto <= 0:
+        return 0
+    fijos, por_tile = TOKENS_IMAGEN.get(modelo, TOKENS_IMAGEN["gpt-4o"])
+    if detalle == "low":
+        return fijos
+    escala = min(1.0, 2048 / max(ancho, alto))
+    ancho, alto = ancho * escala, alto * escala
+    escala = min(1.0, 768 / min(ancho, alto))
+    ancho, alto = ancho * escala, alto * escala
+    tiles = math.ceil(ancho / 512) * math.ceil(alto / 512)
+    return fijos + por_tile * tiles
+
+
+def _tamano_objetivo(ancho: int, alto: int) -> Tuple[int, int]:
+    """
+    Calcula el tamaño final: lado corto como máximo PREPROCESS_SHORT_SIDE y,
+    si con una reducción chica entra en menos tiles de 512 px, la aplica.
+    """
+    escala = min(1.0, PREPROCESS_SHORT_SIDE / min(ancho, alto))
+    ancho, alto = ancho * escala, alto * escala
+
+    lado_largo = max(ancho, alto)
+    limite_tiles = math.floor(lado_largo / 512) * 512
+    if limite_tiles and limite_tiles < lado_largo and limite_tiles / lado_largo >= ESCALA_MINIMA_TILES:
+        factor = limite_tiles / lado_largo
+        ancho, alto = ancho * factor, alto * factor
+
+    return max(1, math.floor(ancho)), max(1, math.floor(alto))
+
+
+def _recortar_bordes(img: "Image.Image") -> "Image.Image":
+    """Recorta bordes de color uniforme (tomando el color de la esquina)."""
+    fondo = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    diferencia = ImageChops.difference(img, fondo).convert("L")
+    bbox = diferencia.point(lambda p: 255 if p > TOLERANCIA_BORDE else 0).getbbox()
+    if not bbox:
+        return img
+    izq, arriba, der, abajo = bbox
+    bbox = (
+        max(0, izq - MARGEN_RECORTE),
+        max(0, arriba - MARGEN_RECORTE),
+        min(img.width, der + MARGEN_RECORTE),
+        min(img.height, abajo + MARGEN_RECORTE)
+    )
+    if bbox == (0, 0, img.width, img.height):
+        return img
+    return img.crop(bbox)
+
+
+def preprocesar_imagen(imagen_bytes: bytes, mime_type: str) -> Tuple[bytes, str, dict]:
+    """
+    Prepara una imagen para el modelo.
+
+    Args:
+        imagen_bytes: Bytes de la imagen original
+        mime_type: Tipo MIME de la imagen original
+
+    Returns:
+        Tuple (bytes_a_enviar, mime_type, estadisticas). Si el preprocesamiento
+        está deshabilitado o falla, devuelve la imagen original.
+    """
+    estadisticas = {
+        "aplicado": False,
+        "bytes_originales": len(imagen_bytes),
+        "bytes_enviados": len(imagen_bytes)
+    }
+    if not PREPROCESS_ENABLED or not PIL_AVAILABLE:
+        return imagen_bytes, mime_type, estadisticas
+
+    try:
+        img = Image.open(io.BytesIO(imagen_bytes))
+        tamano_original = img.size
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        # Recortar bordes, salvo que el cambio de proporción cueste más tiles
+        recortada = _recortar_bordes(img)
+        tokens_recortada = estimar_tokens_imagen(*_tamano_objetivo(*recortada.size))
+        if tokens_recortada <= estimar_tokens_imagen(*_tamano_objetivo(*img.size)):
+            img = recortada
+
+        # Llevar la imagen al tamaño más chico que el modelo aprovecha
+        nuevo = _tamano_objetivo(*img.size)
+        if nuevo != img.size:
+            img = img.resize(nuevo, Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=PREPROCESS_JPEG_QUALITY, optimize=True)
+        procesada = buffer.getvalue()
+    except Exception as e:
+        logger.warning(f"No se pudo preprocesar la imagen, se envía original: {e}")
+        return imagen_bytes, mime_type, estadisticas
+
+    tokens_originales = estimar_tokens_imagen(*tamano_original)
+    tokens_enviados = estimar_tokens_imagen(*img.size)
+
+    # Si no se ganó nada (imagen ya chica y liviana) se manda la original
+    if len(procesada) >= len(imagen_bytes) and img.size == tamano_original:
+        estadisticas.update({
+            "tamano_original": list(tamano_original),
+            "tamano_enviado": list(tamano_original),
+            "tokens_estimados_originales": tokens_originales,
+            "tokens_estimados_enviados": tokens_originales,
+            "tokens_ahorrados": 0,
+            "bytes_ahorrados": 0
+        })
+        return imagen_bytes, mime_type, estadisticas
+
+    estadisticas.update({
+        "aplicado": True,
+        "bytes_enviados": len(procesada),
+        "tamano_original": list(tamano_original),
+        "tamano_enviado": list(img.size),
+        "tokens_estimados_originales": tokens_originales,
+        "tokens_estimados_enviados": tokens_enviados,
+        "tokens_ahorrados": tokens_originales - tokens_enviados,
+        "bytes_ahorrados": len(imagen_bytes) - len(procesada)
+    })
+    logger.info(
+        f"Imagen preprocesada: {tamano_original[0]}x{tamano_original[1]} -> "
+        f"{img.width}x{img.height}, {len(imagen_bytes)} -> {len(procesada)} bytes, "
+        f"~{estadisticas['tokens_ahorrados']} tokens ahorrados"
+    )
+    return procesada, "image/jpeg", estadisticas
@@ -0,0 +1,251 @@
+"""
+Cola persistente de trabajos de procesamiento (API asíncrona /jobs).
+
+El cliente envía el comprobante y recibe un job_id al instante; un pool de
+workers de la API lo procesa y el resultado se consulta con GET /jobs/{id}
+o llega por callback. La cola vive en SQLite, así que los trabajos
+pendientes sobreviven a un reinicio: al arrancar, los que quedaron
+"procesando" vuelven a "pendiente".
+
+El mismo archivo enviado dos veces por el mismo remitente devuelve el job_id
+del primer trabajo mientras éste no haya fallido (reenvíos por timeout del
+cliente), en lugar de procesarlo y guardarlo dos veces.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+from app.config import JOBS_MAX_ATTEMPTS, JOBS_RETENTION_DAYS
+from app.paths import get_jobs_db_path
+
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+
+# Cada cuántos trabajos terminados se borran los vencidos
+LIMPIEZA_CADA = 100
+
+
+def calcular_clave_trabajo(file_base64: str, sender_phone: str = "") -> str:
+    """Clave de idempotencia: mismo archivo del mismo remitente."""
+    return hashlib.sha256(f"{sender_phone}\n{file_base64}".encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """Cola de trabajos en SQLite, segura entre hilos."""
+
+    def __init__(self, db_path: Optional[str] = None, max_intentos: int = JOBS_MAX_ATTEMPTS):
+        """
+        Args:
+            db_path: Ruta al archivo SQLite (default: data/jobs.db)
+            max_intentos: Intentos por trabajo ante errores transitorios
+        """
+        self.db_path = db_path or get_jobs_db_path()
+        self.max_intentos = max_intentos
+        self._terminados = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._inicializar()
+
+    def _inicializar(self):
+        """Crea la tabla si no existe."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id TEXT PRIMARY KEY,
+                    clave TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    pedido TEXT,
+                    callback_url TEXT,
+                    callback_estado TEXT,
+                    resultado TEXT,
+                    error TEXT,
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    creado REAL NOT NULL,
+                    disponible_desde REAL NOT NULL,
+                    iniciado REAL,
+                    terminado REAL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_trabajos_cola ON trabajos (estado, disponible_desde)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_clave ON trabajos (clave)")
+            self._conn.commit()
+
+    def recuperar_interrumpidos(self) -> int:
+        """Vuelve a la cola los trabajos que quedaron a medias (reinicio de la API)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE trabajos SET estado = ?, iniciado = NULL WHERE estado = ?",
+                (PENDIENTE, PROCESANDO)
+            )
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Cola de trabajos: {cursor.rowcount} trabajos interrumpidos vuelven a la cola")
+        return cursor.rowcount
+
+    def encolar(self, pedido: dict, clave: str, callback_url: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Agrega un trabajo a la cola.
+
+        Args:
+            pedido: Datos del request (se guardan hasta que termina)
+            clave: Clave de idempotencia (calcular_clave_trabajo)
+            callback_url: URL a la que se avisa el resultado (opcional)
+
+        Returns:
+            Tuple (job_id, existente). existente=True si ya había un trabajo
+            vigente para la misma clave y no se encoló otro
+        """
+        ahora = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM trabajos WHERE clave = ? AND estado != ? ORDER BY creado DESC LIMIT 1",
+                (clave, FALLIDO)
+            ).fetchone()
+            if row is not None:
+                return row["id"], True
+
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO trabajos (id, clave, estado, pedido, callback_url, creado, disponible_desde) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, clave, PENDIENTE, json.dumps(pedido, ensure_ascii=False), callback_url, ahora, ahora)
+            )
+            self._conn.commit()
+        return job_id, False
+
+    def tomar(self) -> Optional[dict]:
+        """
+        Toma el trabajo pendiente más antiguo que ya esté disponible.
+
+        Returns:
+            Dict con "id", "pedido", "callback_url" e "intentos", o None si no hay
+        """
+        ahora = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, pedido, callback_url, intentos FROM trabajos "
+                "WHERE estado = ? AND disponible_desde <= ? ORDER BY disponible_desde, creado LIMIT 1",
+                (PENDIENTE, ahora)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE trabajos SET estado = ?, iniciado = ?, intentos = intentos + 1 WHERE id = ?",
+                (PROCESANDO, ahora, row["id"])
+            )
+            self._conn.commit()
+        return {
+            "id": row["id"],
+            "pedido": json.loads(row["pedido"]),
+            "callback_url": row["callback_url"],
+            "intentos": row["intentos"] + 1
+        }
+
+    def completar(self, job_id: str, resultado: dict):
+        """Guarda el resultado y libera el pedido (el archivo ya no hace falta)."""
+        self._terminar(job_id, COMPLETADO, resultado=resultado)
+
+    def fallar(self, job_id: str, error: str):
+        """Marca el trabajo como fallido definitivamente."""
+        self._terminar(job_id, FALLIDO, error=error)
+
+    def reintentar(self, job_id: str, error: str, demora_segundos: float) -> bool:
+        """
+        Devuelve el trabajo a la cola después de un error transitorio.
+
+        Returns:
+            True si se reencoló, False si agotó los intentos (queda fallido)
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT intentos FROM trabajos WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row["intentos"] < self.max_intentos:
+                self._conn.execute(
+                    "UPDATE trabajos SET estado = ?, error = ?, disponible_desde = ?, iniciado = NULL WHERE id = ?",
+                    (PENDIENTE, error, time.time() + demora_segundos, job_id)
+                )
+                self._conn.commit()
+                return True
+        self.fallar(job_id, error)
+        return False
+
+    def _terminar(self, job_id: str, estado: str, resultado: Optional[dict] = None, error: Optional[str] = None):
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE trabajos SET estado = ?, resultado = ?, error = ?, terminado = ?, pedido = NULL WHERE id = ?",
+                (estado, json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                 error, ahora, job_id)
+            )
+            self._conn.commit()
+            self._terminados += 1
+            if self._terminados % LIMPIEZA_CADA == 0:
+                self._limpiar(ahora)
+
+    def _limpiar(self, ahora: float):
+        """Borra los trabajos terminados hace más de JOBS_RETENTION_DAYS."""
+        cursor = self._conn.execute(
+            "DELETE FROM trabajos WHERE estado IN (?, ?) AND terminado < ?",
+            (COMPLETADO, FALLIDO, ahora - JOBS_RETENTION_DAYS * 86400)
+        )
+        self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Cola de trabajos: {cursor.rowcount} trabajos vencidos eliminados")
+
+    def registrar_callback(self, job_id: str, estado_callback: str):
+        """Guarda cómo terminó el aviso al callback ("ok" o el error)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE trabajos SET callback_estado = ? WHERE id = ?", (estado_callback, job_id)
+            )
+            self._conn.commit()
+
+    def obtener(self, job_id: str) -> Optional[dict]:
+        """Estado público de un trabajo (sin el archivo), o None si no existe."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, estado, resultado, error, intentos, creado, iniciado, terminado, "
+                "callback_url, callback_estado FROM trabajos WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        trabajo = dict(row)
+        trabajo["resultado"] = json.loads(trabajo["resultado"]) if trabajo["resultado"] else None
+        return trabajo
+
+    def obtener_estadisticas(self) -> dict:
+        """Cantidad de trabajos por estado."""
+        with self._lock:
+            rows = self._conn.execute("SELECT estado, COUNT(*) FROM trabajos GROUP BY estado").fetchall()
+        conteo = {PENDIENTE: 0, PROCESANDO: 0, COMPLETADO: 0, FALLIDO: 0}
+        conteo.update({estado: cantidad for estado, cantidad in rows})
+        return conteo
+
+
+# Instancia global para uso compartido
+_queue_instance: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Obtiene la instancia global de la cola de trabajos."""
+    global _queue_instance
+    with _queue_lock:
+        if _queue_instance is None:
+            _queue_instance = JobQueue()
+    return _queue_instance
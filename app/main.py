@@ -2,21 +2,53 @@
 API FastAPI para procesamiento de comprobantes de transferencias bancarias.
 Punto de entrada principal del sistema.
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
+from typing import List, Optional
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import hashlib
+import ipaddress
 import logging
+import mimetypes
+import socket
+import tempfile
+import time
+from urllib.parse import urlsplit
 
-from app.extractor import extraer_datos_comprobante
-from storage.storage_manager import guardar_transferencia
-from app.sheets import verificar_conexion  # Mantener por retrocompatibilidad o actualizar
-from app.config import MIN_CONFIDENCE
+import httpx
+
+from app.extractor import (
+    extraer_datos_comprobante_async, extraer_comprobantes_pdf_async,
+    extraer_datos_comprobante_bytes_async, extraer_comprobantes_pdf_bytes_async
+)
+from storage.storage_manager import guardar_transferencia, guardar_transferencias, verificar_sheets
+from app.config import (
+    MIN_CONFIDENCE, PDF_MULTIPAGE, JOBS_WORKERS, JOBS_CALLBACK_TIMEOUT, BATCH_MAX_ITEMS,
+    UPLOAD_MAX_BYTES, UPLOAD_SPOOL_BYTES, JOBS_CALLBACK_SCHEMES, JOBS_CALLBACK_HOSTS
+)
 from billing.cost_tracker import CostTracker
+from app.model_router import get_router_stats
+from app.extraction_cache import get_extraction_cache
+from app.single_flight import get_single_flight
+from app.resilience import get_circuito, get_limitador
+from app.receipt_filter import get_prefiltro_stats
+from app.job_queue import get_job_queue, calcular_clave_trabajo
+from app.metrics import get_metricas, registrar_error, EN_PROCESO
+from app.auth import requerir_autenticacion
+from app.admission import get_control_admision, Sobrecarga
+from storage.excel_storage import get_pending_count
+from storage.sheets_queue import (
+    get_sheets_pending_count, get_sheets_dead_letter_count, obtener_estadisticas_colas
+)
 import json
 import os
-from app.paths import resolve_appdata_path
 import shutil
 from app.paths import get_config_path, get_resource_dir
 
@@ -55,11 +87,123 @@ def cargar_config() -> dict:
 CONFIG = cargar_config()
 COST_TRACKER = CostTracker(markup=CONFIG.get('billing', {}).get('markup', 2.0))
 
+# Executor para Excel/Sheets/billing: un solo hilo para que las escrituras
+# a disco queden serializadas y no bloqueen el event loop
+_storage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+
+
+async def _en_storage(fn, *args, **kwargs):
+    """Ejecuta una función bloqueante de almacenamiento en el executor dedicado."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_storage_executor, partial(fn, *args, **kwargs))
+
+
+# Métricas de la API (además de las etapas que miden extractor, storage y billing)
+PROCESAMIENTO = get_metricas().histograma(
+    "comprobantes_procesamiento_segundos",
+    "Duración total de /process-receipt/ por resultado",
+    ("resultado",)
+)
+get_metricas().medidor(
+    "almacenamiento_cola",
+    "Escrituras esperando el executor de almacenamiento",
+    lambda: _storage_executor._work_queue.qsize()
+)
+get_metricas().medidor(
+    "trabajos_pendientes",
+    "Trabajos pendientes en la cola de /jobs",
+    lambda: get_job_queue().obtener_estadisticas()["pendiente"]
+)
+get_metricas().medidor(
+    "extracciones_en_vuelo",
+    "Extracciones distintas en curso (single-flight)",
+    lambda: get_single_flight().obtener_estadisticas()["en_vuelo"]
+)
+get_metricas().medidor(
+    "excel_filas_pendientes",
+    "Filas agregadas al Excel que todavía no se guardaron en disco",
+    get_pending_count
+)
+get_metricas().medidor(
+    "sheets_filas_pendientes",
+    "Filas encoladas que todavía no llegaron a Google Sheets",
+    get_sheets_pending_count
+)
+get_metricas().medidor(
+    "sheets_filas_descartadas",
+    "Filas que Google Sheets rechazó con un error permanente (no se reintentan)",
+    get_sheets_dead_letter_count
+)
+get_metricas().medidor(
+    "openai_circuito_abierto",
+    "1 si el circuit breaker de OpenAI no está cerrado",
+    lambda: 0 if get_circuito().obtener_estado()["estado"] == "cerrado" else 1
+)
+
+
+get_metricas().medidor(
+    "admision_en_cola",
+    "Comprobantes esperando un cupo de procesamiento (todas las fuentes)",
+    lambda: sum(get_control_admision().obtener_estado()["en_cola"].values())
+)
+get_metricas().medidor(
+    "admision_en_vuelo",
+    "Cupos de procesamiento en uso (API y carpeta)",
+    lambda: get_control_admision().obtener_estado()["en_vuelo"]
+)
+
+
+def _error_sobrecarga(error: Sobrecarga) -> HTTPException:
+    """429 con Retry-After calculado con el ritmo actual de procesamiento."""
+    registrar_error("admision", error.fuente)
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.reintentar_en)}
+    )
+
+
+def _clase_error(resultado: dict) -> str:
+    """Clase de una extracción fallida, para comprobantes_errores_total."""
+    if resultado.get("reintentable"):
+        return "openai_transitorio"
+    if resultado.get("metodo") == "prefiltro":
+        return "prefiltro"
+    return "extraccion_fallida"
+
+
+# Executor para la cola de trabajos (SQLite) y los workers que la consumen
+_jobs_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+_workers_trabajos: List[asyncio.Task] = []
+_callbacks_pendientes: set = set()
+_hay_trabajos: Optional[asyncio.Event] = None
+
+# Segundos que un worker espera antes de volver a mirar la cola (trabajos reencolados con demora)
+INTERVALO_COLA_SEGUNDOS = 1.0
+# Intentos de aviso al callback_url de un trabajo
+INTENTOS_CALLBACK = 3
+
+
+async def _en_jobs(fn, *args, **kwargs):
+    """Ejecuta una operación de la cola de trabajos en su executor dedicado."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_jobs_executor, partial(fn, *args, **kwargs))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca los workers de la cola de trabajos y los detiene al cerrar."""
+    await _iniciar_workers_trabajos()
+    yield
+    await _detener_workers_trabajos()
+
+
 # Crear app FastAPI
 app = FastAPI(
     title="Receipt Processing API",
     description="API profesional para procesar comprobantes de transferencias bancarias argentinas",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS para permitir requests desde n8n
@@ -71,6 +215,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Rutas sin autenticación (raíz, health check y métricas) y con X-API-Key
+# (todo lo demás). Se montan en /api/v1 y, por compatibilidad, en las rutas
+# históricas sin prefijo que usan n8n y los scripts de prueba
+API_V1 = "/api/v1"
+publico = APIRouter()
+protegido = APIRouter(dependencies=[Depends(requerir_autenticacion)])
+
 
 # Modelos de request/response
 class ProcessReceiptRequest(BaseModel):
@@ -80,6 +231,7 @@ class ProcessReceiptRequest(BaseModel):
     timestamp: str = ""  # Timestamp de recepción
     mime_type: str = "image/jpeg"  # Tipo MIME del archivo
     texto_completo: str = ""  # Texto OCR previo (opcional)
+    multipagina: Optional[bool] = None  # PDF con un comprobante por página (default: config)
 
 
 class ProcessReceiptResponse(BaseModel):
@@ -91,6 +243,26 @@ class ProcessReceiptResponse(BaseModel):
     confianza: float = 0.0
     requiere_revision: bool = False
     costo_usd: Optional[float] = None
+    transferencias: Optional[List[dict]] = None  # Modo multipágina: una por página
+    paginas: Optional[List[dict]] = None  # Modo multipágina: estado y tiempos por página
+
+
+class SubmitJobRequest(ProcessReceiptRequest):
+    """Request para encolar un comprobante (procesamiento asíncrono)"""
+    callback_url: Optional[str] = None  # URL a la que se avisa el resultado (POST JSON)
+
+
+class JobResponse(BaseModel):
+    """Estado de un trabajo de la cola"""
+    job_id: str
+    estado: str  # pendiente | procesando | completado | fallido
+    existente: bool = False  # True si el archivo ya estaba encolado y se devolvió ese trabajo
+    intentos: int = 0
+    resultado: Optional[dict] = None  # ProcessReceiptResponse cuando está completado
+    error: Optional[str] = None
+    creado: Optional[str] = None
+    terminado: Optional[str] = None
+    callback_estado: Optional[str] = None
 
 
 class HealthResponse(BaseModel):
@@ -99,9 +271,12 @@ class HealthResponse(BaseModel):
     sheets_connection: bool
     timestamp: str
     storage_config: dict
+    openai_circuito: Optional[dict] = None  # Estado del circuit breaker de OpenAI
+    sheets_sesion: Optional[dict] = None  # Sesión de Google Sheets reutilizada
+    sheets_colas: Optional[List[dict]] = None  # Pendientes y descartadas por hoja
 
 
-@app.get("/", response_model=dict)
+@publico.get("/", response_model=dict)
 async def root():
     """Endpoint raíz"""
     return {
@@ -111,57 +286,252 @@ async def root():
     }
 
 
-@app.get("/health", response_model=HealthResponse)
-async def health_check():
+@publico.get("/health", response_model=HealthResponse)
+def health_check():
     """Verifica el estado del servicio y conexiones"""
     # Verificar Sheet solo si está habilitado
     sheets_status = {"success": False}
     if CONFIG.get("storage", {}).get("sheets_enabled"):
         try:
-            from storage.sheets_storage import verificar_conexion_sheets
-            sheets_status = verificar_conexion_sheets(
-                resolve_appdata_path(CONFIG.get("google_credentials_path", "")),
-                CONFIG.get("storage", {}).get("sheets_id", ""),
-                CONFIG.get("storage", {}).get("sheets_name", "Hoja 1")
-            )
+            sheets_status = verificar_sheets(CONFIG)
         except Exception:
             pass
 
+    circuito = get_circuito().obtener_estado()
     return HealthResponse(
-        status="healthy",
+        status="healthy" if circuito["estado"] == "cerrado" else "degraded",
         sheets_connection=sheets_status.get("success", False),
+        sheets_sesion=sheets_status.get("sesion"),
+        sheets_colas=obtener_estadisticas_colas(),
         timestamp=datetime.now().isoformat(),
-        storage_config=CONFIG.get("storage", {})
+        storage_config=CONFIG.get("storage", {}),
+        openai_circuito=dict(circuito, limites=get_limitador().obtener_estado())
     )
 
 
-@app.post("/process-receipt/", response_model=ProcessReceiptResponse)
+def _error_reintentable(resultado: dict) -> HTTPException:
+    """
+    503 con Retry-After para errores transitorios de OpenAI (rate limit, 5xx,
+    circuito abierto): el cliente debe reintentar más tarde, no darlo por fallido.
+    """
+    return HTTPException(
+        status_code=503,
+        detail=f"OpenAI no disponible temporalmente: {resultado.get('error')}",
+        headers={"Retry-After": str(resultado.get("reintentar_en", 1))}
+    )
+
+
+def _fuente(request: ProcessReceiptRequest) -> str:
+    """Fuente del comprobante para billing y para la cola de admisión."""
+    return "whatsapp" if request.sender_phone else "api"
+
+
+def _es_multipagina(request: ProcessReceiptRequest) -> bool:
+    """Indica si el archivo se procesa como PDF con un comprobante por página."""
+    if not request.mime_type.endswith("pdf"):
+        return False
+    return PDF_MULTIPAGE if request.multipagina is None else request.multipagina
+
+
+def _registrar_costos_paginas(transferencias: list, paginas: list, exito: bool, fuente: str) -> float:
+    """Registra en billing cada página extraída. Retorna el costo mostrado total."""
+    usos = {pagina["pagina"]: pagina.get("uso") for pagina in paginas}
+    costo = 0.0
+    for datos in transferencias:
+        registro = COST_TRACKER.registrar_procesamiento(
+            archivo=f"api_upload#p{datos.get('pagina')}",
+            exito=exito,
+            monto_extraido=datos.get("monto_numerico"),
+            emisor=datos.get("emisor_nombre"),
+            fuente=fuente,
+            uso=usos.get(datos.get("pagina"))
+        )
+        costo += registro.get("costo_mostrado_usd", 0.0)
+    for pagina in paginas:
+        if not pagina["success"]:
+            COST_TRACKER.registrar_procesamiento(
+                archivo=f"api_upload#p{pagina['pagina']}",
+                exito=False,
+                fuente=fuente,
+                uso=pagina.get("uso")
+            )
+    return round(costo, 4)
+
+
+def _respuesta_coalescida(resultado: dict) -> ProcessReceiptResponse:
+    """
+    Respuesta para un archivo idéntico a otro que se estaba procesando en el
+    mismo momento: sólo se comparte la extracción. El guardado y el costo los
+    registra ese otro procesamiento (cuyo resultado no se conoce acá), así
+    que acá no se vuelve a guardar.
+    """
+    datos = resultado.get("data") or {}
+    transferencias = resultado.get("transferencias")
+    confianza = datos.get("confianza", 0) if datos else min((d.get("confianza", 0) for d in transferencias or []), default=0)
+    logger.info("Comprobante idéntico a uno en proceso, no se guarda de nuevo")
+    return ProcessReceiptResponse(
+        success=True,
+        message="Comprobante idéntico a uno que se estaba procesando: se compartió su extracción y no se guarda de nuevo",
+        data=datos or None,
+        confianza=confianza,
+        requiere_revision=confianza < MIN_CONFIDENCE,
+        costo_usd=0.0,
+        transferencias=transferencias,
+        paginas=resultado.get("paginas")
+    )
+
+
+async def _extraer(
+    request: ProcessReceiptRequest,
+    contenido: Optional[bytes] = None,
+    hash_contenido: Optional[str] = None
+) -> dict:
+    """
+    Extrae el comprobante (o las páginas de un PDF multipágina).
+    Con contenido (subida binaria) no se usa request.file_base64.
+    """
+    if contenido is None:
+        if _es_multipagina(request):
+            return await extraer_comprobantes_pdf_async(request.file_base64)
+        return await extraer_datos_comprobante_async(
+            imagen_base64=request.file_base64,
+            mime_type=request.mime_type
+        )
+    if _es_multipagina(request):
+        return await extraer_comprobantes_pdf_bytes_async(contenido, hash_contenido)
+    return await extraer_datos_comprobante_bytes_async(contenido, request.mime_type, hash_contenido)
+
+
+async def _procesar_multipagina(request: ProcessReceiptRequest, resultado: dict) -> ProcessReceiptResponse:
+    """Guarda en un lote las transferencias de un PDF con un comprobante por página."""
+    fuente = "whatsapp" if request.sender_phone else "api"
+    if not resultado.get("success"):
+        registrar_error("extraccion", _clase_error(resultado))
+    # Con alguna página transitoria se reintenta el PDF completo (nada se guarda)
+    if resultado.get("reintentable"):
+        raise _error_reintentable(resultado)
+    if resultado.get("coalescida") and resultado.get("success"):
+        return _respuesta_coalescida(resultado)
+    transferencias = resultado.get("transferencias", [])
+    paginas = resultado.get("paginas", [])
+    
+    if not resultado.get("success"):
+        logger.error(f"Error en extracción multipágina: {resultado.get('error')}")
+        await _en_storage(_registrar_costos_paginas, [], paginas, False, fuente)
+        return ProcessReceiptResponse(
+            success=False,
+            message=f"Error al extraer datos: {resultado.get('error')}",
+            requiere_revision=True,
+            paginas=paginas
+        )
+    
+    timestamp = request.timestamp or datetime.now().isoformat()
+    resultado_guardado = await _en_storage(
+        guardar_transferencias,
+        lista_datos=transferencias,
+        config=CONFIG,
+        whatsapp_from=request.sender_phone,
+        timestamp_recepcion=timestamp
+    )
+    exito_guardado = resultado_guardado.get("success", False)
+    costo = await _en_storage(_registrar_costos_paginas, transferencias, paginas, exito_guardado, fuente)
+    
+    confianza = min(d.get("confianza", 0) for d in transferencias)
+    fallidas = len(paginas) - len(transferencias)
+    logger.info(
+        f"PDF multipágina: {len(transferencias)}/{len(paginas)} páginas extraídas "
+        f"en {resultado.get('tiempo_total_ms')} ms"
+    )
+    return ProcessReceiptResponse(
+        success=exito_guardado,
+        message=resultado_guardado.get("message"),
+        cuenta_destino=", ".join(sorted(set(resultado_guardado.get("cuentas_destino", [])))) or None,
+        confianza=confianza,
+        requiere_revision=confianza < MIN_CONFIDENCE or fallidas > 0 or not exito_guardado,
+        costo_usd=costo,
+        transferencias=transferencias,
+        paginas=paginas
+    )
+
+
+@protegido.post("/process-receipt/", response_model=ProcessReceiptResponse)
 async def process_receipt(request: ProcessReceiptRequest):
     """
     Procesa un comprobante de transferencia bancaria.
     
     Recibe una imagen en base64, extrae los datos usando GPT-4o Vision,
     valida la información y la guarda en los destinos configurados.
+    Con multipagina=true, un PDF se procesa como un comprobante por página.
+    """
+    return await _procesar_comprobante(request)
+
+
+async def _procesar_comprobante(
+    request: ProcessReceiptRequest,
+    contenido: Optional[bytes] = None,
+    hash_contenido: Optional[str] = None
+) -> ProcessReceiptResponse:
     """
+    Extrae, guarda y factura un comprobante. contenido es el archivo en
+    binario cuando llegó por /process-receipt/upload (request.file_base64
+    queda vacío). Espera un cupo del control de admisión (429 si la cola de
+    su fuente está llena) y registra la duración total.
+    """
+    inicio = time.perf_counter()
+    resultado = "error"
+    try:
+        async with get_control_admision().ticket_async(_fuente(request)):
+            EN_PROCESO.inc()
+            try:
+                respuesta = await _extraer_y_guardar(request, contenido, hash_contenido)
+            finally:
+                EN_PROCESO.dec()
+        resultado = "ok" if respuesta.success else "fallido"
+        return respuesta
+    except Sobrecarga as e:
+        resultado = "rechazado"
+        logger.warning(str(e))
+        raise _error_sobrecarga(e)
+    except HTTPException as e:
+        resultado = "reintentable" if e.status_code == 503 else "error"
+        raise
+    finally:
+        PROCESAMIENTO.observar(time.perf_counter() - inicio, resultado)
+
+
+async def _extraer_y_guardar(
+    request: ProcessReceiptRequest,
+    contenido: Optional[bytes],
+    hash_contenido: Optional[str]
+) -> ProcessReceiptResponse:
+    """Cuerpo de _procesar_comprobante."""
     logger.info(f"Procesando comprobante de: {request.sender_phone}")
     
     try:
         # 1. Extraer datos del comprobante usando GPT-4o Vision
-        resultado_extraccion = extraer_datos_comprobante(
-            imagen_base64=request.file_base64,
-            mime_type=request.mime_type
-        )
+        resultado_extraccion = await _extraer(request, contenido, hash_contenido)
+        if _es_multipagina(request):
+            return await _procesar_multipagina(request, resultado_extraccion)
         
         datos = resultado_extraccion.get("data", {})
         confianza = datos.get("confianza", 0) if datos else 0
         
+        if not resultado_extraccion.get("success"):
+            registrar_error("extraccion", _clase_error(resultado_extraccion))
+        
+        if resultado_extraccion.get("reintentable"):
+            logger.warning(f"Error transitorio de OpenAI: {resultado_extraccion.get('error')}")
+            raise _error_reintentable(resultado_extraccion)
+        
         if not resultado_extraccion.get("success"):
             logger.error(f"Error en extracción: {resultado_extraccion.get('error')}")
             # Registrar fallo
-            COST_TRACKER.registrar_procesamiento(
+            await _en_storage(
+                COST_TRACKER.registrar_procesamiento,
                 archivo="api_upload",
                 exito=False,
-                fuente="whatsapp" if request.sender_phone else "api"
+                fuente="whatsapp" if request.sender_phone else "api",
+                uso=resultado_extraccion.get("uso")
             )
             return ProcessReceiptResponse(
                 success=False,
@@ -169,6 +539,9 @@ async def process_receipt(request: ProcessReceiptRequest):
                 requiere_revision=True
             )
         
+        if resultado_extraccion.get("coalescida"):
+            return _respuesta_coalescida(resultado_extraccion)
+        
         # 2. Verificar nivel de confianza
         requiere_revision = confianza < MIN_CONFIDENCE
         
@@ -178,7 +551,8 @@ async def process_receipt(request: ProcessReceiptRequest):
         # 3. Guardar en destinos configurados
         timestamp = request.timestamp or datetime.now().isoformat()
         
-        resultado_guardado = guardar_transferencia(
+        resultado_guardado = await _en_storage(
+            guardar_transferencia,
             datos=datos,
             config=CONFIG,
             whatsapp_from=request.sender_phone,
@@ -188,12 +562,14 @@ async def process_receipt(request: ProcessReceiptRequest):
         exito_guardado = resultado_guardado.get("success", False)
         
         # 4. Registrar costos
-        registro_costo = COST_TRACKER.registrar_procesamiento(
+        registro_costo = await _en_storage(
+            COST_TRACKER.registrar_procesamiento,
             archivo="api_upload",
             exito=exito_guardado,
             monto_extraido=datos.get("monto_numerico"),
             emisor=datos.get("emisor_nombre"),
-            fuente="whatsapp" if request.sender_phone else "api"
+            fuente="whatsapp" if request.sender_phone else "api",
+            uso=resultado_extraccion.get("uso")
         )
         
         if not exito_guardado:
@@ -220,6 +596,8 @@ async def process_receipt(request: ProcessReceiptRequest):
             costo_usd=registro_costo.get("costo_mostrado_usd")
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Error inesperado al procesar comprobante")
         raise HTTPException(
@@ -228,17 +606,562 @@ async def process_receipt(request: ProcessReceiptRequest):
         )
 
 
-@app.post("/extract-only/", response_model=dict)
+@protegido.get("/stats/extraccion", response_model=dict)
+def extraction_stats():
+    """
+    Telemetría de extracción: latencia p50/p95 y costo por nivel de modelo,
+    tasa de escalado, estadísticas del cache, extracciones coalescidas e
+    imágenes descartadas por el prefiltro y estado del control de admisión.
+    """
+    cache = get_extraction_cache()
+    return {
+        "ruteo": get_router_stats().obtener_estadisticas(),
+        "cache": cache.obtener_estadisticas() if cache else None,
+        "coalescencia": get_single_flight().obtener_estadisticas(),
+        "prefiltro": get_prefiltro_stats().obtener_estadisticas(),
+        "admision": get_control_admision().obtener_estado()
+    }
+
+
+@publico.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Métricas en formato de texto de Prometheus: latencia por etapa
+    (decodificación, render de PDF, modelo, validación, Excel, Sheets,
+    acumulador, billing), errores por clase, comprobantes en proceso y
+    colas (trabajos, almacenamiento, Excel bloqueado).
+    """
+    return PlainTextResponse(get_metricas().exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@protegido.post("/extract-only/", response_model=dict)
 async def extract_only(request: ProcessReceiptRequest):
     """
     Solo extrae datos del comprobante sin guardar en Google Sheets.
     Útil para testing y debugging.
     """
-    resultado = extraer_datos_comprobante(
-        imagen_base64=request.file_base64,
-        mime_type=request.mime_type
+    try:
+        async with get_control_admision().ticket_async(_fuente(request)):
+            return await _extraer(request)
+    except Sobrecarga as e:
+        raise _error_sobrecarga(e)
+
+
+# --- Subida binaria (multipart / octet-stream) ---
+
+# Tamaño de bloque al leer una subida
+BLOQUE_SUBIDA = 64 * 1024
+
+
+def _mime_de_archivo(content_type: Optional[str], nombre: Optional[str]) -> str:
+    """MIME declarado por el cliente o, si es genérico, deducido del nombre."""
+    if content_type and content_type != "application/octet-stream":
+        return content_type.split(";")[0].strip()
+    return mimetypes.guess_type(nombre or "")[0] or "image/jpeg"
+
+
+async def _leer_por_bloques(archivo: UploadFile):
+    """Itera un UploadFile de a BLOQUE_SUBIDA bytes."""
+    while True:
+        bloque = await archivo.read(BLOQUE_SUBIDA)
+        if not bloque:
+            break
+        yield bloque
+
+
+async def _recibir_archivo(bloques) -> tuple:
+    """
+    Vuelca una subida a un archivo temporal (en memoria hasta
+    UPLOAD_SPOOL_BYTES, después en disco) mientras calcula su SHA256, así el
+    hash no requiere otra pasada y el tamaño se controla antes de cargar
+    el archivo. Al final se lee completo en memoria, porque el extractor
+    trabaja con bytes: una subida chica convive un momento con su copia en
+    el spool; una grande, sólo con el archivo temporal en disco.
+
+    Returns:
+        Tuple (contenido, sha256)
+
+    Raises:
+        HTTPException 413 si supera UPLOAD_MAX_BYTES
+    """
+    sha256 = hashlib.sha256()
+    total = 0
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES) as spool:
+        async for bloque in bloques:
+            total += len(bloque)
+            if total > UPLOAD_MAX_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Archivo mayor a {UPLOAD_MAX_BYTES // (1024 * 1024)} MB"
+                )
+            sha256.update(bloque)
+            spool.write(bloque)
+        spool.seek(0)
+        contenido = spool.read()
+    if not contenido:
+        raise HTTPException(status_code=400, detail="Archivo vacío")
+    return contenido, sha256.hexdigest()
+
+
+@protegido.post("/process-receipt/upload", response_model=ProcessReceiptResponse)
+async def process_receipt_upload(
+    http_request: Request,
+    sender_phone: str = "",
+    timestamp: str = "",
+    mime_type: str = "",
+    multipagina: Optional[bool] = None
+):
+    """
+    Procesa un comprobante subido en binario, sin base64.
+
+    Acepta multipart/form-data (campo "file", más sender_phone, timestamp,
+    mime_type y multipagina opcionales como campos) o el archivo crudo en el
+    body (application/octet-stream o el MIME del archivo) con esos datos en
+    la query string. Responde lo mismo que /process-receipt/.
+    """
+    content_type = http_request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await http_request.form()
+        archivo = form.get("file")
+        if not isinstance(archivo, UploadFile):
+            raise HTTPException(status_code=400, detail="Falta el campo 'file'")
+        contenido, hash_contenido = await _recibir_archivo(_leer_por_bloques(archivo))
+        sender_phone = str(form.get("sender_phone") or sender_phone)
+        timestamp = str(form.get("timestamp") or timestamp)
+        mime_type = str(form.get("mime_type") or mime_type) or _mime_de_archivo(archivo.content_type, archivo.filename)
+        if form.get("multipagina"):
+            multipagina = str(form.get("multipagina")).lower() in ("1", "true", "si", "sí")
+    else:
+        contenido, hash_contenido = await _recibir_archivo(http_request.stream())
+        mime_type = mime_type or _mime_de_archivo(content_type, None)
+
+    request = ProcessReceiptRequest(
+        file_base64="",
+        sender_phone=sender_phone,
+        timestamp=timestamp,
+        mime_type=mime_type,
+        multipagina=multipagina
+    )
+    return await _procesar_comprobante(request, contenido, hash_contenido)
+
+
+# --- Lote: varios comprobantes por request ---
+
+async def _leer_lote(http_request: Request) -> List[tuple]:
+    """
+    Lee los comprobantes del body: multipart (un archivo por parte, más
+    sender_phone/timestamp/multipagina opcionales como campos de formulario)
+    o NDJSON (un ProcessReceiptRequest por línea).
+
+    Returns:
+        Lista de (nombre_archivo, ProcessReceiptRequest, contenido). En
+        multipart contenido son los bytes del archivo (no se pasa a base64);
+        en NDJSON es None y el archivo viaja en file_base64
+    """
+    content_type = http_request.headers.get("content-type", "")
+    items = []
+    if content_type.startswith("multipart/form-data"):
+        form = await http_request.form()
+        comunes = {
+            "sender_phone": str(form.get("sender_phone") or ""),
+            "timestamp": str(form.get("timestamp") or ""),
+        }
+        if form.get("multipagina"):
+            comunes["multipagina"] = str(form.get("multipagina")).lower() in ("1", "true", "si", "sí")
+        for _, valor in form.multi_items():
+            if not isinstance(valor, UploadFile):
+                continue
+            contenido, _ = await _recibir_archivo(_leer_por_bloques(valor))
+            items.append((valor.filename or f"archivo_{len(items)}", ProcessReceiptRequest(
+                file_base64="",
+                mime_type=_mime_de_archivo(valor.content_type, valor.filename),
+                **comunes
+            ), contenido))
+    else:
+        cuerpo = await http_request.body()
+        for numero, linea in enumerate(cuerpo.splitlines(), start=1):
+            if not linea.strip():
+                continue
+            try:
+                items.append((f"item_{numero}", ProcessReceiptRequest.model_validate_json(linea), None))
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=f"Línea {numero} inválida: {e.errors()}")
+    return items
+
+
+async def _extraer_item(indice: int, request: ProcessReceiptRequest, contenido: Optional[bytes]) -> tuple:
+    """Extrae un comprobante del lote. Nunca lanza: los errores van en el resultado."""
+    try:
+        async with get_control_admision().ticket_async(_fuente(request)):
+            EN_PROCESO.inc()
+            try:
+                resultado = await _extraer(request, contenido)
+            finally:
+                EN_PROCESO.dec()
+    except Sobrecarga as e:
+        registrar_error("admision", e.fuente)
+        resultado = {"success": False, "error": str(e), "reintentable": True, "reintentar_en": e.reintentar_en}
+    except Exception as e:
+        logger.exception(f"Lote: error inesperado en el ítem {indice}")
+        resultado = {"success": False, "error": str(e)}
+    if not resultado.get("success"):
+        registrar_error("extraccion", _clase_error(resultado))
+    return indice, resultado
+
+
+def _linea_item(indice: int, archivo: str, resultado: dict) -> dict:
+    """Resultado de extracción de un ítem, tal como se streamea al cliente."""
+    datos = resultado.get("data") or None
+    transferencias = resultado.get("transferencias")
+    if datos:
+        confianza = datos.get("confianza", 0)
+    else:
+        confianza = min((d.get("confianza", 0) for d in transferencias or []), default=0)
+    linea = {
+        "tipo": "item",
+        "indice": indice,
+        "archivo": archivo,
+        "success": bool(resultado.get("success")),
+        "data": datos,
+        "transferencias": transferencias,
+        "confianza": confianza,
+        "requiere_revision": not resultado.get("success") or confianza < MIN_CONFIDENCE,
+        "error": resultado.get("error"),
+        "coalescida": bool(resultado.get("coalescida"))
+    }
+    if resultado.get("reintentable"):
+        linea["reintentable"] = True
+        linea["reintentar_en"] = resultado.get("reintentar_en", 1)
+    return linea
+
+
+def _registrar_costos_lote(registros: List[dict], exito_guardado: bool) -> float:
+    """Registra en billing cada transferencia o fallo del lote. Retorna el costo mostrado total."""
+    costo = 0.0
+    for registro in registros:
+        exito = registro.pop("guardable") and exito_guardado
+        costo += COST_TRACKER.registrar_procesamiento(exito=exito, **registro).get("costo_mostrado_usd", 0.0)
+    return round(costo, 4)
+
+
+async def _procesar_lote(items: List[tuple]):
+    """
+    Extrae los ítems en paralelo y streamea una línea NDJSON por ítem a medida
+    que terminan; al final guarda todo lo extraído con una sola escritura por
+    destino y cierra con una línea "resumen".
+
+    El lote no pide más cupos de admisión a la vez que el máximo en vuelo,
+    para no llenar por sí solo la cola de su fuente.
+    """
+    ventana = asyncio.Semaphore(get_control_admision().max_en_vuelo)
+
+    async def _extraer_en_ventana(indice: int, request: ProcessReceiptRequest, contenido: Optional[bytes]):
+        async with ventana:
+            return await _extraer_item(indice, request, contenido)
+
+    tareas = [
+        asyncio.create_task(_extraer_en_ventana(i, request, contenido))
+        for i, (_, request, contenido) in enumerate(items)
+    ]
+    a_guardar = []  # (indice, pagina, datos, request)
+    registros = []  # kwargs para COST_TRACKER.registrar_procesamiento
+    try:
+        for siguiente in asyncio.as_completed(tareas):
+            indice, resultado = await siguiente
+            archivo, request, _ = items[indice]
+            yield json.dumps(_linea_item(indice, archivo, resultado), ensure_ascii=False) + "\n"
+
+            fuente = _fuente(request)
+            if resultado.get("reintentable") or (resultado.get("coalescida") and resultado.get("success")):
+                # Se reintenta después / lo guarda el procesamiento idéntico en curso
+                continue
+            if not resultado.get("success"):
+                for pagina in resultado.get("paginas") or [{"uso": resultado.get("uso"), "pagina": None}]:
+                    registros.append({
+                        "archivo": archivo if pagina["pagina"] is None else f"{archivo}#p{pagina['pagina']}",
+                        "fuente": fuente, "uso": pagina.get("uso"), "guardable": False
+                    })
+                continue
+            usos = {p["pagina"]: p.get("uso") for p in resultado.get("paginas", [])}
+            for datos in resultado.get("transferencias") or [resultado.get("data")]:
+                pagina = datos.get("pagina") if resultado.get("transferencias") else None
+                a_guardar.append((indice, pagina, datos, request))
+                registros.append({
+                    "archivo": archivo if pagina is None else f"{archivo}#p{pagina}",
+                    "monto_extraido": datos.get("monto_numerico"),
+                    "emisor": datos.get("emisor_nombre"),
+                    "fuente": fuente,
+                    "uso": usos.get(pagina) if pagina is not None else resultado.get("uso"),
+                    "guardable": True
+                })
+            for pagina in resultado.get("paginas", []):
+                if not pagina["success"]:
+                    registros.append({
+                        "archivo": f"{archivo}#p{pagina['pagina']}",
+                        "fuente": fuente, "uso": pagina.get("uso"), "guardable": False
+                    })
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+
+    resultado_guardado = {"success": False, "message": "No hay transferencias para guardar", "cuentas_destino": []}
+    if a_guardar:
+        ahora = datetime.now().isoformat()
+        resultado_guardado = await _en_storage(
+            guardar_transferencias,
+            lista_datos=[datos for _, _, datos, _ in a_guardar],
+            config=CONFIG,
+            remitentes=[request.sender_phone for _, _, _, request in a_guardar],
+            timestamps=[request.timestamp or ahora for _, _, _, request in a_guardar]
+        )
+    costo = await _en_storage(_registrar_costos_lote, registros, resultado_guardado.get("success", False))
+    logger.info(f"Lote: {len(items)} archivos, {len(a_guardar)} transferencias guardadas")
+    yield json.dumps({
+        "tipo": "resumen",
+        "success": bool(resultado_guardado.get("success")),
+        "message": resultado_guardado.get("message"),
+        "archivos": len(items),
+        "guardadas": [
+            {"indice": indice, "pagina": pagina, "cuenta_destino": cuenta}
+            for (indice, pagina, _, _), cuenta in zip(a_guardar, resultado_guardado.get("cuentas_destino", []))
+        ],
+        "costo_usd": costo
+    }, ensure_ascii=False) + "\n"
+
+
+@protegido.post("/process-receipts/batch")
+async def process_receipts_batch(http_request: Request):
+    """
+    Procesa varios comprobantes en un solo request.
+
+    Acepta multipart/form-data (un archivo por parte) o NDJSON
+    (application/x-ndjson, un ProcessReceiptRequest por línea). Responde
+    NDJSON: una línea por comprobante apenas termina su extracción y una
+    línea final "resumen" después de guardar todo en una sola escritura.
+    """
+    items = await _leer_lote(http_request)
+    if not items:
+        raise HTTPException(status_code=400, detail="El lote no tiene comprobantes")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote tiene {len(items)} comprobantes (máximo {BATCH_MAX_ITEMS})"
+        )
+    logger.info(f"Procesando lote de {len(items)} comprobantes")
+    return StreamingResponse(_procesar_lote(items), media_type="application/x-ndjson")
+
+
+# --- Procesamiento asíncrono: cola de trabajos ---
+
+def _fecha(epoch: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(epoch).isoformat() if epoch else None
+
+
+async def _rechazo_callback(callback_url: str) -> Optional[str]:
+    """
+    Motivo por el que no se acepta un callback_url (None si está permitido).
+
+    Se controla el esquema (jobs.callback_esquemas) y el host: si hay
+    jobs.callback_hosts_permitidos tiene que estar en la lista; si no, tiene
+    que resolver sólo a direcciones públicas (nada de localhost, redes
+    privadas ni metadata del proveedor de nube).
+    """
+    partes = urlsplit(callback_url)
+    if partes.scheme.lower() not in JOBS_CALLBACK_SCHEMES:
+        return f"esquema no permitido ({partes.scheme or 'ninguno'})"
+    host = (partes.hostname or "").lower()
+    if not host:
+        return "la URL no tiene host"
+    if JOBS_CALLBACK_HOSTS:
+        return None if host in JOBS_CALLBACK_HOSTS else f"host no permitido ({host})"
+    try:
+        direcciones = await asyncio.get_running_loop().getaddrinfo(host, partes.port or 443)
+    except (socket.gaierror, ValueError) as e:
+        return f"no se pudo resolver {host} ({e})"
+    for direccion in direcciones:
+        ip = ipaddress.ip_address(direccion[4][0].split("%", 1)[0])
+        if not ip.is_global:
+            return f"{host} resuelve a una dirección interna ({ip})"
+    return None
+
+
+async def _avisar_callback(job_id: str, callback_url: str):
+    """POSTea el estado final del trabajo al callback_url, con reintentos."""
+    cola = get_job_queue()
+    # Se vuelve a controlar al avisar: el DNS pudo cambiar desde que se encoló
+    rechazo = await _rechazo_callback(callback_url)
+    if rechazo:
+        logger.warning(f"Trabajo {job_id}: callback_url rechazado ({rechazo})")
+        await _en_jobs(cola.registrar_callback, job_id, f"rechazado: {rechazo}")
+        return
+    trabajo = await _en_jobs(cola.obtener, job_id)
+    cuerpo = {
+        "job_id": job_id,
+        "estado": trabajo["estado"],
+        "resultado": trabajo["resultado"],
+        "error": trabajo["error"]
+    }
+    estado_callback = "sin_intentar"
+    async with httpx.AsyncClient(timeout=JOBS_CALLBACK_TIMEOUT) as client:
+        for intento in range(INTENTOS_CALLBACK):
+            try:
+                respuesta = await client.post(callback_url, json=cuerpo)
+                if respuesta.status_code < 400:
+                    estado_callback = "ok"
+                    break
+                estado_callback = f"HTTP {respuesta.status_code}"
+            except httpx.HTTPError as e:
+                estado_callback = f"{type(e).__name__}: {e}"
+            if intento < INTENTOS_CALLBACK - 1:
+                await asyncio.sleep(2 ** intento)
+    if estado_callback != "ok":
+        logger.warning(f"Trabajo {job_id}: no se pudo avisar a {callback_url} ({estado_callback})")
+    await _en_jobs(cola.registrar_callback, job_id, estado_callback)
+
+
+async def _ejecutar_trabajo(trabajo: dict):
+    """Procesa un trabajo con el mismo flujo que POST /process-receipt/."""
+    cola = get_job_queue()
+    job_id = trabajo["id"]
+    try:
+        respuesta = await process_receipt(ProcessReceiptRequest(**trabajo["pedido"]))
+    except HTTPException as e:
+        if e.status_code in (429, 503):
+            demora = float((e.headers or {}).get("Retry-After", INTERVALO_COLA_SEGUNDOS))
+            if await _en_jobs(cola.reintentar, job_id, str(e.detail), demora):
+                logger.info(f"Trabajo {job_id}: error transitorio, se reintenta en {demora:.0f}s")
+                return
+        else:
+            await _en_jobs(cola.fallar, job_id, str(e.detail))
+    except Exception as e:
+        logger.exception(f"Trabajo {job_id}: error inesperado")
+        await _en_jobs(cola.fallar, job_id, str(e))
+    else:
+        await _en_jobs(cola.completar, job_id, respuesta.model_dump())
+
+    if trabajo["callback_url"]:
+        tarea = asyncio.create_task(_avisar_callback(job_id, trabajo["callback_url"]))
+        _callbacks_pendientes.add(tarea)
+        tarea.add_done_callback(_callbacks_pendientes.discard)
+
+
+async def _worker_trabajos(numero: int):
+    """Toma trabajos de la cola hasta que se cancela la tarea."""
+    cola = get_job_queue()
+    while True:
+        try:
+            trabajo = await _en_jobs(cola.tomar)
+        except Exception:
+            logger.exception(f"Worker de trabajos {numero}: error leyendo la cola")
+            trabajo = None
+        if trabajo is None:
+            _hay_trabajos.clear()
+            try:
+                await asyncio.wait_for(_hay_trabajos.wait(), timeout=INTERVALO_COLA_SEGUNDOS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await _ejecutar_trabajo(trabajo)
+
+
+async def _iniciar_workers_trabajos():
+    """Recupera los trabajos interrumpidos y arranca JOBS_WORKERS workers."""
+    global _hay_trabajos
+    _hay_trabajos = asyncio.Event()
+    await _en_jobs(get_job_queue().recuperar_interrumpidos)
+    for numero in range(JOBS_WORKERS):
+        _workers_trabajos.append(asyncio.create_task(_worker_trabajos(numero)))
+    logger.info(f"Cola de trabajos: {JOBS_WORKERS} workers iniciados")
+
+
+async def _detener_workers_trabajos():
+    """Cancela los workers; lo que estaba en proceso se retoma al reiniciar."""
+    for tarea in _workers_trabajos + list(_callbacks_pendientes):
+        tarea.cancel()
+    await asyncio.gather(*_workers_trabajos, *_callbacks_pendientes, return_exceptions=True)
+    _workers_trabajos.clear()
+
+
+@protegido.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(request: SubmitJobRequest, response: Response):
+    """
+    Encola un comprobante y devuelve el job_id sin esperar la extracción.
+
+    El resultado se consulta con GET /jobs/{job_id} o llega por POST al
+    callback_url. Reenviar el mismo archivo del mismo remitente devuelve el
+    trabajo ya encolado (existente=true). Un callback_url con esquema o host
+    no permitido (ver _rechazo_callback) se rechaza con 422.
+    """
+    if request.callback_url:
+        rechazo = await _rechazo_callback(request.callback_url)
+        if rechazo:
+            raise HTTPException(status_code=422, detail=f"callback_url no permitido: {rechazo}")
+    cola = get_job_queue()
+    pedido = request.model_dump(exclude={"callback_url"})
+    clave = await _en_jobs(calcular_clave_trabajo, request.file_base64, request.sender_phone)
+    job_id, existente = await _en_jobs(cola.encolar, pedido, clave, request.callback_url)
+    if _hay_trabajos is not None:
+        _hay_trabajos.set()
+    trabajo = await _en_jobs(cola.obtener, job_id)
+    response.headers["Location"] = f"/jobs/{job_id}"
+    logger.info(f"Trabajo {job_id} {'ya estaba encolado' if existente else 'encolado'} ({request.sender_phone})")
+    return JobResponse(job_id=job_id, estado=trabajo["estado"], existente=existente,
+                       intentos=trabajo["intentos"], creado=_fecha(trabajo["creado"]))
+
+
+@protegido.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Estado y, si terminó, resultado de un trabajo encolado."""
+    trabajo = await _en_jobs(get_job_queue().obtener, job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return JobResponse(
+        job_id=job_id,
+        estado=trabajo["estado"],
+        intentos=trabajo["intentos"],
+        resultado=trabajo["resultado"],
+        error=trabajo["error"],
+        creado=_fecha(trabajo["creado"]),
+        terminado=_fecha(trabajo["terminado"]),
+        callback_estado=trabajo["callback_estado"]
     )
-    return resultado
+
+
+@protegido.get("/stats/jobs", response_model=dict)
+async def jobs_stats():
+    """Cantidad de trabajos por estado en la cola."""
+    return await _en_jobs(get_job_queue().obtener_estadisticas)
+
+
+# --- Montaje de rutas ---
+
+def _rutas_v1(router: APIRouter) -> APIRouter:
+    """
+    Copia las rutas de un router bajo /api/v1, sin la barra final de las
+    rutas históricas (/process-receipt/ -> /api/v1/process-receipt).
+    """
+    v1 = APIRouter(prefix=API_V1)
+    for ruta in router.routes:
+        v1.add_api_route(
+            ruta.path.rstrip("/"),
+            ruta.endpoint,
+            methods=list(ruta.methods),
+            response_model=ruta.response_model,
+            status_code=ruta.status_code,
+            response_class=ruta.response_class,
+            dependencies=ruta.dependencies,
+            name=f"v1_{ruta.name}",
+            description=ruta.description
+        )
+    return v1
+
+
+app.include_router(_rutas_v1(publico))
+app.include_router(_rutas_v1(protegido))
+# Rutas históricas: mismas funciones y misma autenticación (con api_key
+# configurada también piden X-API-Key; ver README_CLIENTE.md)
+app.include_router(publico)
+app.include_router(protegido, deprecated=True)
 
 
 # Para ejecutar directamente con: python -m app.main
@@ -0,0 +1,213 @@
+"""
+Métricas del procesamiento en formato de texto de Prometheus (GET /metrics).
+
+Sin dependencias: contadores, histogramas y medidores con etiquetas,
+seguros entre hilos (el pipeline corre en el event loop, en pools de hilos
+y en el hilo del folder watcher). Cada etapa del pipeline se mide con
+medir_etapa("nombre"), que observa la duración en
+comprobantes_etapa_segundos y, si la etapa lanza, cuenta la clase del
+error en comprobantes_errores_total.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Límites de los buckets de latencia, en segundos
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _formatear_etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _numero(valor: float) -> str:
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+class Contador:
+    """Contador monótono con etiquetas."""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._lock = threading.Lock()
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *valores_etiquetas: str, cantidad: float = 1.0):
+        with self._lock:
+            self._valores[valores_etiquetas] = self._valores.get(valores_etiquetas, 0.0) + cantidad
+
+    def exportar(self) -> List[str]:
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [
+            f"{self.nombre}{_formatear_etiquetas(self.etiquetas, etiquetas)} {_numero(valor)}"
+            for etiquetas, valor in valores
+        ]
+
+
+class Histograma:
+    """Histograma acumulativo (buckets "le") con etiquetas."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # etiquetas -> [cuenta por bucket..., suma, cuenta total]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, *valores_etiquetas: str):
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self) -> List[str]:
+        with self._lock:
+            series = sorted((etiquetas, list(serie)) for etiquetas, serie in self._series.items())
+        lineas = []
+        for etiquetas, serie in series:
+            for limite, cuenta in zip(self.buckets, serie):
+                le = _formatear_etiquetas(self.etiquetas, etiquetas, f'le="{limite}"')
+                lineas.append(f"{self.nombre}_bucket{le} {cuenta}")
+            infinito = _formatear_etiquetas(self.etiquetas, etiquetas, 'le="+Inf"')
+            lineas.append(f"{self.nombre}_bucket{infinito} {serie[-1]}")
+            lineas.append(f"{self.nombre}_sum{_formatear_etiquetas(self.etiquetas, etiquetas)} {round(serie[-2], 6)}")
+            lineas.append(f"{self.nombre}_count{_formatear_etiquetas(self.etiquetas, etiquetas)} {serie[-1]}")
+        return lineas
+
+
+class Medidor:
+    """Valor instantáneo: se mueve con inc/dec o se lee de una función al exportar."""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, funcion: Optional[Callable[[], float]] = None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self._lock = threading.Lock()
+        self._valor = 0.0
+
+    def inc(self, cantidad: float = 1.0):
+        with self._lock:
+            self._valor += cantidad
+
+    def dec(self, cantidad: float = 1.0):
+        self.inc(-cantidad)
+
+    def exportar(self) -> List[str]:
+        if self.funcion is not None:
+            try:
+                valor = self.funcion()
+            except Exception:
+                return []
+        else:
+            with self._lock:
+                valor = self._valor
+        return [f"{self.nombre} {_numero(valor)}"]
+
+
+class RegistroMetricas:
+    """Conjunto de métricas del proceso, exportable en formato Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas: Dict[str, object] = {}
+
+    def _registrar(self, metrica):
+        with self._lock:
+            return self._metricas.setdefault(metrica.nombre, metrica)
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Contador:
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Histograma:
+        return self._registrar(Histograma(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre: str, ayuda: str, funcion: Optional[Callable[[], float]] = None) -> Medidor:
+        """Crea (o reemplaza la función de) un medidor."""
+        medidor = self._registrar(Medidor(nombre, ayuda, funcion))
+        if funcion is not None:
+            medidor.funcion = funcion
+        return medidor
+
+    def exportar(self) -> str:
+        with self._lock:
+            metricas = sorted(self._metricas.values(), key=lambda m: m.nombre)
+        lineas = []
+        for metrica in metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.exportar())
+        return "\n".join(lineas) + "\n"
+
+
+# Instancia global para uso compartido
+_registro_instance: Optional[RegistroMetricas] = None
+_registro_lock = threading.Lock()
+
+
+def get_metricas() -> RegistroMetricas:
+    """Obtiene el registro global de métricas."""
+    global _registro_instance
+    with _registro_lock:
+        if _registro_instance is None:
+            _registro_instance = RegistroMetricas()
+    return _registro_instance
+
+
+# Métricas del pipeline, compartidas por todos los módulos
+ETAPAS = get_metricas().histograma(
+    "comprobantes_etapa_segundos",
+    "Duración de cada etapa del procesamiento de un comprobante",
+    ("etapa",)
+)
+ERRORES = get_metricas().contador(
+    "comprobantes_errores_total",
+    "Errores por etapa y clase",
+    ("etapa", "clase")
+)
+EN_PROCESO = get_metricas().medidor(
+    "comprobantes_en_proceso",
+    "Comprobantes en proceso en la API en este momento"
+)
+
+
+@contextmanager
+def medir_etapa(etapa: str):
+    """Mide la duración de una etapa; si lanza, cuenta el error con su clase."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORES.inc(etapa, type(e).__name__)
+        raise
+    finally:
+        ETAPAS.observar(time.perf_counter() - inicio, etapa)
+
+
+def registrar_error(etapa: str, clase: str):
+    """Cuenta un error que no llegó como excepción (ej. resultado con success=False)."""
+    ERRORES.inc(etapa, clase)
@@ -0,0 +1,236 @@
+"""
+Ruteo de la extracción por niveles de modelo.
+
+Cada comprobante se intenta primero con el nivel económico (modelo más
+barato o detail "low"); sólo si el resultado no es confiable se repite con
+el modelo completo. Se registra latencia y costo por nivel y la tasa de
+escalado para poder comparar p50/p95 antes y después.
+"""
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from app.config import (
+    OPENAI_MODEL, OPENAI_MODEL_ECONOMICO, OPENAI_DETAIL_ECONOMICO, ROUTING_ENABLED,
+    MIN_CONFIDENCE
+)
+from billing.cost_tracker import calcular_costo_tokens, calcular_ahorro_cache
+
+# Muestras de latencia que se guardan por nivel para los percentiles
+MUESTRAS_LATENCIA = 1000
+
+
+def obtener_niveles() -> List[dict]:
+    """
+    Niveles de modelo a probar, en orden.
+
+    Returns:
+        Lista de dicts con "nombre", "modelo" y "detalle"
+    """
+    completo = {"nombre": "completo", "modelo": OPENAI_MODEL, "detalle": "high"}
+    economico = {"nombre": "economico", "modelo": OPENAI_MODEL_ECONOMICO, "detalle": OPENAI_DETAIL_ECONOMICO}
+    if not ROUTING_ENABLED or (economico["modelo"], economico["detalle"]) == (completo["modelo"], completo["detalle"]):
+        return [completo]
+    return [economico, completo]
+
+
+def motivo_escalado(datos: dict) -> Optional[str]:
+    """
+    Decide si el resultado de un nivel hay que repetirlo con el siguiente.
+
+    Args:
+        datos: Datos ya pasados por _validar_y_enriquecer
+
+    Returns:
+        Motivo del escalado o None si el resultado es aceptable
+    """
+    if not datos.get("monto_numerico"):
+        return "monto_cero"
+    if datos.get("confianza", 0) < MIN_CONFIDENCE:
+        return "confianza_baja"
+    if datos.get("emisor_cbu") and not datos.get("emisor_cbu_valido"):
+        return "cbu_emisor_invalido"
+    if datos.get("receptor_cbu") and not datos.get("receptor_cbu_valido"):
+        return "cbu_receptor_invalido"
+    if datos.get("emisor_cuil") and not datos.get("emisor_cuil_valido"):
+        return "cuil_emisor_invalido"
+    return None
+
+
+def _campo(objeto, nombre: str):
+    """Lee un campo de un objeto del SDK o de su equivalente en dict (Batch API)."""
+    if objeto is None:
+        return None
+    if isinstance(objeto, dict):
+        return objeto.get(nombre)
+    return getattr(objeto, nombre, None)
+
+
+def uso_vacio() -> dict:
+    """Uso de una extracción que no llamó al modelo (cache, capa de texto)."""
+    return {
+        "llamadas": 0,
+        "tokens_entrada": 0,
+        "tokens_cacheados": 0,
+        "tokens_salida": 0,
+        "costo_usd": 0.0,
+        "ahorro_cache_usd": 0.0,
+        "latencia_ms": 0.0
+    }
+
+
+def uso_respuesta(modelo: str, response, factor: float = 1.0) -> dict:
+    """
+    Uso real de una respuesta según su usage (ceros si no viene).
+    
+    Args:
+        modelo: Modelo al que se le hizo la llamada (para el precio)
+        response: Respuesta del SDK o body en dict (resultados de la Batch API)
+        factor: Multiplicador del precio (FACTOR_BATCH para la Batch API)
+    
+    Returns:
+        Dict con llamadas, tokens_entrada, tokens_cacheados, tokens_salida,
+        costo_usd, ahorro_cache_usd y latencia_ms (0, la mide quien llama)
+    """
+    uso = uso_vacio()
+    uso["llamadas"] = 1
+    usage = _campo(response, "usage")
+    if usage is None:
+        return uso
+    uso["tokens_entrada"] = _campo(usage, "prompt_tokens") or 0
+    uso["tokens_salida"] = _campo(usage, "completion_tokens") or 0
+    uso["tokens_cacheados"] = _campo(_campo(usage, "prompt_tokens_details"), "cached_tokens") or 0
+    uso["costo_usd"] = factor * calcular_costo_tokens(
+        modelo, uso["tokens_entrada"], uso["tokens_salida"], uso["tokens_cacheados"]
+    )
+    uso["ahorro_cache_usd"] = factor * calcular_ahorro_cache(modelo, uso["tokens_cacheados"])
+    return uso
+
+
+def sumar_usos(usos: List[Optional[dict]]) -> dict:
+    """Suma varios usos (niveles de una extracción o páginas de un PDF)."""
+    total = uso_vacio()
+    for uso in usos:
+        if not uso:
+            continue
+        for clave in total:
+            total[clave] += uso.get(clave, 0)
+    total["costo_usd"] = round(total["costo_usd"], 8)
+    total["ahorro_cache_usd"] = round(total["ahorro_cache_usd"], 8)
+    total["latencia_ms"] = round(total["latencia_ms"], 1)
+    return total
+
+
+def costo_respuesta(modelo: str, response) -> float:
+    """Costo real en USD de una respuesta según su usage (0 si no viene)."""
+    return uso_respuesta(modelo, response)["costo_usd"]
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return round(ordenados[idx], 1)
+
+
+class RouterStats:
+    """Telemetría por nivel: llamadas, latencias, costo y escalados."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._niveles: Dict[str, dict] = {}
+        self._latencias_totales = deque(maxlen=MUESTRAS_LATENCIA)
+        self._extracciones = 0
+        self._escaladas = 0
+        self._motivos: Dict[str, int] = {}
+
+    def _nivel(self, nombre: str) -> dict:
+        if nombre not in self._niveles:
+            self._niveles[nombre] = {
+                "llamadas": 0,
+                "errores": 0,
+                "costo_usd": 0.0,
+                "tokens_entrada": 0,
+                "tokens_cacheados": 0,
+                "latencias": deque(maxlen=MUESTRAS_LATENCIA)
+            }
+        return self._niveles[nombre]
+
+    def registrar_llamada(
+        self,
+        nivel: str,
+        latencia_ms: float,
+        costo_usd: float,
+        error: bool = False,
+        uso: Optional[dict] = None
+    ):
+        """Registra una llamada al modelo de un nivel."""
+        with self._lock:
+            datos = self._nivel(nivel)
+            datos["llamadas"] += 1
+            datos["costo_usd"] += costo_usd
+            datos["latencias"].append(latencia_ms)
+            if uso:
+                datos["tokens_entrada"] += uso.get("tokens_entrada", 0)
+                datos["tokens_cacheados"] += uso.get("tokens_cacheados", 0)
+            if error:
+                datos["errores"] += 1
+
+    def registrar_extraccion(self, latencia_total_ms: float, motivos: List[str]):
+        """
+        Registra una extracción completa (todos sus niveles).
+
+        Args:
+            latencia_total_ms: Tiempo sumado de todos los niveles usados
+            motivos: Motivos de escalado (vacío si resolvió el primer nivel)
+        """
+        with self._lock:
+            self._extracciones += 1
+            self._latencias_totales.append(latencia_total_ms)
+            if motivos:
+                self._escaladas += 1
+            for motivo in motivos:
+                self._motivos[motivo] = self._motivos.get(motivo, 0) + 1
+
+    def obtener_estadisticas(self) -> dict:
+        """Retorna latencia p50/p95, costo por nivel y tasa de escalado."""
+        with self._lock:
+            niveles = {
+                nombre: {
+                    "llamadas": datos["llamadas"],
+                    "errores": datos["errores"],
+                    "costo_usd": round(datos["costo_usd"], 6),
+                    "costo_promedio_usd": round(datos["costo_usd"] / datos["llamadas"], 6) if datos["llamadas"] else 0.0,
+                    "tokens_entrada": datos["tokens_entrada"],
+                    "tokens_cacheados": datos["tokens_cacheados"],
+                    "tasa_cache_prompt": round(datos["tokens_cacheados"] / datos["tokens_entrada"], 4) if datos["tokens_entrada"] else 0.0,
+                    "latencia_p50_ms": _percentil(list(datos["latencias"]), 50),
+                    "latencia_p95_ms": _percentil(list(datos["latencias"]), 95)
+                }
+                for nombre, datos in self._niveles.items()
+            }
+            return {
+                "niveles_configurados": [n["modelo"] + ("/" + n["detalle"]) for n in obtener_niveles()],
+                "extracciones": self._extracciones,
+                "escaladas": self._escaladas,
+                "tasa_escalado": round(self._escaladas / self._extracciones, 4) if self._extracciones else 0.0,
+                "motivos_escalado": dict(self._motivos),
+                "latencia_p50_ms": _percentil(list(self._latencias_totales), 50),
+                "latencia_p95_ms": _percentil(list(self._latencias_totales), 95),
+                "niveles": niveles
+            }
+
+
+# Instancia global para uso compartido
+_stats_instance: Optional[RouterStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_router_stats() -> RouterStats:
+    """Obtiene la instancia global de telemetría del ruteo."""
+    global _stats_instance
+    with _stats_lock:
+        if _stats_instance is None:
+            _stats_instance = RouterStats()
+    return _stats_instance
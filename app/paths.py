@@ -2,6 +2,7 @@
 Rutas y directorios de datos del sistema.
 Mantiene los archivos de configuración y datos fuera de la carpeta instalada.
 """
+import hashlib
 import os
 import sys
 from pathlib import Path
@@ -46,6 +47,38 @@ def get_processed_files_path() -> str:
     return os.path.join(get_data_dir(), "processed_files.json")
 
 
+def get_extraction_cache_path() -> str:
+    return os.path.join(get_data_dir(), "extraction_cache.db")
+
+
+def get_jobs_db_path() -> str:
+    """Cola persistente de trabajos de la API asíncrona (/jobs)."""
+    return os.path.join(get_data_dir(), "jobs.db")
+
+
+def get_backfill_dir() -> str:
+    """Directorio de trabajo de los lotes de Batch API (JSONL y estado)."""
+    return ensure_dir(os.path.join(get_data_dir(), "backfill"))
+
+
+def get_duplicate_index_path(destino: str) -> str:
+    """Índice de duplicados persistido de un destino (Excel o Sheet)."""
+    nombre = hashlib.sha1(destino.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(ensure_dir(os.path.join(get_data_dir(), "indices")), f"{nombre}.jsonl")
+
+
+def get_sheets_spill_path(destino: str) -> str:
+    """Filas encoladas para una hoja de Google Sheets que todavía no se enviaron."""
+    nombre = hashlib.sha1(destino.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(ensure_dir(os.path.join(get_data_dir(), "sheets_pendientes")), f"{nombre}.jsonl")
+
+
+def get_sheets_dead_letter_path(destino: str) -> str:
+    """Filas que Google Sheets rechazó con un error permanente (no se reintentan)."""
+    nombre = hashlib.sha1(destino.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(ensure_dir(os.path.join(get_data_dir(), "sheets_descartadas")), f"{nombre}.jsonl")
+
+
 def get_qr_path() -> str:
     return os.path.join(get_app_data_dir(), "whatsapp_qr.png")
 
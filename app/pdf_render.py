@@ -0,0 +1,256 @@
+"""
+Backends de renderizado de PDFs a imagen.
+
+- pdfium: pypdfium2 en el mismo proceso (sin subprocesos ni archivos temporales)
+- pdfium_pool: pypdfium2 en un pool de procesos pre-calentado
+- poppler: pdf2image/pdftoppm, un subproceso por PDF (comportamiento histórico)
+
+Todos devuelven la página como JPEG, en escala de grises y al tamaño que
+el modelo realmente usa (lado corto ~PREPROCESS_SHORT_SIDE).
+"""
+import io
+import logging
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.config import (
+    PDF_RENDER_BACKEND, PDF_RENDER_WORKERS, PDF_GRAYSCALE, PDF_MAX_DPI,
+    PREPROCESS_SHORT_SIDE
+)
+
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+# DPI mínimo para que el texto chico siga legible
+PDF_MIN_DPI = 100
+# Calidad JPEG de la página renderizada
+CALIDAD_JPEG = 90
+
+# pdfium no es thread-safe: toda llamada en este proceso pasa por este lock
+# (también lo usa app/pdf_text.py para leer la capa de texto)
+pdfium_lock = threading.Lock()
+
+
+def _escala_pdfium(ancho_pt: float, alto_pt: float) -> float:
+    """Escala (píxeles por punto) para que el lado corto quede en PREPROCESS_SHORT_SIDE."""
+    escala = PREPROCESS_SHORT_SIDE / max(1.0, min(ancho_pt, alto_pt))
+    return max(PDF_MIN_DPI / 72, min(escala, PDF_MAX_DPI / 72))
+
+
+def _renderizar_pdfium(pdf_bytes: bytes, pagina: int, grises: bool) -> bytes:
+    """Renderiza una página con pypdfium2 y la devuelve como JPEG."""
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        if pagina >= len(pdf):
+            raise ValueError(f"El PDF tiene {len(pdf)} páginas, no existe la página {pagina + 1}")
+        page = pdf[pagina]
+        ancho, alto = page.get_size()
+        img = page.render(scale=_escala_pdfium(ancho, alto), grayscale=grises).to_pil()
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=CALIDAD_JPEG)
+        return buffer.getvalue()
+    finally:
+        pdf.close()
+
+
+def _contar_paginas_pdfium(pdf_bytes: bytes) -> int:
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _inicializar_proceso():
+    """Initializer del pool: deja pdfium cargado en cada proceso."""
+    if PDFIUM_AVAILABLE:
+        pdfium.PdfDocument.new().close()
+
+
+def _calentar():
+    """Tarea vacía para forzar el arranque de los procesos del pool."""
+    return os.getpid()
+
+
+class PdfRenderer(ABC):
+    """Interfaz común de los backends de renderizado."""
+
+    nombre = "base"
+
+    @abstractmethod
+    def renderizar(self, pdf_bytes: bytes, pagina: int = 0) -> bytes:
+        """
+        Renderiza una página del PDF.
+
+        Args:
+            pdf_bytes: Contenido del PDF
+            pagina: Índice de la página (0 = primera)
+
+        Returns:
+            Página como JPEG
+        """
+
+    @abstractmethod
+    def contar_paginas(self, pdf_bytes: bytes) -> int:
+        """Cantidad de páginas del PDF."""
+
+    def cerrar(self):
+        """Libera recursos del backend (procesos, etc.)."""
+
+
+class PdfiumRenderer(PdfRenderer):
+    """pypdfium2 dentro del proceso, serializado con pdfium_lock."""
+
+    nombre = "pdfium"
+
+    def __init__(self, grises: bool = PDF_GRAYSCALE):
+        self.grises = grises
+
+    def renderizar(self, pdf_bytes: bytes, pagina: int = 0) -> bytes:
+        with pdfium_lock:
+            return _renderizar_pdfium(pdf_bytes, pagina, self.grises)
+
+    def contar_paginas(self, pdf_bytes: bytes) -> int:
+        with pdfium_lock:
+            return _contar_paginas_pdfium(pdf_bytes)
+
+
+class PdfiumPoolRenderer(PdfRenderer):
+    """pypdfium2 en un pool de procesos que se arranca una sola vez."""
+
+    nombre = "pdfium_pool"
+
+    def __init__(self, workers: int = PDF_RENDER_WORKERS, grises: bool = PDF_GRAYSCALE):
+        self.grises = grises
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_proceso)
+        # Arrancar todos los procesos ahora y no en el primer comprobante
+        for futuro in [self._pool.submit(_calentar) for _ in range(workers)]:
+            futuro.result()
+        logger.info(f"Pool de renderizado PDF iniciado ({workers} procesos)")
+
+    def renderizar(self, pdf_bytes: bytes, pagina: int = 0) -> bytes:
+        return self._pool.submit(_renderizar_pdfium, pdf_bytes, pagina, self.grises).result()
+
+    def contar_paginas(self, pdf_bytes: bytes) -> int:
+        return self._pool.submit(_contar_paginas_pdfium, pdf_bytes).result()
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class PopplerRenderer(PdfRenderer):
+    """pdf2image (pdftoppm). Lanza un subproceso por llamada."""
+
+    nombre = "poppler"
+
+    def __init__(self, grises: bool = PDF_GRAYSCALE):
+        self.grises = grises
+        self.poppler_path = os.environ.get("POPPLER_PATH")
+
+    def _opciones(self) -> dict:
+        opciones = {"grayscale": self.grises}
+        if self.poppler_path:
+            opciones["poppler_path"] = self.poppler_path
+        return opciones
+
+    def _tamano_pagina(self, pdf_bytes: bytes, pagina: int) -> Optional[tuple]:
+        """(ancho, alto) en puntos de la página ya rotada, según pdfinfo; None si no se pudo leer."""
+        from pdf2image import pdfinfo_from_bytes
+
+        try:
+            info = pdfinfo_from_bytes(
+                pdf_bytes, poppler_path=self.poppler_path, first_page=pagina + 1, last_page=pagina + 1
+            )
+        except Exception as e:
+            logger.debug(f"pdfinfo no devolvió el tamaño de la página {pagina + 1}: {e}")
+            return None
+        # Con -f/-l las claves son "Page    1 size" y "Page    1 rot"
+        tamano = next((v for k, v in info.items() if re.fullmatch(r"Page\s+\d+ size|Page size", k)), "")
+        rotacion = next((v for k, v in info.items() if re.fullmatch(r"Page\s+\d+ rot|Page rot", k)), "0")
+        medidas = re.match(r"([\d.]+) x ([\d.]+)", tamano)
+        if not medidas:
+            return None
+        ancho, alto = float(medidas.group(1)), float(medidas.group(2))
+        if str(rotacion).strip() in ("90", "270"):
+            ancho, alto = alto, ancho
+        return ancho, alto
+
+    def renderizar(self, pdf_bytes: bytes, pagina: int = 0) -> bytes:
+        from pdf2image import convert_from_bytes
+
+        # Misma escala que pdfium: lado corto en PREPROCESS_SHORT_SIDE sea
+        # la página vertical u horizontal
+        tamano = self._tamano_pagina(pdf_bytes, pagina)
+        dpi = _escala_pdfium(*tamano) * 72 if tamano else PDF_MAX_DPI
+        images = convert_from_bytes(
+            pdf_bytes,
+            first_page=pagina + 1,
+            last_page=pagina + 1,
+            dpi=dpi,
+            **self._opciones()
+        )
+        if not images:
+            raise ValueError(f"No se pudo extraer la página {pagina + 1} del PDF")
+        img = images[0]
+        if tamano is None and min(img.size) > PREPROCESS_SHORT_SIDE:
+            # Sin el tamaño de la página se reduce después de renderizar
+            factor = PREPROCESS_SHORT_SIDE / min(img.size)
+            img = img.resize((round(img.width * factor), round(img.height * factor)))
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=CALIDAD_JPEG)
+        return buffer.getvalue()
+
+    def contar_paginas(self, pdf_bytes: bytes) -> int:
+        from pdf2image import pdfinfo_from_bytes
+
+        return int(pdfinfo_from_bytes(pdf_bytes, poppler_path=self.poppler_path)["Pages"])
+
+
+BACKENDS = {
+    "pdfium": PdfiumRenderer,
+    "pdfium_pool": PdfiumPoolRenderer,
+    "poppler": PopplerRenderer
+}
+
+# Instancia global para uso compartido
+_renderer_instance: Optional[PdfRenderer] = None
+_renderer_lock = threading.Lock()
+
+
+def crear_renderer(backend: str) -> PdfRenderer:
+    """
+    Crea un backend de renderizado por nombre.
+
+    Args:
+        backend: "auto", "pdfium", "pdfium_pool" o "poppler"
+    """
+    if backend == "auto":
+        backend = "pdfium" if PDFIUM_AVAILABLE else "poppler"
+    if backend.startswith("pdfium") and not PDFIUM_AVAILABLE:
+        logger.warning("pypdfium2 no está instalado, se usa poppler para renderizar PDFs")
+        backend = "poppler"
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de renderizado PDF desconocido: {backend}")
+    return BACKENDS[backend]()
+
+
+def get_pdf_renderer() -> PdfRenderer:
+    """Obtiene el backend configurado (extraccion.pdf_render_backend)."""
+    global _renderer_instance
+    with _renderer_lock:
+        if _renderer_instance is None:
+            _renderer_instance = crear_renderer(PDF_RENDER_BACKEND)
+            logger.info(f"Renderizado de PDF con backend: {_renderer_instance.nombre}")
+    return _renderer_instance
@@ -0,0 +1,248 @@
+"""
+Extracción determinística de comprobantes PDF con capa de texto.
+Los PDFs que generan los bancos (Galicia, Naranja X, Mercado Pago, ...) traen
+el texto embebido: se puede leer sin rasterizar y sin llamar al modelo.
+
+parsear_comprobante devuelve el mismo dict que produce el modelo (antes de
+_validar_y_enriquecer) más una confianza propia. El extractor sólo usa este
+camino cuando la confianza alcanza MIN_CONFIDENCE.
+"""
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+    pdfium = None
+
+from app.pdf_render import pdfium_lock
+
+logger = logging.getLogger(__name__)
+
+# Mínimo de caracteres útiles para considerar que el PDF tiene capa de texto
+MIN_CARACTERES_TEXTO = 40
+
+# Confianza máxima que se asigna a un parseo por texto
+CONFIANZA_MAXIMA = 0.95
+
+# Peso de cada campo en la confianza del parseo
+PESOS_CONFIANZA = {
+    "monto": 0.35,
+    "fecha_operacion": 0.2,
+    "emisor_nombre": 0.15,
+    "emisor_id": 0.1,
+    "receptor": 0.1,
+    "referencia": 0.1
+}
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12
+}
+
+# Patrones compilados una sola vez
+_RE_MONTO = re.compile(r"\$\s*([\d.]+(?:,\d{1,2})?)")
+_RE_MONTO_ETIQUETA = re.compile(
+    r"(?:importe|monto|total)(?:\s+transferido)?\s*:?\s*\$?\s*([\d.]+(?:,\d{1,2})?)", re.IGNORECASE
+)
+_RE_FECHA_NUMERICA = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})(?:\D{0,12}?(\d{1,2}):(\d{2}))?")
+_RE_FECHA_LARGA = re.compile(
+    r"\b(\d{1,2})\s+de\s+([a-záéíóú]+)\s+(?:de\s+)?(\d{4})(?:\D{0,12}?(\d{1,2}):(\d{2}))?", re.IGNORECASE
+)
+_RE_CBU = re.compile(r"(?<!\d)(\d{22})(?!\d)")
+_RE_CUIL = re.compile(r"(?<!\d)(\d{2})-?(\d{8})-?(\d)(?!\d)")
+_RE_REFERENCIA = re.compile(
+    r"(?:n[uú]mero|n[°º]|nro\.?|c[oó]digo|id)\s*(?:de\s+)?(?:operaci[oó]n|comprobante|transacci[oó]n|referencia)"
+    r"[^\n:]*[:\s]\s*([A-Za-z0-9-]{4,})",
+    re.IGNORECASE
+)
+_RE_NOMBRE = re.compile(r"^[A-Za-zÁÉÍÓÚÑáéíóúñ.' ]{5,60}$")
+
+# Encabezados que abren la sección del emisor / receptor
+_ORIGEN = r"(?:^|\n)\s*(?:de|origen|desde|cuenta origen|ordenante|remitente|enviado por)\s*:?\s*(?:\n|$| )"
+_DESTINO = r"(?:^|\n)\s*(?:para|destino|hacia|cuenta destino|destinatario|beneficiario)\s*:?\s*(?:\n|$| )"
+_RE_ORIGEN = re.compile(_ORIGEN, re.IGNORECASE)
+_RE_DESTINO = re.compile(_DESTINO, re.IGNORECASE)
+_RE_TITULAR = re.compile(r"(?:titular|nombre|raz[oó]n social)\s*:\s*([^\n]+)", re.IGNORECASE)
+
+# Líneas que nunca son un nombre de persona
+_NO_NOMBRE = re.compile(
+    r"cuit|cuil|cbu|cvu|alias|banco|cuenta|caja|mercado pago|naranja|galicia|"
+    r"comprobante|transferencia|importe|monto|fecha|operaci|motivo|concepto",
+    re.IGNORECASE
+)
+
+# Parsers por banco: cómo se reconoce el PDF y cómo se llama en el sistema
+PARSERS_BANCO: List[Dict] = [
+    {
+        "banco": "Mercado Pago",
+        "detectar": re.compile(r"mercado\s*pago", re.IGNORECASE),
+        "concepto": re.compile(r"motivo\s*:?\s*([^\n]+)", re.IGNORECASE)
+    },
+    {
+        "banco": "Naranja X",
+        "detectar": re.compile(r"naranja\s*x", re.IGNORECASE),
+        "concepto": re.compile(r"(?:motivo|concepto)\s*:?\s*([^\n]+)", re.IGNORECASE)
+    },
+    {
+        "banco": "Banco de Galicia",
+        "detectar": re.compile(r"galicia", re.IGNORECASE),
+        "concepto": re.compile(r"(?:concepto|motivo|descripci[oó]n)\s*:?\s*([^\n]+)", re.IGNORECASE)
+    }
+]
+
+_PARSER_GENERICO = {
+    "banco": "",
+    "detectar": None,
+    "concepto": re.compile(r"(?:concepto|motivo)\s*:?\s*([^\n]+)", re.IGNORECASE)
+}
+
+
+def extraer_texto_pdf(pdf_bytes: bytes, max_paginas: int = 1, desde: int = 0) -> str:
+    """
+    Extrae la capa de texto de max_paginas páginas a partir de "desde".
+
+    Returns:
+        Texto extraído ("" si no hay capa de texto o pypdfium2 no está instalado)
+    """
+    if not PDFIUM_AVAILABLE:
+        return ""
+    try:
+        with pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            try:
+                partes = []
+                for i in range(desde, min(len(pdf), desde + max_paginas)):
+                    textpage = pdf[i].get_textpage()
+                    partes.append(textpage.get_text_range())
+            finally:
+                pdf.close()
+        return "\n".join(partes).replace("\r\n", "\n").replace("\r", "\n")
+    except Exception as e:
+        logger.debug(f"No se pudo leer la capa de texto del PDF: {e}")
+        return ""
+
+
+def _buscar_monto(texto: str) -> str:
+    """Devuelve el monto sin separadores de miles (formato "650000.50")."""
+    m = _RE_MONTO_ETIQUETA.search(texto) or _RE_MONTO.search(texto)
+    if not m:
+        return ""
+    return m.group(1).replace(".", "").replace(",", ".")
+
+
+def _buscar_fecha(texto: str) -> str:
+    """Devuelve la primera fecha en formato DD/MM/YYYY HH:mm (o DD/MM/YYYY)."""
+    m = _RE_FECHA_NUMERICA.search(texto)
+    if m:
+        d, mo, y, hh, mm = m.groups()
+    else:
+        m = _RE_FECHA_LARGA.search(texto)
+        if not m:
+            return ""
+        d, mes_txt, y, hh, mm = m.groups()
+        mo = MESES.get(mes_txt.lower())
+        if not mo:
+            return ""
+    fecha = f"{int(d):02d}/{int(mo):02d}/{y}"
+    if hh is not None:
+        fecha += f" {int(hh):02d}:{mm}"
+    return fecha
+
+
+def _secciones(texto: str) -> Tuple[str, str]:
+    """Separa el texto en sección del emisor y del receptor (si se reconocen)."""
+    m_origen = _RE_ORIGEN.search(texto)
+    m_destino = _RE_DESTINO.search(texto)
+    if not m_origen or not m_destino:
+        return "", ""
+    if m_origen.start() < m_destino.start():
+        return texto[m_origen.end():m_destino.start()], texto[m_destino.end():]
+    return texto[m_origen.end():], texto[m_destino.end():m_origen.start()]
+
+
+def _buscar_nombre(seccion: str) -> str:
+    """Busca el nombre del titular en una sección."""
+    m = _RE_TITULAR.search(seccion)
+    if m and not _NO_NOMBRE.search(m.group(1)):
+        return m.group(1).strip()
+    for linea in seccion.split("\n"):
+        linea = linea.strip()
+        if _RE_NOMBRE.match(linea) and not _NO_NOMBRE.search(linea):
+            return linea
+    return ""
+
+
+def _buscar_cuil(seccion: str) -> str:
+    m = _RE_CUIL.search(seccion)
+    return f"{m.group(1)}-{m.group(2)}-{m.group(3)}" if m else ""
+
+
+def _buscar_cbu(seccion: str) -> str:
+    m = _RE_CBU.search(seccion.replace(" ", ""))
+    return m.group(1) if m else ""
+
+
+def _calcular_confianza(datos: dict) -> float:
+    puntaje = 0.0
+    if datos["monto"]:
+        puntaje += PESOS_CONFIANZA["monto"]
+    if datos["fecha_operacion"]:
+        puntaje += PESOS_CONFIANZA["fecha_operacion"]
+    if datos["emisor_nombre"]:
+        puntaje += PESOS_CONFIANZA["emisor_nombre"]
+    if datos["emisor_cuil"] or datos["emisor_cbu"]:
+        puntaje += PESOS_CONFIANZA["emisor_id"]
+    if datos["receptor_nombre"] or datos["receptor_cbu"]:
+        puntaje += PESOS_CONFIANZA["receptor"]
+    if datos["referencia"]:
+        puntaje += PESOS_CONFIANZA["referencia"]
+    return round(min(puntaje, CONFIANZA_MAXIMA), 2)
+
+
+def parsear_comprobante(texto: str) -> Optional[dict]:
+    """
+    Parsea el texto de un comprobante de transferencia.
+
+    Args:
+        texto: Capa de texto del PDF
+
+    Returns:
+        Dict con los mismos campos que devuelve el modelo (incluida
+        "confianza"), o None si el texto no parece un comprobante
+    """
+    if len(texto.strip()) < MIN_CARACTERES_TEXTO:
+        return None
+
+    seccion_emisor, seccion_receptor = _secciones(texto)
+
+    # El banco se reconoce fuera de la sección del receptor (que puede
+    # nombrar a otro banco, ej. una transferencia de Galicia a Mercado Pago)
+    texto_emisor = texto.replace(seccion_receptor, "") if seccion_receptor else texto
+    parser = next(
+        (p for p in PARSERS_BANCO if p["detectar"].search(texto_emisor)),
+        _PARSER_GENERICO
+    )
+    concepto = parser["concepto"].search(texto)
+    referencia = _RE_REFERENCIA.search(texto)
+
+    datos = {
+        "emisor_nombre": _buscar_nombre(seccion_emisor),
+        "emisor_cuil": _buscar_cuil(seccion_emisor),
+        "emisor_cbu": _buscar_cbu(seccion_emisor),
+        "banco_emisor": parser["banco"],
+        "receptor_nombre": _buscar_nombre(seccion_receptor),
+        "receptor_cuil": _buscar_cuil(seccion_receptor),
+        "receptor_cbu": _buscar_cbu(seccion_receptor),
+        "banco_receptor": "",
+        "monto": _buscar_monto(texto),
+        "fecha_operacion": _buscar_fecha(texto),
+        "referencia": referencia.group(1) if referencia else "",
+        "concepto": concepto.group(1).strip() if concepto else ""
+    }
+    datos["confianza"] = _calcular_confianza(datos)
+    return datos
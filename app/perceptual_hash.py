@@ -0,0 +1,233 @@
+"""
+Detección de comprobantes casi idénticos por hash perceptual (dHash).
+WhatsApp recomprime las imágenes reenviadas: los bytes cambian pero la imagen
+no, así que el hash SHA256 no alcanza para reconocerlas.
+
+El índice usa multi-index hashing: el hash de 256 bits se parte en 16 bloques
+de 16 bits y cada bloque tiene su propia tabla. Si dos hashes difieren en
+d bits, al menos 16 - d bloques coinciden exactamente, así que alcanza con
+consultar los d + 1 bloques con menos candidatos para no perder ninguno.
+"""
+import io
+import logging
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.paths import get_extraction_cache_path
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# dHash de 16x16 = 256 bits (más resolución que el clásico 8x8 para no
+# confundir comprobantes de la misma app que sólo difieren en el monto)
+HASH_LADO = 16
+HASH_BITS = HASH_LADO * HASH_LADO
+BLOQUE_BITS = 16
+NUM_BLOQUES = HASH_BITS // BLOQUE_BITS
+_MASCARA_BLOQUE = (1 << BLOQUE_BITS) - 1
+
+# Permutación fija de bits: cada bloque toma bits de toda la imagen, así las
+# zonas lisas (fondos, encabezados) no concentran todos los hashes en un bloque
+_PERMUTACION = list(range(HASH_BITS))
+random.Random(20240131).shuffle(_PERMUTACION)
+
+
+def calcular_dhash(imagen_bytes: bytes) -> Optional[int]:
+    """
+    Calcula el dHash de 256 bits de una imagen.
+
+    Args:
+        imagen_bytes: Bytes de la imagen (JPEG, PNG, ...)
+
+    Returns:
+        Hash como entero o None si la imagen no se pudo leer
+    """
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        img = Image.open(io.BytesIO(imagen_bytes))
+        # Decodificar JPEG a resolución reducida (mucho más rápido)
+        img.draft("L", (HASH_LADO * 8, HASH_LADO * 8))
+        img = ImageOps.exif_transpose(img).convert("L")
+        img = img.resize((HASH_LADO + 1, HASH_LADO), Image.LANCZOS)
+        pixeles = list(img.getdata())
+    except Exception as e:
+        logger.debug(f"No se pudo calcular dHash: {e}")
+        return None
+
+    valor = 0
+    bit = 0
+    ancho = HASH_LADO + 1
+    for fila in range(HASH_LADO):
+        base = fila * ancho
+        for col in range(HASH_LADO):
+            if pixeles[base + col] > pixeles[base + col + 1]:
+                valor |= 1 << _PERMUTACION[bit]
+            bit += 1
+    return valor
+
+
+def _bloques(valor: int) -> List[int]:
+    """Parte un hash en NUM_BLOQUES bloques de BLOQUE_BITS bits."""
+    return [(valor >> (i * BLOQUE_BITS)) & _MASCARA_BLOQUE for i in range(NUM_BLOQUES)]
+
+
+class PerceptualIndex:
+    """
+    Índice en memoria de hashes perceptuales con persistencia en SQLite.
+    Cada hash apunta al SHA256 del archivo cuya extracción se guardó en cache.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Args:
+            db_path: Ruta al SQLite (default: el mismo archivo del cache de extracciones)
+        """
+        self.db_path = db_path or get_extraction_cache_path()
+        self._hashes: List[int] = []
+        self._claves: List[str] = []
+        self._tablas: List[Dict[int, List[int]]] = [{} for _ in range(NUM_BLOQUES)]
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._inicializar()
+
+    def _inicializar(self):
+        """Crea la tabla si no existe y carga los hashes guardados."""
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS hashes_perceptuales (
+                    dhash TEXT NOT NULL,
+                    hash_contenido TEXT PRIMARY KEY,
+                    creado REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+            total = self._cargar()
+        if total:
+            logger.info(f"Índice perceptual cargado: {total} comprobantes")
+
+    def _cargar(self) -> int:
+        """Arma el índice en memoria desde el SQLite (con el lock tomado)."""
+        self._hashes.clear()
+        self._claves.clear()
+        self._tablas = [{} for _ in range(NUM_BLOQUES)]
+        filas = self._conn.execute(
+            "SELECT dhash, hash_contenido FROM hashes_perceptuales"
+        ).fetchall()
+        for dhash_hex, hash_contenido in filas:
+            self._agregar_en_memoria(int(dhash_hex, 16), hash_contenido)
+        return len(filas)
+
+    def _agregar_en_memoria(self, valor: int, hash_contenido: str):
+        idx = len(self._hashes)
+        self._hashes.append(valor)
+        self._claves.append(hash_contenido)
+        for tabla, bloque in zip(self._tablas, _bloques(valor)):
+            tabla.setdefault(bloque, []).append(idx)
+
+    def agregar(self, valor: int, hash_contenido: str):
+        """
+        Agrega un hash al índice (y lo persiste).
+
+        Args:
+            valor: dHash de la imagen
+            hash_contenido: SHA256 del archivo original
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO hashes_perceptuales (dhash, hash_contenido, creado) VALUES (?, ?, ?)",
+                (format(valor, "x"), hash_contenido, time.time())
+            )
+            self._conn.commit()
+            if cursor.rowcount:
+                self._agregar_en_memoria(valor, hash_contenido)
+
+    def purgar(self) -> int:
+        """
+        Elimina los hashes cuya extracción ya no está en el cache (expiró o
+        se desalojó por tamaño).
+
+        Returns:
+            Cantidad de hashes eliminados
+        """
+        with self._lock:
+            try:
+                eliminados = self._conn.execute(
+                    "DELETE FROM hashes_perceptuales WHERE hash_contenido NOT IN "
+                    "(SELECT hash FROM extracciones)"
+                ).rowcount
+            except sqlite3.OperationalError:
+                # Sin tabla de extracciones (índice en otro archivo)
+                return 0
+            self._conn.commit()
+            if eliminados:
+                self._cargar()
+        if eliminados:
+            logger.info(f"Índice perceptual: {eliminados} hashes de extracciones vencidas eliminados")
+        return eliminados
+
+    def buscar(self, valor: int, distancia_maxima: int) -> Optional[Tuple[str, int]]:
+        """
+        Busca el hash más cercano dentro de una distancia de Hamming.
+
+        Args:
+            valor: dHash a buscar
+            distancia_maxima: Bits distintos permitidos (menor a NUM_BLOQUES)
+
+        Returns:
+            Tuple (hash_contenido, distancia) del más cercano, o None
+        """
+        distancia_maxima = min(distancia_maxima, NUM_BLOQUES - 1)
+        with self._lock:
+            # Alcanza con los d + 1 bloques con menos candidatos
+            buckets = sorted(
+                (tabla.get(bloque, ()) for tabla, bloque in zip(self._tablas, _bloques(valor))),
+                key=len
+            )[:distancia_maxima + 1]
+
+            mejor: Optional[Tuple[str, int]] = None
+            vistos = set()
+            for bucket in buckets:
+                for idx in bucket:
+                    if idx in vistos:
+                        continue
+                    vistos.add(idx)
+                    distancia = (self._hashes[idx] ^ valor).bit_count()
+                    if distancia <= distancia_maxima and (mejor is None or distancia < mejor[1]):
+                        mejor = (self._claves[idx], distancia)
+                        if distancia == 0:
+                            return mejor
+        return mejor
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+
+# Instancia global para uso compartido
+_index_instance: Optional[PerceptualIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_perceptual_index() -> Optional[PerceptualIndex]:
+    """Obtiene la instancia global del índice (None si Pillow no está disponible)."""
+    global _index_instance
+    if not PIL_AVAILABLE:
+        return None
+    with _index_lock:
+        if _index_instance is None:
+            try:
+                _index_instance = PerceptualIndex()
+            except Exception as e:
+                logger.error(f"No se pudo abrir el índice perceptual: {e}")
+                return None
+    return _index_instance
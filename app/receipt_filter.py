@@ -0,0 +1,247 @@
+"""
+Prefiltro local de imágenes que no son comprobantes.
+
+Por WhatsApp llegan selfies, memes y stickers; cada uno cuesta una llamada a
+Vision que termina con confianza < 0.5. Antes de pagarla se mira la imagen
+en miniatura (unos pocos ms):
+- stickers: gran parte del fondo transparente (se rechazan)
+- imágenes sin fondo dominante (fotos, aunque sea de un ticket sobre una
+  mesa): se lee el texto con tesseract sobre la imagen reducida (del orden
+  de cientos de ms, con un tope de TIEMPO_MAX_OCR); con palabras típicas
+  ("transferencia", "CBU", "$", ...) pasa y casi sin texto se rechaza.
+  Sin OCR van al modelo: el color y el fondo solos no alcanzan para
+  descartar un comprobante fotografiado
+
+tesseract viene en la imagen de Docker y en el instalador de Windows (el
+launcher pasa su ruta en TESSERACT_CMD); en una instalación con pip hay que
+instalar el binario aparte. Sin él sólo se rechazan stickers, y /metrics
+informa "ocr": false.
+
+Sólo se rechazan los casos obvios; ante la duda la imagen va al modelo.
+"""
+import io
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from app.config import (
+    PREFILTER_ENABLED, PREFILTER_OCR, PREFILTER_MIN_BACKGROUND, PREFILTER_MAX_COLORFULNESS
+)
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    Image = None
+
+try:
+    import pytesseract
+    PYTESSERACT_AVAILABLE = True
+except ImportError:
+    PYTESSERACT_AVAILABLE = False
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+# Lado de la miniatura para las heurísticas de imagen
+LADO_MINIATURA = 96
+# Lado largo de la imagen que se pasa a tesseract (más chica = más rápido;
+# alcanza para leer los títulos y montos de un comprobante)
+LADO_OCR = 640
+# Segundos máximos de OCR por imagen; si se pasa, la imagen va al modelo
+TIEMPO_MAX_OCR = 2
+# Tolerancia (0-255) alrededor del tono dominante para contarlo como fondo
+TOLERANCIA_FONDO = 10
+# Fracción de píxeles transparentes a partir de la cual es un sticker
+MAX_TRANSPARENCIA = 0.25
+# Por debajo de esta fracción de fondo la imagen es dudosa y se consulta el OCR
+FONDO_DUDOSO = 0.45
+# Caracteres alfanuméricos mínimos que tiene que leer el OCR en un comprobante
+MIN_CARACTERES_OCR = 25
+# Muestras de tiempo que se guardan para los percentiles
+MUESTRAS_TIEMPO = 1000
+
+PALABRAS_CLAVE = re.compile(
+    r"transfer|comprobante|\bcbu\b|\bcvu\b|\balias\b|importe|monto|operaci[oó]n|"
+    r"destinatario|beneficiario|origen|destino|\$",
+    re.IGNORECASE
+)
+
+_tesseract_disponible: Optional[bool] = None
+
+
+def _ocr_disponible() -> bool:
+    """Indica si se puede usar tesseract (módulo y binario instalados)."""
+    global _tesseract_disponible
+    if _tesseract_disponible is None:
+        _tesseract_disponible = False
+        if PYTESSERACT_AVAILABLE and PREFILTER_OCR:
+            # Ejecutable embebido (instalador de Windows) o instalado fuera del PATH
+            if os.environ.get("TESSERACT_CMD"):
+                pytesseract.pytesseract.tesseract_cmd = os.environ["TESSERACT_CMD"]
+            try:
+                pytesseract.get_tesseract_version()
+                _tesseract_disponible = True
+            except Exception:
+                logger.info("tesseract no está instalado, el prefiltro usa sólo heurísticas de imagen")
+    return _tesseract_disponible
+
+
+def _fraccion_transparente(img: "Image.Image") -> float:
+    """Fracción de píxeles con alfa < 128 (0 si la imagen no tiene transparencia)."""
+    if img.mode not in ("RGBA", "LA", "PA") and "transparency" not in img.info:
+        return 0.0
+    alfa = img.convert("RGBA").getchannel("A")
+    histograma = alfa.histogram()
+    return sum(histograma[:128]) / max(1, alfa.width * alfa.height)
+
+
+def _fraccion_fondo(gris: "Image.Image") -> float:
+    """Fracción de píxeles cerca del tono dominante (fondo liso de una captura)."""
+    histograma = gris.histogram()
+    dominante = max(range(256), key=histograma.__getitem__)
+    desde, hasta = max(0, dominante - TOLERANCIA_FONDO), min(255, dominante + TOLERANCIA_FONDO)
+    return sum(histograma[desde:hasta + 1]) / max(1, gris.width * gris.height)
+
+
+def _colorido(rgb: "Image.Image") -> float:
+    """Métrica de colorido de Hasler y Süsstrunk (0 = gris; fotos > 40)."""
+    rg, yb = [], []
+    for r, g, b in rgb.getdata():
+        rg.append(r - g)
+        yb.append((r + g) / 2 - b)
+    n = len(rg)
+    media_rg, media_yb = sum(rg) / n, sum(yb) / n
+    var_rg = sum((x - media_rg) ** 2 for x in rg) / n
+    var_yb = sum((x - media_yb) ** 2 for x in yb) / n
+    return (var_rg + var_yb) ** 0.5 + 0.3 * (media_rg ** 2 + media_yb ** 2) ** 0.5
+
+
+def _leer_texto(img: "Image.Image") -> str:
+    """OCR rápido de la imagen reducida (texto disperso, sin layout)."""
+    gris = img.convert("L")
+    gris.thumbnail((LADO_OCR, LADO_OCR))
+    return pytesseract.image_to_string(gris, config="--psm 11", timeout=TIEMPO_MAX_OCR)
+
+
+def evaluar_imagen(contenido: bytes) -> dict:
+    """
+    Decide si una imagen puede ser un comprobante.
+
+    Args:
+        contenido: Bytes de la imagen (JPEG, PNG, WEBP, ...)
+
+    Returns:
+        Dict con "es_comprobante", "motivo" (por qué se rechazó, o None),
+        "caracteristicas" y "tiempo_ms"
+    """
+    inicio = time.perf_counter()
+    resultado = {"es_comprobante": True, "motivo": None, "caracteristicas": {}}
+    if not PREFILTER_ENABLED or not PIL_AVAILABLE:
+        resultado["tiempo_ms"] = 0.0
+        return resultado
+
+    try:
+        img = Image.open(io.BytesIO(contenido))
+        img.draft("RGB", (LADO_MINIATURA * 4, LADO_MINIATURA * 4))  # decodifica JPEG reducido
+        img.load()
+    except Exception as e:
+        # Si no se puede leer, que decida el pipeline normal
+        logger.debug(f"Prefiltro: no se pudo abrir la imagen ({e})")
+        resultado["tiempo_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        return resultado
+
+    transparencia = _fraccion_transparente(img)
+    miniatura = img.convert("RGB")
+    miniatura.thumbnail((LADO_MINIATURA, LADO_MINIATURA))
+    fondo = _fraccion_fondo(miniatura.convert("L"))
+    colorido = _colorido(miniatura)
+    caracteristicas = {
+        "transparencia": round(transparencia, 3),
+        "fondo": round(fondo, 3),
+        "colorido": round(colorido, 1)
+    }
+    # Una foto no se rechaza sola: puede ser la de un ticket, la decide el OCR
+    parece_foto = fondo < PREFILTER_MIN_BACKGROUND and colorido > PREFILTER_MAX_COLORFULNESS
+    if parece_foto:
+        caracteristicas["parece_foto"] = True
+
+    if transparencia >= MAX_TRANSPARENCIA:
+        resultado.update(es_comprobante=False, motivo="sticker")
+    elif (fondo < FONDO_DUDOSO or parece_foto) and _ocr_disponible():
+        try:
+            texto = _leer_texto(img)
+        except Exception as e:
+            logger.debug(f"Prefiltro: falló el OCR ({e})")
+        else:
+            caracteres = sum(1 for c in texto if c.isalnum())
+            caracteristicas["caracteres_ocr"] = caracteres
+            caracteristicas["palabras_clave"] = len(PALABRAS_CLAVE.findall(texto))
+            if not caracteristicas["palabras_clave"] and caracteres < MIN_CARACTERES_OCR:
+                resultado.update(es_comprobante=False, motivo="sin_texto")
+
+    resultado["caracteristicas"] = caracteristicas
+    resultado["tiempo_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    return resultado
+
+
+def _percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return round(ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))], 1)
+
+
+class PrefiltroStats:
+    """Imágenes evaluadas, rechazadas por motivo, tiempo y costo evitado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._evaluadas = 0
+        self._rechazadas = 0
+        self._motivos: Dict[str, int] = {}
+        self._costo_evitado_usd = 0.0
+        self._tiempos = deque(maxlen=MUESTRAS_TIEMPO)
+
+    def registrar(self, evaluacion: dict, costo_evitado_usd: float = 0.0):
+        """Registra una evaluación (y el costo estimado que evitó, si la rechazó)."""
+        with self._lock:
+            self._evaluadas += 1
+            self._tiempos.append(evaluacion.get("tiempo_ms", 0.0))
+            if not evaluacion["es_comprobante"]:
+                self._rechazadas += 1
+                self._motivos[evaluacion["motivo"]] = self._motivos.get(evaluacion["motivo"], 0) + 1
+                self._costo_evitado_usd += costo_evitado_usd
+
+    def obtener_estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "habilitado": PREFILTER_ENABLED,
+                "ocr": bool(_tesseract_disponible),
+                "evaluadas": self._evaluadas,
+                "rechazadas": self._rechazadas,
+                "tasa_rechazo": round(self._rechazadas / self._evaluadas, 4) if self._evaluadas else 0.0,
+                "motivos": dict(self._motivos),
+                "costo_evitado_usd": round(self._costo_evitado_usd, 6),
+                "tiempo_p50_ms": _percentil(list(self._tiempos), 50),
+                "tiempo_p95_ms": _percentil(list(self._tiempos), 95)
+            }
+
+
+# Instancia global para uso compartido
+_stats_instance: Optional[PrefiltroStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_prefiltro_stats() -> PrefiltroStats:
+    """Obtiene la instancia global de estadísticas del prefiltro."""
+    global _stats_instance
+    with _stats_lock:
+        if _stats_instance is None:
+            _stats_instance = PrefiltroStats()
+    return _stats_instance
@@ -0,0 +1,78 @@
+"""
+Esquema de la respuesta del modelo.
+
+El mismo modelo pydantic sirve para dos cosas:
+- generar el JSON schema estricto que se manda en response_format, así el
+  modelo sólo puede responder con estos campos (y el prompt no necesita
+  repetir la lista)
+- validar la respuesta con el validador compilado de pydantic-core
+"""
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+
+class RespuestaInvalida(ValueError):
+    """La respuesta del modelo no cumple el esquema del comprobante."""
+
+
+class ComprobanteExtraido(BaseModel):
+    """Campos que el modelo extrae de un comprobante."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    emisor_nombre: str = Field(description="Nombre y apellido completo de quien ENVÍA el dinero, o vacío")
+    emisor_cuil: str = Field(description="CUIL/CUIT del emisor con formato XX-XXXXXXXX-X, o vacío")
+    emisor_cbu: str = Field(description="CBU/CVU del emisor, 22 dígitos, o vacío")
+    banco_emisor: str = Field(description="Banco o app desde donde se envía")
+    receptor_nombre: str = Field(description="Nombre y apellido de quien RECIBE el dinero, o vacío")
+    receptor_cuil: str = Field(description="CUIL/CUIT del receptor con formato XX-XXXXXXXX-X, o vacío")
+    receptor_cbu: str = Field(description="CBU/CVU del receptor, 22 dígitos, o vacío")
+    banco_receptor: str = Field(description="Banco o app que recibe")
+    monto: str = Field(description="Monto principal, sólo el número sin símbolos ni separadores de miles. Ej: 650000.50")
+    fecha_operacion: str = Field(description="Fecha y hora de la operación, DD/MM/YYYY HH:mm")
+    referencia: str = Field(description="Código o número de operación, o vacío")
+    concepto: str = Field(description="Concepto o motivo de la transferencia, o vacío")
+    confianza: float = Field(description="Confianza de 0 a 1 en la extracción")
+
+
+def _quitar_titulos(schema: dict) -> dict:
+    """Elimina los "title" que agrega pydantic (no aportan y suman tokens)."""
+    schema.pop("title", None)
+    for propiedad in schema.get("properties", {}).values():
+        propiedad.pop("title", None)
+    return schema
+
+
+# response_format para chat.completions (structured outputs, modo estricto)
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "comprobante",
+        "strict": True,
+        "schema": _quitar_titulos(ComprobanteExtraido.model_json_schema())
+    }
+}
+
+
+def validar_respuesta(content) -> dict:
+    """
+    Valida la respuesta del modelo contra el esquema.
+
+    Args:
+        content: Texto devuelto por el modelo
+
+    Returns:
+        Dict con los campos del comprobante
+
+    Raises:
+        RespuestaInvalida: si la respuesta falta, no es JSON o no cumple el esquema
+    """
+    if not content:
+        raise RespuestaInvalida("El modelo no devolvió contenido")
+    try:
+        return ComprobanteExtraido.model_validate_json(content).model_dump()
+    except ValidationError as e:
+        errores = "; ".join(
+            f"{'.'.join(str(p) for p in err['loc']) or 'json'}: {err['msg']}"
+            for err in e.errors()[:10]
+        )
+        raise RespuestaInvalida(errores) from e
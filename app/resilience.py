@@ -0,0 +1,422 @@
+"""
+Resiliencia de las llamadas a OpenAI.
+
+- TokenBucket: limita pedidos por minuto (RPM) y tokens por minuto (TPM)
+  de cada modelo según los límites de la cuenta, antes de que OpenAI
+  responda 429.
+- Reintentos con backoff exponencial y jitter completo, sólo para errores
+  reintentables (429, 5xx, timeouts, conexión). Respeta Retry-After.
+- CircuitBreaker: después de varias fallas seguidas deja de llamar a la API
+  durante un tiempo y falla rápido; así una caída de OpenAI no consume la
+  cola ni marca archivos como procesados.
+
+Todo es seguro entre hilos (folder watcher) y tiene variante asíncrona (API).
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import openai
+
+from app.config import (
+    OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, OPENAI_MODEL_LIMITS, OPENAI_TOKENS_PER_CALL,
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Códigos HTTP que vale la pena reintentar
+CODIGOS_REINTENTABLES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitoAbierto(Exception):
+    """El circuito está abierto: no se llama a la API hasta que pase la espera."""
+
+    def __init__(self, segundos_restantes: float):
+        self.segundos_restantes = segundos_restantes
+        super().__init__(f"OpenAI no disponible (circuito abierto), reintentar en {segundos_restantes:.0f}s")
+
+
+class TokenBucket:
+    """
+    Balde de tokens seguro entre hilos.
+
+    Cada pedido reserva sus tokens aunque el balde quede en negativo y espera
+    lo que tarde en reponerse esa deuda; así los pedidos se atienden en orden
+    de llegada sin sondear.
+    """
+
+    def __init__(self, capacidad: float, por_segundo: float):
+        """
+        Args:
+            capacidad: Máximo acumulable (ráfaga permitida)
+            por_segundo: Reposición por segundo
+        """
+        self.capacidad = float(capacidad)
+        self.por_segundo = float(por_segundo)
+        self._disponibles = float(capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reponer(self):
+        ahora = time.monotonic()
+        self._disponibles = min(self.capacidad, self._disponibles + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def reservar(self, cantidad: float) -> float:
+        """Reserva cantidad y retorna los segundos a esperar antes de usarla."""
+        with self._lock:
+            self._reponer()
+            self._disponibles -= min(cantidad, self.capacidad)
+            if self._disponibles >= 0:
+                return 0.0
+            return -self._disponibles / self.por_segundo
+
+    def devolver(self, cantidad: float):
+        """
+        Devuelve tokens reservados de más (o cobra los que faltaron, si es
+        negativo). La deuda no pasa de un balde entero: una estimación muy
+        corta no frena las llamadas siguientes más que una reposición completa.
+        """
+        with self._lock:
+            self._reponer()
+            self._disponibles = max(-self.capacidad, min(self.capacidad, self._disponibles + cantidad))
+
+    def adquirir(self, cantidad: float = 1):
+        """Reserva y espera bloqueando el hilo."""
+        espera = self.reservar(cantidad)
+        if espera > 0:
+            time.sleep(espera)
+
+    async def adquirir_async(self, cantidad: float = 1):
+        """Reserva y espera sin bloquear el event loop."""
+        espera = self.reservar(cantidad)
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    def obtener_estado(self) -> dict:
+        with self._lock:
+            self._reponer()
+            return {
+                "disponibles": round(self._disponibles, 1),
+                "capacidad": self.capacidad,
+                "por_segundo": round(self.por_segundo, 3)
+            }
+
+
+class LimitadorOpenAI:
+    """
+    Límites de la cuenta por modelo, como los aplica OpenAI: un balde para
+    pedidos y otro para tokens de cada modelo (se crean al primer uso).
+    """
+
+    def __init__(self, rpm: int, tpm: int, tokens_por_llamada: int,
+                 limites_modelo: Optional[Dict[str, dict]] = None):
+        """
+        Args:
+            rpm: Pedidos por minuto de cada modelo (0 = sin límite)
+            tpm: Tokens por minuto de cada modelo (0 = sin límite)
+            tokens_por_llamada: Reserva de una llamada sin estimación propia
+            limites_modelo: {"modelo": {"rpm": ..., "tpm": ...}} que pisan rpm/tpm
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.tokens_por_llamada = tokens_por_llamada
+        self.limites_modelo = limites_modelo or {}
+        self._baldes: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._lock = threading.Lock()
+
+    def _baldes_de(self, modelo: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        """(pedidos, tokens) del modelo."""
+        with self._lock:
+            baldes = self._baldes.get(modelo)
+            if baldes is None:
+                limites = self.limites_modelo.get(modelo, {})
+                rpm = int(limites.get("rpm", self.rpm))
+                tpm = int(limites.get("tpm", self.tpm))
+                baldes = self._baldes[modelo] = (
+                    TokenBucket(rpm, rpm / 60) if rpm > 0 else None,
+                    TokenBucket(tpm, tpm / 60) if tpm > 0 else None
+                )
+            return baldes
+
+    def _espera(self, modelo: str, tokens: Optional[int]) -> Tuple[float, int]:
+        """Reserva un pedido y los tokens; retorna (segundos a esperar, tokens reservados)."""
+        pedidos, baldes_tokens = self._baldes_de(modelo)
+        espera, reservados = 0.0, 0
+        if pedidos:
+            espera = max(espera, pedidos.reservar(1))
+        if baldes_tokens:
+            # El balde no reserva más que su capacidad
+            reservados = int(min(tokens or self.tokens_por_llamada, baldes_tokens.capacidad))
+            espera = max(espera, baldes_tokens.reservar(reservados))
+        return espera, reservados
+
+    def esperar(self, modelo: str = "", tokens: Optional[int] = None) -> int:
+        """
+        Espera turno para una llamada (sincrónico).
+
+        Args:
+            modelo: Modelo de la llamada (cada uno tiene sus baldes)
+            tokens: Tokens estimados de la llamada (None = tokens_por_llamada)
+
+        Returns:
+            Tokens reservados, para ajustar con el uso real
+        """
+        espera, reservados = self._espera(modelo, tokens)
+        if espera > 0:
+            logger.info(f"Límite de OpenAI ({modelo or 'sin modelo'}): esperando {espera:.1f}s")
+            time.sleep(espera)
+        return reservados
+
+    async def esperar_async(self, modelo: str = "", tokens: Optional[int] = None) -> int:
+        """Espera turno para una llamada sin bloquear el event loop."""
+        espera, reservados = self._espera(modelo, tokens)
+        if espera > 0:
+            logger.info(f"Límite de OpenAI ({modelo or 'sin modelo'}): esperando {espera:.1f}s")
+            await asyncio.sleep(espera)
+        return reservados
+
+    def ajustar(self, modelo: str, reservados: int, tokens_reales: int):
+        """Corrige el balde de tokens del modelo con el uso real de la respuesta."""
+        _, baldes_tokens = self._baldes_de(modelo)
+        if baldes_tokens and tokens_reales:
+            baldes_tokens.devolver(reservados - tokens_reales)
+
+    def obtener_estado(self) -> dict:
+        with self._lock:
+            baldes = dict(self._baldes)
+        return {
+            modelo or "sin_modelo": {
+                "pedidos": pedidos.obtener_estado() if pedidos else None,
+                "tokens": tokens.obtener_estado() if tokens else None
+            }
+            for modelo, (pedidos, tokens) in baldes.items()
+        }
+
+
+class CircuitBreaker:
+    """
+    Circuito de tres estados:
+    - cerrado: las llamadas pasan; cuenta fallas seguidas
+    - abierto: falla rápido con CircuitoAbierto durante segundos_abierto
+    - semi_abierto: deja pasar una sola llamada de prueba; si anda se cierra
+    """
+
+    def __init__(self, umbral_fallos: int, segundos_abierto: float):
+        self.umbral_fallos = umbral_fallos
+        self.segundos_abierto = segundos_abierto
+        self._lock = threading.Lock()
+        self._estado = "cerrado"
+        self._fallos_seguidos = 0
+        self._abierto_hasta = 0.0
+        self._prueba_en_curso = False
+        self._prueba_desde = 0.0
+        self._aperturas = 0
+        self._rechazadas = 0
+        self._ultimo_error: Optional[str] = None
+
+    def permitir(self):
+        """
+        Verifica si se puede llamar a la API.
+
+        Raises:
+            CircuitoAbierto: si el circuito está abierto (o ya hay una prueba en curso)
+        """
+        with self._lock:
+            if self._estado == "cerrado":
+                return
+            restante = self._abierto_hasta - time.monotonic()
+            if self._estado == "abierto" and restante <= 0:
+                self._estado = "semi_abierto"
+            # Una prueba que nunca reportó (tarea cancelada) no bloquea para siempre
+            prueba_vencida = time.monotonic() - self._prueba_desde > self.segundos_abierto
+            if self._estado == "semi_abierto" and (not self._prueba_en_curso or prueba_vencida):
+                self._prueba_en_curso = True
+                self._prueba_desde = time.monotonic()
+                return
+            self._rechazadas += 1
+            raise CircuitoAbierto(max(restante, 1.0))
+
+    def registrar_exito(self):
+        with self._lock:
+            if self._estado != "cerrado":
+                logger.info("Circuito de OpenAI cerrado: la API volvió a responder")
+            self._estado = "cerrado"
+            self._fallos_seguidos = 0
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self, error: Exception):
+        with self._lock:
+            self._fallos_seguidos += 1
+            self._ultimo_error = f"{type(error).__name__}: {error}"[:200]
+            self._prueba_en_curso = False
+            if self._estado == "semi_abierto" or self._fallos_seguidos >= self.umbral_fallos:
+                if self._estado != "abierto":
+                    self._aperturas += 1
+                    logger.error(
+                        f"Circuito de OpenAI abierto por {self.segundos_abierto:.0f}s "
+                        f"({self._fallos_seguidos} fallas seguidas): {self._ultimo_error}"
+                    )
+                self._estado = "abierto"
+                self._abierto_hasta = time.monotonic() + self.segundos_abierto
+
+    def segundos_para_reintento(self) -> float:
+        """Segundos hasta que el circuito deje pasar una llamada (0 si está cerrado)."""
+        with self._lock:
+            if self._estado == "cerrado":
+                return 0.0
+            return max(self._abierto_hasta - time.monotonic(), 0.0)
+
+    def obtener_estado(self) -> dict:
+        with self._lock:
+            estado = self._estado
+            if estado == "abierto" and self._abierto_hasta <= time.monotonic():
+                estado = "semi_abierto"
+            return {
+                "estado": estado,
+                "fallos_seguidos": self._fallos_seguidos,
+                "aperturas": self._aperturas,
+                "rechazadas": self._rechazadas,
+                "reintentar_en_s": round(max(self._abierto_hasta - time.monotonic(), 0.0), 1) if estado != "cerrado" else 0.0,
+                "ultimo_error": self._ultimo_error
+            }
+
+
+def es_reintentable(error: Exception) -> bool:
+    """Indica si un error de OpenAI es transitorio (rate limit, 5xx, red)."""
+    if isinstance(error, CircuitoAbierto):
+        return True
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in CODIGOS_REINTENTABLES
+    return False
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Segundos pedidos por la API en el header Retry-After, si vino."""
+    respuesta = getattr(error, "response", None)
+    if respuesta is None:
+        return None
+    valor = respuesta.headers.get("retry-after-ms")
+    if valor:
+        try:
+            return float(valor) / 1000
+        except ValueError:
+            pass
+    valor = respuesta.headers.get("retry-after")
+    try:
+        return float(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def espera_reintento(intento: int, error: Exception) -> float:
+    """Backoff exponencial con jitter completo; respeta Retry-After si es mayor."""
+    espera = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** intento)))
+    pedido = _retry_after(error)
+    if pedido is not None:
+        espera = max(espera, min(pedido, RETRY_MAX_SECONDS))
+    return espera
+
+
+def _tokens_usados(respuesta) -> int:
+    """Tokens reales de la respuesta (0 si no trae usage)."""
+    usage = getattr(respuesta, "usage", None)
+    if usage is None:
+        return 0
+    return getattr(usage, "total_tokens", 0) or 0
+
+
+def llamar_con_reintentos(fn: Callable[[], object], modelo: str = "", tokens_estimados: Optional[int] = None):
+    """
+    Ejecuta una llamada a OpenAI (sincrónica) con límites, reintentos y circuito.
+
+    Args:
+        fn: La llamada
+        modelo: Modelo de la llamada, para usar sus límites
+        tokens_estimados: Tokens a reservar (entrada + max_tokens); None = tokens_estimados_llamada
+
+    Raises:
+        CircuitoAbierto: si el circuito está abierto
+        La última excepción de OpenAI si no se pudo después de los reintentos
+    """
+    limitador, circuito = get_limitador(), get_circuito()
+    for intento in range(RETRY_MAX_ATTEMPTS):
+        circuito.permitir()
+        reservados = limitador.esperar(modelo, tokens_estimados)
+        try:
+            respuesta = fn()
+        except Exception as e:
+            if not es_reintentable(e):
+                circuito.registrar_exito()  # la API respondió; el error es del pedido
+                raise
+            circuito.registrar_fallo(e)
+            if intento == RETRY_MAX_ATTEMPTS - 1:
+                raise
+            espera = espera_reintento(intento, e)
+            logger.warning(f"Error reintentable de OpenAI ({e}), reintento {intento + 1} en {espera:.1f}s")
+            time.sleep(espera)
+            continue
+        circuito.registrar_exito()
+        limitador.ajustar(modelo, reservados, _tokens_usados(respuesta))
+        return respuesta
+
+
+async def llamar_con_reintentos_async(
+    fn: Callable[[], Awaitable[object]],
+    modelo: str = "",
+    tokens_estimados: Optional[int] = None
+):
+    """Variante asíncrona de llamar_con_reintentos (las esperas no bloquean el loop)."""
+    limitador, circuito = get_limitador(), get_circuito()
+    for intento in range(RETRY_MAX_ATTEMPTS):
+        circuito.permitir()
+        reservados = await limitador.esperar_async(modelo, tokens_estimados)
+        try:
+            respuesta = await fn()
+        except Exception as e:
+            if not es_reintentable(e):
+                circuito.registrar_exito()
+                raise
+            circuito.registrar_fallo(e)
+            if intento == RETRY_MAX_ATTEMPTS - 1:
+                raise
+            espera = espera_reintento(intento, e)
+            logger.warning(f"Error reintentable de OpenAI ({e}), reintento {intento + 1} en {espera:.1f}s")
+            await asyncio.sleep(espera)
+            continue
+        circuito.registrar_exito()
+        limitador.ajustar(modelo, reservados, _tokens_usados(respuesta))
+        return respuesta
+
+
+# Instancias globales para uso compartido
+_limitador_instance: Optional[LimitadorOpenAI] = None
+_circuito_instance: Optional[CircuitBreaker] = None
+_instancias_lock = threading.Lock()
+
+
+def get_limitador() -> LimitadorOpenAI:
+    """Obtiene el limitador global de RPM/TPM."""
+    global _limitador_instance
+    with _instancias_lock:
+        if _limitador_instance is None:
+            _limitador_instance = LimitadorOpenAI(
+                OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, OPENAI_TOKENS_PER_CALL, OPENAI_MODEL_LIMITS
+            )
+    return _limitador_instance
+
+
+def get_circuito() -> CircuitBreaker:
+    """Obtiene el circuit breaker global de OpenAI."""
+    global _circuito_instance
+    with _instancias_lock:
+        if _circuito_instance is None:
+            _circuito_instance = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS)
+    return _circuito_instance
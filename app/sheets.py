@@ -1,45 +1,38 @@
 """
 Integración con Google Sheets para guardar los datos de transferencias.
 """
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    SHEETS_AVAILABLE = True
-except ImportError:
-    SHEETS_AVAILABLE = False
-    gspread = None
-    Credentials = None
-
 from datetime import datetime
-from typing import Optional
 from app.config import GOOGLE_CREDENTIALS_PATH, GOOGLE_SHEET_ID, GOOGLE_SHEET_NAME
 from app.paths import resolve_appdata_path
 from app.validator import identificar_cuenta_destino
-
-
-# Scopes necesarios para Google Sheets
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
+from storage.sheets_session import get_sesion_sheets
+from storage.sheets_storage import agregar_filas
 
 
 def get_sheets_client():
     """
-    Obtiene un cliente autenticado de Google Sheets.
+    Obtiene el cliente autenticado de Google Sheets (sesión compartida del proceso).
     """
-    if not SHEETS_AVAILABLE:
-        raise ImportError("Librería gspread no instalada (Modo Lite).")
+    credentials_path = resolve_appdata_path(GOOGLE_CREDENTIALS_PATH)
+    if not GOOGLE_CREDENTIALS_PATH:
+        raise ValueError("GOOGLE_CREDENTIALS_PATH no configurado en .env")
+    return get_sesion_sheets(credentials_path).cliente
 
+
+def _get_hoja():
+    """Hoja configurada en .env, reutilizada entre llamadas."""
     credentials_path = resolve_appdata_path(GOOGLE_CREDENTIALS_PATH)
-    if not credentials_path:
+    if not GOOGLE_CREDENTIALS_PATH:
         raise ValueError("GOOGLE_CREDENTIALS_PATH no configurado en .env")
-    
-    credentials = Credentials.from_service_account_file(
-        credentials_path,
-        scopes=SCOPES
-    )
-    return gspread.authorize(credentials)
+    return get_sesion_sheets(credentials_path).hoja(GOOGLE_SHEET_ID, GOOGLE_SHEET_NAME, HEADERS)
+
+
+def _invalidar_hoja():
+    """Después de un error, la próxima llamada reabre la hoja."""
+    try:
+        get_sesion_sheets(resolve_appdata_path(GOOGLE_CREDENTIALS_PATH)).invalidar(GOOGLE_SHEET_ID, GOOGLE_SHEET_NAME)
+    except (ImportError, ValueError):
+        pass
 
 
 # Headers definidos
@@ -61,17 +54,8 @@ def guardar_transferencia(
     Guarda una transferencia en Google Sheets con validaciones y formato.
     """
     try:
-        client = get_sheets_client()
-        sheet = client.open_by_key(GOOGLE_SHEET_ID).worksheet(GOOGLE_SHEET_NAME)
-        
-        # 0. Verificar/Actualizar Headers
-        # Leemos primera fila para ver si coincide
-        try:
-            first_row = sheet.row_values(1)
-            if not first_row or first_row != HEADERS:
-                sheet.update('A1:K1', [HEADERS])
-        except Exception:
-            pass # Si falla lectura, ignoramos y seguimos intentando append
+        # 0. Hoja de la sesión compartida (los headers se verifican una vez por proceso)
+        sheet = _get_hoja()
             
         # 1. Preparar datos
         # Identificar cuenta destino
@@ -100,46 +84,7 @@ def guardar_transferencia(
             if "deposito" in concepto or "efectivo" in concepto:
                 emisor_nombre = "DEPÓSITO EN EFECTIVO"
 
-        # 2. Detectar duplicados
-        # Traemos todas las filas
-        todas_las_filas = sheet.get_all_values()
-        es_duplicado = False
-        
-        # Normalizamos monto nuevo
-        try:
-            m_new_float = float(monto)
-        except:
-            m_new_float = 0.0
-
-        # Saltamos header (fila 0)
-        for i, row in enumerate(todas_las_filas):
-            if i == 0: continue 
-            if len(row) >= 3:
-                row_fecha = str(row[1]).strip()
-                row_monto = row[2]
-                
-                # Comparación:
-                # 1. Fechas coinciden (string exacto por ahora, idealmente parsear)
-                # 2. Montos coinciden (parseando a float para evitar dif "$100" vs "100")
-                fechas_match = (row_fecha and row_fecha == fecha_deposito)
-                
-                montos_match = False
-                try:
-                    # Limpiar monto row: quitar $ , y espacios
-                    m_row_clean = str(row_monto).replace('$', '').replace(',', '').strip()
-                    if m_row_clean:
-                        m_row_float = float(m_row_clean)
-                        # Margen de error pequeño por coma flotante
-                        if abs(m_row_float - m_new_float) < 1.0:
-                            montos_match = True
-                except:
-                    pass
-                
-                if fechas_match and montos_match:
-                    es_duplicado = True
-                    break
-
-        # 3. Preparar fila
+        # 2. Preparar fila
         whatsapp_link = ""
         if whatsapp_from:
              numero_limpio = whatsapp_from.replace("@c.us", "")
@@ -159,12 +104,12 @@ def guardar_transferencia(
             confianza_str                   # K: Confianza (OPTIMA/REVEER)
         ]
         
-        # 4. Guardar
-        sheet.append_row(fila, value_input_option='USER_ENTERED')
+        # 3. Guardar, detectando duplicados con el espejo local de la hoja
+        #    (compartido con storage/sheets_storage.py)
+        nueva_fila_idx, (es_duplicado,) = agregar_filas(sheet, GOOGLE_SHEET_ID, GOOGLE_SHEET_NAME, [fila])
         
-        # 5. Aplicar formato si es duplicado
+        # 4. Aplicar formato si es duplicado
         if es_duplicado:
-            nueva_fila_idx = len(todas_las_filas) + 1
             rango = f"A{nueva_fila_idx}:K{nueva_fila_idx}"
             sheet.format(rango, {
                 "backgroundColor": {
@@ -180,6 +125,7 @@ def guardar_transferencia(
         }
         
     except Exception as e:
+        _invalidar_hoja()
         return {
             "success": False,
             "error": str(e)
@@ -191,8 +137,7 @@ def verificar_conexion() -> dict:
     Verifica que la conexión con Google Sheets funcione.
     """
     try:
-        client = get_sheets_client()
-        sheet = client.open_by_key(GOOGLE_SHEET_ID).worksheet(GOOGLE_SHEET_NAME)
+        sheet = _get_hoja()
         # Intentar leer la primera celda
         sheet.acell('A1').value
         return {
@@ -200,6 +145,7 @@ def verificar_conexion() -> dict:
             "message": "Conexión exitosa con Google Sheets"
         }
     except Exception as e:
+        _invalidar_hoja()
         return {
             "success": False,
             "error": str(e)
@@ -0,0 +1,153 @@
+"""
+Coalescencia de extracciones idénticas en vuelo (single-flight).
+
+Cuando el mismo comprobante llega a la vez por WhatsApp y por la carpeta,
+la primera llamada (líder) hace la extracción y las demás esperan ese mismo
+resultado en lugar de volver a pagar el modelo. Funciona entre hilos (folder
+watcher, backfill) y entre tareas de asyncio (API): cada vuelo es un
+concurrent.futures.Future, que se puede esperar bloqueando o con
+asyncio.wrap_future.
+
+Las esperas reciben una copia del resultado marcada con "coalescida" y con
+uso en cero: el líder es quien factura; el guardado queda a cargo de quien lo llamó.
+Sólo se les propagan los errores de la extracción: si el líder se cancela (por
+ejemplo el lote que lo lanzó terminó) el vuelo se libera y la primera espera
+reintenta como nuevo líder.
+"""
+import asyncio
+import copy
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.model_router import uso_vacio
+
+logger = logging.getLogger(__name__)
+
+
+class _VueloAbandonado(Exception):
+    """El líder se canceló sin resultado: quien espera debe reintentar."""
+
+
+class SingleFlight:
+    """Registro de extracciones en vuelo por hash de contenido."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vuelos: Dict[str, Future] = {}
+        self._lideres = 0
+        self._coalescidas = 0
+        self._costo_evitado_usd = 0.0
+
+    def _unirse(self, clave: str):
+        """
+        Devuelve (futuro, es_lider). El líder es responsable de completar el
+        futuro y de llamar a _aterrizar.
+        """
+        with self._lock:
+            futuro = self._vuelos.get(clave)
+            if futuro is not None:
+                return futuro, False
+            futuro = Future()
+            self._vuelos[clave] = futuro
+            self._lideres += 1
+            return futuro, True
+
+    def _aterrizar(self, clave: str, futuro: Future, resultado=None, error: Optional[BaseException] = None):
+        """
+        Saca el vuelo del registro y publica su resultado a quienes esperan.
+        Se publica una copia porque el líder puede seguir modificando el suyo.
+        Una cancelación del líder (CancelledError, KeyboardInterrupt) no es un
+        error de la extracción: se publica _VueloAbandonado para que reintenten.
+        """
+        with self._lock:
+            self._vuelos.pop(clave, None)
+        if error is not None and not isinstance(error, Exception):
+            futuro.set_exception(_VueloAbandonado())
+        elif error is not None:
+            futuro.set_exception(error)
+        else:
+            futuro.set_result(copy.deepcopy(resultado))
+
+    def _copia_para_espera(self, resultado):
+        """Copia del resultado del líder para una llamada coalescida."""
+        if not isinstance(resultado, dict):
+            return resultado
+        copia = copy.deepcopy(resultado)
+        uso = copia.get("uso") or {}
+        with self._lock:
+            self._coalescidas += 1
+            self._costo_evitado_usd += uso.get("costo_usd", 0.0)
+        copia["coalescida"] = True
+        copia["uso"] = uso_vacio()
+        for pagina in copia.get("paginas", []):
+            pagina["uso"] = uso_vacio()
+        return copia
+
+    def ejecutar(self, clave: str, fn: Callable[[], dict]) -> dict:
+        """
+        Ejecuta fn una sola vez por clave entre todas las llamadas concurrentes
+        (variante sincrónica, bloquea el hilo mientras espera).
+        """
+        futuro, es_lider = self._unirse(clave)
+        while not es_lider:
+            logger.info(f"Extracción {clave[:20]} ya en vuelo, se espera su resultado")
+            try:
+                return self._copia_para_espera(futuro.result())
+            except _VueloAbandonado:
+                futuro, es_lider = self._unirse(clave)
+        try:
+            resultado = fn()
+        except BaseException as e:
+            self._aterrizar(clave, futuro, error=e)
+            raise
+        self._aterrizar(clave, futuro, resultado)
+        return resultado
+
+    async def ejecutar_async(self, clave: str, fn: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        Variante asíncrona de ejecutar: espera sin bloquear el event loop.
+        La espera va protegida con shield: cancelar a quien espera no debe
+        cancelar el futuro compartido del líder.
+        """
+        futuro, es_lider = self._unirse(clave)
+        while not es_lider:
+            logger.info(f"Extracción {clave[:20]} ya en vuelo, se espera su resultado")
+            try:
+                return self._copia_para_espera(await asyncio.shield(asyncio.wrap_future(futuro)))
+            except _VueloAbandonado:
+                futuro, es_lider = self._unirse(clave)
+        try:
+            resultado = await fn()
+        except BaseException as e:
+            self._aterrizar(clave, futuro, error=e)
+            raise
+        self._aterrizar(clave, futuro, resultado)
+        return resultado
+
+    def obtener_estadisticas(self) -> dict:
+        """Extracciones ejecutadas, coalescidas, en vuelo y costo evitado."""
+        with self._lock:
+            total = self._lideres + self._coalescidas
+            return {
+                "en_vuelo": len(self._vuelos),
+                "ejecutadas": self._lideres,
+                "coalescidas": self._coalescidas,
+                "tasa_coalescencia": round(self._coalescidas / total, 4) if total else 0.0,
+                "costo_evitado_usd": round(self._costo_evitado_usd, 6)
+            }
+
+
+# Instancia global para uso compartido
+_single_flight_instance: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Obtiene la instancia global de coalescencia de extracciones."""
+    global _single_flight_instance
+    with _single_flight_lock:
+        if _single_flight_instance is None:
+            _single_flight_instance = SingleFlight()
+    return _single_flight_instance
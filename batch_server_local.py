@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita la Batch API de OpenAI (archivos + lotes) para
+probar el backfill sin conexión y sin gastar.
+
+Uso:
+    python batch_server_local.py [puerto] [demora_segundos]
+
+y en config.json (sección "extraccion"):
+    "batch_base_url": "http://localhost:8090/v1"
+
+Cada solicitud del lote se responde con un comprobante de ejemplo en el
+mismo formato JSON que devuelve el modelo. El lote pasa por validating ->
+in_progress -> completed después de la demora indicada.
+"""
+import hashlib
+import json
+import sys
+import threading
+import time
+import uuid
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from typing import Optional
+
+app = FastAPI(title="Batch API local")
+
+_archivos = {}
+_lotes = {}
+_lock = threading.Lock()
+DEMORA_SEGUNDOS = 3.0
+
+
+class CrearLote(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str = "24h"
+    metadata: Optional[dict] = None
+
+
+def _respuesta_simulada(custom_id: str, body: dict) -> dict:
+    """Arma una respuesta de chat.completions con un comprobante de ejemplo."""
+    semilla = int(hashlib.sha256(custom_id.encode()).hexdigest()[:8], 16)
+    contenido = {
+        "emisor_nombre": f"Cliente {semilla % 1000:03d}",
+        "emisor_cuil": "20-12345678-6",
+        "emisor_cbu": "",
+        "banco_emisor": "Mercado Pago",
+        "receptor_nombre": "Empresa Demo",
+        "receptor_cuil": "",
+        "receptor_cbu": "",
+        "banco_receptor": "",
+        "monto": str(1000 + semilla % 500000),
+        "fecha_operacion": f"{1 + semilla % 28:02d}/01/2025 {semilla % 24:02d}:{semilla % 60:02d}",
+        "referencia": str(semilla),
+        "concepto": "Varios",
+        "confianza": 0.95
+    }
+    return {
+        "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "request_id": uuid.uuid4().hex,
+            "body": {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", ""),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": json.dumps(contenido, ensure_ascii=False)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 850, "completion_tokens": 180, "total_tokens": 1030}
+            }
+        },
+        "error": None
+    }
+
+
+def _guardar_archivo(contenido: bytes, nombre: str, proposito: str) -> dict:
+    archivo = {
+        "id": f"file-{uuid.uuid4().hex[:24]}",
+        "object": "file",
+        "bytes": len(contenido),
+        "created_at": int(time.time()),
+        "filename": nombre,
+        "purpose": proposito,
+        "status": "processed"
+    }
+    with _lock:
+        _archivos[archivo["id"]] = (archivo, contenido)
+    return archivo
+
+
+def _procesar_lote(batch_id: str):
+    """Simula el procesamiento del lote en segundo plano."""
+    time.sleep(DEMORA_SEGUNDOS / 2)
+    with _lock:
+        lote = _lotes[batch_id]
+        lote["status"] = "in_progress"
+        lote["in_progress_at"] = int(time.time())
+        _, entrada = _archivos[lote["input_file_id"]]
+    time.sleep(DEMORA_SEGUNDOS / 2)
+
+    lineas = []
+    for linea in entrada.decode("utf-8").splitlines():
+        if linea.strip():
+            solicitud = json.loads(linea)
+            lineas.append(json.dumps(_respuesta_simulada(solicitud["custom_id"], solicitud["body"])))
+    salida = _guardar_archivo(("\n".join(lineas) + "\n").encode("utf-8"), f"{batch_id}_output.jsonl", "batch_output")
+
+    with _lock:
+        lote.update({
+            "status": "completed",
+            "output_file_id": salida["id"],
+            "completed_at": int(time.time()),
+            "request_counts": {"total": len(lineas), "completed": len(lineas), "failed": 0}
+        })
+
+
+@app.post("/v1/files")
+async def subir_archivo(file: UploadFile = File(...), purpose: str = Form(...)):
+    return _guardar_archivo(await file.read(), file.filename or "input.jsonl", purpose)
+
+
+@app.get("/v1/files/{file_id}/content", response_class=PlainTextResponse)
+def contenido_archivo(file_id: str):
+    with _lock:
+        if file_id not in _archivos:
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        return _archivos[file_id][1].decode("utf-8")
+
+
+@app.delete("/v1/files/{file_id}")
+def borrar_archivo(file_id: str):
+    with _lock:
+        if _archivos.pop(file_id, None) is None:
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    return {"id": file_id, "object": "file", "deleted": True}
+
+
+@app.post("/v1/batches")
+def crear_lote(pedido: CrearLote):
+    with _lock:
+        if pedido.input_file_id not in _archivos:
+            raise HTTPException(status_code=404, detail="input_file_id no encontrado")
+        total = sum(1 for l in _archivos[pedido.input_file_id][1].splitlines() if l.strip())
+        lote = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": pedido.endpoint,
+            "input_file_id": pedido.input_file_id,
+            "completion_window": pedido.completion_window,
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "errors": None,
+            "metadata": pedido.metadata,
+            "request_counts": {"total": total, "completed": 0, "failed": 0}
+        }
+        _lotes[lote["id"]] = lote
+    threading.Thread(target=_procesar_lote, args=(lote["id"],), daemon=True).start()
+    return lote
+
+
+@app.get("/v1/batches/{batch_id}")
+def consultar_lote(batch_id: str):
+    with _lock:
+        if batch_id not in _lotes:
+            raise HTTPException(status_code=404, detail="Lote no encontrado")
+        return dict(_lotes[batch_id])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 8090
+    if len(sys.argv) > 2:
+        DEMORA_SEGUNDOS = float(sys.argv[2])
+    print(f"📦 Batch API local en http://localhost:{puerto}/v1 (demora {DEMORA_SEGUNDOS}s)")
+    uvicorn.run(app, host="127.0.0.1", port=puerto, log_level="warning")
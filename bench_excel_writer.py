@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del escritor de Excel (storage/excel_storage.py).
+
+Uso:
+    python bench_excel_writer.py [--comparar] [filas_previas ...]
+
+Para cada tamaño (por defecto 1000, 10000 y 100000 filas ya cargadas) arma
+un Excel de prueba y mide: apertura del libro con el índice de duplicados,
+costo por fila agregada (p50/p95, en microsegundos), duración de un
+guardado y latencia de agregar mientras corre ese guardado (máxima y p95,
+en milisegundos). Con --comparar mide también el esquema anterior (abrir y guardar
+el Excel completo por cada comprobante).
+"""
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from openpyxl import Workbook, load_workbook
+
+from storage.excel_storage import HEADERS, ExcelWriter
+
+FILAS_MEDIDAS = 500
+REPETICIONES_ANTERIOR = 3
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+
+def datos_de_prueba(i):
+    return {
+        "archivo_origen": f"comprobante_{i}.jpg",
+        "fecha_operacion": f"{1 + i % 28:02d}/{1 + i % 12:02d}/2025",
+        "monto_numerico": round(random.uniform(1000, 500000), 2),
+        "emisor_nombre": "JUAN PEREZ",
+        "emisor_cuil": "20-12345678-9",
+        "emisor_cbu": "0170099220000067797370",
+        "receptor_nombre": "EMPRESA SA",
+        "receptor_cbu": "0110599520000001234567",
+        "referencia": str(100000 + i),
+        "confianza": 0.95
+    }
+
+
+def crear_excel(ruta, filas):
+    """Excel con `filas` transferencias (modo write_only, rápido para armar el caso)."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Transferencias")
+    ws.append(HEADERS)
+    for i in range(filas):
+        d = datos_de_prueba(i)
+        ws.append([d["archivo_origen"], "API", d["fecha_operacion"], d["monto_numerico"],
+                   d["emisor_nombre"], d["emisor_cuil"], d["emisor_cbu"], "", d["receptor_nombre"],
+                   "", d["receptor_cbu"], "", d["referencia"], "", "OPTIMA", "", ""])
+    wb.save(ruta)
+
+
+def medir_writer(ruta):
+    writer = ExcelWriter(ruta, intervalo_flush=3600, max_pendientes=10 ** 9)
+
+    inicio = time.perf_counter()
+    writer.agregar([datos_de_prueba(0)], [""])
+    apertura = time.perf_counter() - inicio
+
+    tiempos = []
+    for i in range(1, FILAS_MEDIDAS + 1):
+        inicio = time.perf_counter()
+        writer.agregar([datos_de_prueba(i)], ["5491122334455@c.us"])
+        tiempos.append((time.perf_counter() - inicio) * 1e6)
+
+    # Guardado en otro hilo mientras se siguen agregando filas
+    resultado = {}
+
+    def guardar():
+        inicio = time.perf_counter()
+        writer.flush()
+        resultado["guardado"] = time.perf_counter() - inicio
+
+    hilo = threading.Thread(target=guardar)
+    hilo.start()
+    durante = []
+    i = FILAS_MEDIDAS
+    while hilo.is_alive():
+        i += 1
+        inicio = time.perf_counter()
+        writer.agregar([datos_de_prueba(i)], [""])
+        durante.append((time.perf_counter() - inicio) * 1e3)
+        time.sleep(0.001)
+    hilo.join()
+    writer.cerrar()
+    return apertura, tiempos, resultado["guardado"], durante or [0.0]
+
+
+def medir_anterior(ruta):
+    """Esquema anterior: load_workbook + append + save por comprobante."""
+    tiempos = []
+    for i in range(REPETICIONES_ANTERIOR):
+        inicio = time.perf_counter()
+        wb = load_workbook(ruta)
+        wb.active.append(list(datos_de_prueba(i).values()))
+        wb.save(ruta)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.mean(tiempos)
+
+
+def main():
+    args = sys.argv[1:]
+    comparar = "--comparar" in args
+    tamanos = [int(a) for a in args if a != "--comparar"] or [1000, 10000, 100000]
+
+    directorio = tempfile.mkdtemp(prefix="bench_excel_")
+    try:
+        for filas in tamanos:
+            ruta = os.path.join(directorio, f"bench_{filas}.xlsx")
+            crear_excel(ruta, filas)
+            apertura, tiempos, guardado, durante = medir_writer(ruta)
+            print(f"{filas:>7} filas | apertura {apertura:6.2f}s | por fila p50 {percentil(tiempos, 50):7.1f}µs "
+                  f"p95 {percentil(tiempos, 95):7.1f}µs | guardado {guardado:6.2f}s | "
+                  f"durante el guardado máx {max(durante):7.1f}ms p95 {percentil(durante, 95):7.1f}ms")
+            if comparar:
+                crear_excel(ruta, filas)
+                print(f"{'':>7}       | anterior (abrir+guardar por fila): {medir_anterior(ruta):6.2f}s por fila")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de los backends de renderizado de PDF.
+
+Uso:
+    python bench_pdf_render.py <carpeta_con_pdfs> [repeticiones]
+
+Mide cada backend disponible (poppler, pdfium, pdfium_pool) sobre la primera
+página de cada PDF y muestra promedio, p50 y p95 en milisegundos.
+"""
+import os
+import statistics
+import sys
+import time
+
+from app.pdf_render import BACKENDS, PDFIUM_AVAILABLE, crear_renderer
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+
+def cargar_pdfs(carpeta):
+    pdfs = []
+    for nombre in sorted(os.listdir(carpeta)):
+        if nombre.lower().endswith(".pdf"):
+            with open(os.path.join(carpeta, nombre), "rb") as f:
+                pdfs.append((nombre, f.read()))
+    return pdfs
+
+
+def medir(backend, pdfs, repeticiones):
+    renderer = crear_renderer(backend)
+    if renderer.nombre != backend:
+        print(f"⚠️  {backend}: no disponible (se usaría {renderer.nombre}), se omite")
+        renderer.cerrar()
+        return None
+    tiempos = []
+    bytes_totales = 0
+    try:
+        # Una pasada de calentamiento que no se mide
+        renderer.renderizar(pdfs[0][1], 0)
+        for _ in range(repeticiones):
+            for _, contenido in pdfs:
+                inicio = time.perf_counter()
+                jpeg = renderer.renderizar(contenido, 0)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+                bytes_totales += len(jpeg)
+    except Exception as e:
+        print(f"❌ {backend}: {e}")
+        return None
+    finally:
+        renderer.cerrar()
+    return {
+        "promedio": statistics.mean(tiempos),
+        "p50": percentil(tiempos, 50),
+        "p95": percentil(tiempos, 95),
+        "kb_promedio": bytes_totales / len(tiempos) / 1024
+    }
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    carpeta = sys.argv[1]
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    pdfs = cargar_pdfs(carpeta)
+    if not pdfs:
+        print(f"No hay PDFs en {carpeta}")
+        sys.exit(1)
+
+    print(f"📄 {len(pdfs)} PDFs x {repeticiones} repeticiones (pypdfium2: {'sí' if PDFIUM_AVAILABLE else 'no'})")
+    print(f"{'backend':<14}{'prom ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'KB/pág':>10}")
+    for backend in BACKENDS:
+        r = medir(backend, pdfs, repeticiones)
+        if r:
+            print(
+                f"{backend:<14}{r['promedio']:>10.1f}{r['p50']:>10.1f}"
+                f"{r['p95']:>10.1f}{r['kb_promedio']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
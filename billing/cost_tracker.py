@@ -12,13 +12,60 @@ logger = logging.getLogger(__name__)
 
 # Ruta del archivo de log de uso
 from app.paths import get_usage_log_path
+from app.metrics import medir_etapa
 DEFAULT_USAGE_LOG = get_usage_log_path()
 
 # Costo aproximado por procesamiento (USD)
+# Sólo se usa cuando el resultado no trae el uso real de tokens ("uso")
 # GPT-4o Vision: ~$2.50/1M input tokens, ~$10/1M output tokens
 # Una imagen promedio: ~1000 tokens input + ~500 tokens output
 COSTO_BASE_POR_IMAGEN = 0.015  # ~$0.015 USD por imagen
 
+# Precios por millón de tokens (USD): (input, input cacheado, output)
+PRECIOS_MODELOS = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40)
+}
+
+# La Batch API cobra la mitad
+FACTOR_BATCH = 0.5
+
+
+def _precios(modelo: str) -> tuple:
+    """Precios del modelo; para modelos sin precio conocido usa los de gpt-4o."""
+    return PRECIOS_MODELOS.get(modelo, PRECIOS_MODELOS["gpt-4o"])
+
+
+def calcular_costo_tokens(
+    modelo: str,
+    tokens_entrada: int,
+    tokens_salida: int,
+    tokens_cacheados: int = 0
+) -> float:
+    """
+    Calcula el costo real en USD de una llamada a partir del uso de tokens.
+    
+    Args:
+        tokens_entrada: Tokens de entrada totales (incluye los cacheados)
+        tokens_salida: Tokens de salida
+        tokens_cacheados: Parte de la entrada servida desde el cache de prompts
+    """
+    precio_entrada, precio_cacheado, precio_salida = _precios(modelo)
+    return (
+        (tokens_entrada - tokens_cacheados) * precio_entrada
+        + tokens_cacheados * precio_cacheado
+        + tokens_salida * precio_salida
+    ) / 1_000_000
+
+
+def calcular_ahorro_cache(modelo: str, tokens_cacheados: int) -> float:
+    """USD ahorrados por los tokens de entrada servidos desde el cache de prompts."""
+    precio_entrada, precio_cacheado, _ = _precios(modelo)
+    return tokens_cacheados * (precio_entrada - precio_cacheado) / 1_000_000
+
 
 class CostTracker:
     """
@@ -82,7 +129,8 @@ class CostTracker:
         exito: bool,
         monto_extraido: Optional[float] = None,
         emisor: Optional[str] = None,
-        fuente: str = "whatsapp"  # "whatsapp" o "carpeta"
+        fuente: str = "whatsapp",  # "whatsapp" o "carpeta"
+        uso: Optional[dict] = None
     ) -> dict:
         """
         Registra un procesamiento de comprobante.
@@ -93,15 +141,22 @@ class CostTracker:
             monto_extraido: Monto extraído del comprobante (si aplica)
             emisor: Nombre del emisor (si aplica)
             fuente: Fuente del comprobante ("whatsapp" o "carpeta")
+            uso: Uso real de la extracción ("uso" del resultado del extractor:
+                 tokens, costo_usd, ahorro_cache_usd, latencia_ms). Sin uso se
+                 estima con COSTO_BASE_POR_IMAGEN.
             
         Returns:
             Dict con el costo calculado
         """
         log = self._cargar_log()
         
-        # Calcular costos
-        costo_real = self.costo_base if exito else 0.0
-        costo_mostrado = costo_real * self.markup
+        # Calcular costos: el real es lo que se gastó (aunque falle),
+        # al cliente sólo se le muestran los exitosos
+        if uso is not None:
+            costo_real = uso.get("costo_usd", 0.0)
+        else:
+            costo_real = self.costo_base if exito else 0.0
+        costo_mostrado = costo_real * self.markup if exito else 0.0
         
         # Crear registro
         registro = {
@@ -111,9 +166,21 @@ class CostTracker:
             "fuente": fuente,
             "monto_extraido": monto_extraido,
             "emisor": emisor,
-            "costo_real_usd": round(costo_real, 4),
-            "costo_mostrado_usd": round(costo_mostrado, 4)
+            "costo_real_usd": round(costo_real, 6),
+            "costo_mostrado_usd": round(costo_mostrado, 6)
         }
+        if uso is not None:
+            registro["uso"] = {
+                "tokens_entrada": uso.get("tokens_entrada", 0),
+                "tokens_cacheados": uso.get("tokens_cacheados", 0),
+                "tokens_salida": uso.get("tokens_salida", 0),
+                "llamadas": uso.get("llamadas", 0),
+                "latencia_ms": uso.get("latencia_ms", 0.0),
+                "ahorro_cache_usd": round(uso.get("ahorro_cache_usd", 0.0), 6)
+            }
+            if uso.get("rechazado_prefiltro"):
+                registro["uso"]["rechazado_prefiltro"] = True
+                registro["uso"]["costo_evitado_usd"] = uso.get("costo_evitado_usd", 0.0)
         
         # Agregar al log
         log["procesamientos"].append(registro)
@@ -126,12 +193,25 @@ class CostTracker:
             log["resumen"]["total_fallidos"] += 1
         log["resumen"]["costo_total_usd"] += costo_real
         log["resumen"]["costo_mostrado_usd"] += costo_mostrado
+        if uso is not None:
+            for clave in ("tokens_entrada", "tokens_cacheados", "tokens_salida"):
+                log["resumen"][clave] = log["resumen"].get(clave, 0) + uso.get(clave, 0)
+            log["resumen"]["ahorro_cache_usd"] = round(
+                log["resumen"].get("ahorro_cache_usd", 0.0) + uso.get("ahorro_cache_usd", 0.0), 6
+            )
+            # Imágenes descartadas por el prefiltro local antes de pagar el modelo
+            if uso.get("rechazado_prefiltro"):
+                log["resumen"]["rechazados_prefiltro"] = log["resumen"].get("rechazados_prefiltro", 0) + 1
+                log["resumen"]["costo_evitado_prefiltro_usd"] = round(
+                    log["resumen"].get("costo_evitado_prefiltro_usd", 0.0) + uso.get("costo_evitado_usd", 0.0), 6
+                )
         
         # Redondear totales
-        log["resumen"]["costo_total_usd"] = round(log["resumen"]["costo_total_usd"], 4)
-        log["resumen"]["costo_mostrado_usd"] = round(log["resumen"]["costo_mostrado_usd"], 4)
+        log["resumen"]["costo_total_usd"] = round(log["resumen"]["costo_total_usd"], 6)
+        log["resumen"]["costo_mostrado_usd"] = round(log["resumen"]["costo_mostrado_usd"], 6)
         
-        self._guardar_log(log)
+        with medir_etapa("billing"):
+            self._guardar_log(log)
         
         logger.info(f"Procesamiento registrado: {archivo} - Costo mostrado: ${costo_mostrado:.4f} USD")
         
@@ -156,6 +236,15 @@ class CostTracker:
         cotizacion_usd_ars = 1200  # Ajustar según cotización actual
         resumen["costo_mostrado_ars"] = round(resumen["costo_mostrado_usd"] * cotizacion_usd_ars, 2)
         
+        if resumen.get("total_procesados"):
+            resumen["tasa_rechazo_prefiltro"] = round(
+                resumen.get("rechazados_prefiltro", 0) / resumen["total_procesados"], 4
+            )
+        
+        # Porcentaje de la entrada servida desde el cache de prompts
+        if resumen.get("tokens_entrada"):
+            resumen["tasa_cache_prompt"] = round(resumen.get("tokens_cacheados", 0) / resumen["tokens_entrada"], 4)
+        
         return resumen
     
     def obtener_resumen_mensual(self, mes: Optional[int] = None, año: Optional[int] = None) -> dict:
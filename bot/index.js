@@ -78,23 +78,24 @@ async function procesarCola() {
 
       while (retries <= MAX_RETRIES && !success) {
         try {
-          const requestHeaders = { 'Content-Type': 'application/json' };
+          // El archivo viaja en binario (un 33% menos que en base64 dentro de JSON)
+          const requestHeaders = { 'Content-Type': item.mimetype || 'application/octet-stream' };
           if (API_KEY) {
             requestHeaders['X-API-Key'] = API_KEY;
           }
 
           const response = await axios.post(
-            `${API_URL}/api/v1/process-receipt`,
-            {
-              file_base64: item.data,
-              sender_phone: item.from,
-              mime_type: item.mimetype,
-              timestamp: new Date().toISOString(),
-              texto_completo: item.body,
-            },
+            `${API_URL}/api/v1/process-receipt/upload`,
+            Buffer.from(item.data, 'base64'),
             {
               timeout: API_TIMEOUT,
               headers: requestHeaders,
+              params: {
+                sender_phone: item.from,
+                mime_type: item.mimetype,
+                timestamp: new Date().toISOString(),
+              },
+              maxBodyLength: MAX_FILE_SIZE + 1024,
             }
           );
 
@@ -117,6 +118,17 @@ async function procesarCola() {
             } else {
               logger.error('Error: No se puede conectar a la API Python después de varios intentos. ¿Está corriendo?');
             }
+          } else if (error.response && [429, 503].includes(error.response.status)) {
+            // API saturada: esperar lo que indica Retry-After antes de reintentar
+            retries++;
+            if (retries <= MAX_RETRIES) {
+              const retryAfter = parseInt(error.response.headers['retry-after'], 10);
+              const waitSec = Math.min(Number.isFinite(retryAfter) && retryAfter > 0 ? retryAfter : 5 * retries, 300);
+              logger.warn(`API saturada (${error.response.status}), reintentando en ${waitSec}s (${retries}/${MAX_RETRIES})...`);
+              await new Promise((r) => setTimeout(r, waitSec * 1000));
+            } else {
+              logger.error('Error: La API sigue saturada después de varios intentos.');
+            }
           } else if (error.code === 'ETIMEDOUT') {
             logger.error('Error: Timeout al procesar. El servidor tardó demasiado.');
             break;
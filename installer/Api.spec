@@ -30,15 +30,15 @@ hiddenimports += [
     'uvicorn.protocols.websockets', 'uvicorn.protocols.websockets.auto',
     'uvicorn.lifespan', 'uvicorn.lifespan.on',
     'fastapi', 'starlette', 'pydantic', 'openai', 'httpx',
-    'pdf2image', 'openpyxl', 'gspread', 'PIL',
+    'pdf2image', 'pypdfium2', 'openpyxl', 'gspread', 'PIL', 'pytesseract',
 ]
 
 # Collect data files for external packages
 datas = []
 binaries = []
 
-# Collect uvicorn, fastapi, starlette completely
-for pkg in ['uvicorn', 'fastapi', 'starlette']:
+# Collect uvicorn, fastapi, starlette completely (pypdfium2 trae su DLL de pdfium)
+for pkg in ['uvicorn', 'fastapi', 'starlette', 'pypdfium2', 'pypdfium2_raw']:
     try:
         pkg_datas, pkg_binaries, pkg_hiddenimports = collect_all(pkg)
         datas += pkg_datas
@@ -1,6 +1,6 @@
 """
 Script de build para Windows.
-Genera Launcher.exe y Api.exe, copia bot, node, chromium y poppler.
+Genera Launcher.exe y Api.exe, copia bot, node, chromium, poppler y tesseract.
 """
 import os
 import shutil
@@ -144,6 +144,13 @@ def main():
     if poppler_src.exists():
         shutil.copytree(poppler_src, launcher_dir / "poppler", dirs_exist_ok=True)
 
+    # Copy Tesseract (build/tesseract con tesseract.exe y tessdata, para el prefiltro de imágenes)
+    tesseract_src = BUILD / "tesseract"
+    if tesseract_src.exists():
+        shutil.copytree(tesseract_src, launcher_dir / "tesseract", dirs_exist_ok=True)
+    else:
+        print("Aviso: falta build/tesseract; el prefiltro sólo rechazará stickers")
+
     # Extra docs
     readme = ROOT / "README_CLIENTE.md"
     if readme.exists():
@@ -1495,6 +1495,9 @@ class SystemLauncher(ctk.CTk):
             poppler_path = self.get_poppler_path()
             if poppler_path:
                 api_env["POPPLER_PATH"] = poppler_path
+            tesseract_cmd = self.get_tesseract_cmd()
+            if tesseract_cmd:
+                api_env["TESSERACT_CMD"] = tesseract_cmd
             # Flags para ocultar ventana en Windows
             creation_flags = 0
             if sys.platform == "win32":
@@ -1770,6 +1773,23 @@ class SystemLauncher(ctk.CTk):
         
         return ""
 
+    def get_tesseract_cmd(self):
+        """Ejecutable de tesseract para el prefiltro de imágenes ("" si no hay)."""
+        # 1. Embebido en el instalador
+        if getattr(sys, "frozen", False):
+            embebido = os.path.join(get_resource_dir(), "tesseract", "tesseract.exe")
+            if os.path.exists(embebido):
+                return embebido
+
+        # 2. Instalación del usuario o en el PATH
+        for path in [
+            os.path.join(os.environ.get("LOCALAPPDATA", ""), "Programs", "Tesseract-OCR", "tesseract.exe"),
+            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+        ]:
+            if os.path.exists(path):
+                return path
+        return shutil.which("tesseract") or ""
+
     def kill_process_tree(self, pid):
         try:
             if sys.platform == "win32":
@@ -2,12 +2,16 @@
 """
 Script principal para ejecutar el sistema de procesamiento de comprobantes.
 Inicia la API Python y opcionalmente el monitor de carpeta.
+
+    python run.py                      # API + monitor de carpeta
+    python run.py --backfill [carpeta] # procesa un archivo histórico con la Batch API
 """
 import os
 import sys
 import json
 import signal
 import logging
+import multiprocessing
 import threading
 import time
 import shutil
@@ -26,8 +30,10 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Importar módulos del proyecto
-from app.extractor import extraer_datos_comprobante
-from storage.storage_manager import guardar_transferencia
+from app.extractor import extraer_datos_comprobante, extraer_comprobantes_pdf
+from app.config import PDF_MULTIPAGE
+from app.admission import get_control_admision, Sobrecarga
+from storage.storage_manager import guardar_transferencia, guardar_transferencias
 from billing.cost_tracker import CostTracker
 from watcher.folder_watcher import FolderWatcher
 from app.license import LicenseManager
@@ -102,6 +108,9 @@ def procesar_archivo(file_base64: str, mime_type: str, nombre_archivo: str) -> d
     """
     global config, cost_tracker
     
+    if PDF_MULTIPAGE and mime_type == "application/pdf":
+        return procesar_pdf_multipagina(file_base64, nombre_archivo)
+    
     # 1. Extraer datos con GPT-4o Vision
     resultado_extraccion = extraer_datos_comprobante(
         imagen_base64=file_base64,
@@ -109,17 +118,28 @@ def procesar_archivo(file_base64: str, mime_type: str, nombre_archivo: str) -> d
     )
     
     if not resultado_extraccion.get("success"):
-        # Registrar fallo en billing
-        if cost_tracker:
+        # Registrar fallo en billing (los transitorios se reintentan, no se registran)
+        if cost_tracker and not resultado_extraccion.get("reintentable"):
             cost_tracker.registrar_procesamiento(
                 archivo=nombre_archivo,
                 exito=False,
-                fuente="carpeta"
+                fuente="carpeta",
+                uso=resultado_extraccion.get("uso")
             )
         return resultado_extraccion
     
     datos = resultado_extraccion.get("data", {})
     
+    # Idéntico a un archivo que se estaba procesando: se comparte la extracción
+    # y el guardado queda a cargo de ese procesamiento
+    if resultado_extraccion.get("coalescida"):
+        return {
+            "success": True,
+            "message": "Comprobante idéntico a uno que se estaba procesando: se compartió su extracción y no se guarda de nuevo",
+            "data": datos,
+            "coalescida": True
+        }
+    
     # 2. Guardar en storage(s) configurado(s)
     resultado_guardado = guardar_transferencia(
         datos=datos,
@@ -135,7 +155,8 @@ def procesar_archivo(file_base64: str, mime_type: str, nombre_archivo: str) -> d
             exito=resultado_guardado.get("success", False),
             monto_extraido=datos.get("monto_numerico"),
             emisor=datos.get("emisor_nombre"),
-            fuente="carpeta"
+            fuente="carpeta",
+            uso=resultado_extraccion.get("uso")
         )
     
     return {
@@ -146,6 +167,83 @@ def procesar_archivo(file_base64: str, mime_type: str, nombre_archivo: str) -> d
     }
 
 
+def procesar_archivo_carpeta(file_base64: str, mime_type: str, nombre_archivo: str) -> dict:
+    """
+    procesar_archivo con un cupo del control de admisión compartido con la
+    API (fuente "carpeta"): un backfill de la carpeta no compite sin límite
+    con una ráfaga de WhatsApp. Si no consigue cupo, el archivo queda para
+    el próximo escaneo.
+    """
+    try:
+        with get_control_admision().ticket("carpeta"):
+            return procesar_archivo(file_base64, mime_type, nombre_archivo)
+    except Sobrecarga as e:
+        logger.warning(f"📁 {nombre_archivo}: {e}")
+        return {"success": False, "error": str(e), "reintentable": True, "reintentar_en": e.reintentar_en}
+
+
+def procesar_pdf_multipagina(file_base64: str, nombre_archivo: str) -> dict:
+    """
+    Procesa un PDF con un comprobante por página (extraccion.pdf_multipagina).
+    Todas las transferencias se guardan en un solo lote.
+    """
+    global config, cost_tracker
+    
+    resultado_extraccion = extraer_comprobantes_pdf(file_base64)
+    # Con alguna página transitoria se reintenta el PDF completo (nada se guarda)
+    if resultado_extraccion.get("reintentable"):
+        return resultado_extraccion
+    if resultado_extraccion.get("coalescida") and resultado_extraccion.get("success"):
+        return {
+            "success": True,
+            "message": "PDF idéntico a uno que se estaba procesando: se compartió su extracción y no se guarda de nuevo",
+            "transferencias": resultado_extraccion.get("transferencias", []),
+            "paginas": resultado_extraccion.get("paginas", []),
+            "coalescida": True
+        }
+    transferencias = resultado_extraccion.get("transferencias", [])
+    for datos in transferencias:
+        datos.setdefault("archivo_origen", f"{nombre_archivo} (pág. {datos['pagina']})")
+    
+    resultado_guardado = {"success": False, "message": resultado_extraccion.get("error", "")}
+    if transferencias:
+        resultado_guardado = guardar_transferencias(
+            lista_datos=transferencias,
+            config=config,
+            whatsapp_from="",
+            timestamp_recepcion=datetime.now().isoformat()
+        )
+    
+    if cost_tracker:
+        exito = resultado_guardado.get("success", False)
+        usos = {pagina["pagina"]: pagina.get("uso") for pagina in resultado_extraccion.get("paginas", [])}
+        for datos in transferencias:
+            cost_tracker.registrar_procesamiento(
+                archivo=f"{nombre_archivo}#p{datos['pagina']}",
+                exito=exito,
+                monto_extraido=datos.get("monto_numerico"),
+                emisor=datos.get("emisor_nombre"),
+                fuente="carpeta",
+                uso=usos.get(datos["pagina"])
+            )
+        for pagina in resultado_extraccion.get("paginas", []):
+            if not pagina["success"]:
+                cost_tracker.registrar_procesamiento(
+                    archivo=f"{nombre_archivo}#p{pagina['pagina']}",
+                    exito=False,
+                    fuente="carpeta",
+                    uso=pagina.get("uso")
+                )
+    
+    return {
+        "success": resultado_guardado.get("success", False),
+        "message": resultado_guardado.get("message", ""),
+        "transferencias": transferencias,
+        "paginas": resultado_extraccion.get("paginas", []),
+        "storage": resultado_guardado
+    }
+
+
 def iniciar_folder_watcher():
     """Inicia el monitor de carpeta en un hilo separado."""
     global config, ejecutando
@@ -167,7 +265,7 @@ def iniciar_folder_watcher():
         try:
             # Escanear y procesar archivos nuevos
             resultados = watcher.escanear_y_procesar(
-                procesar_fn=procesar_archivo,
+                procesar_fn=procesar_archivo_carpeta,
                 intervalo_segundos=2.0
             )
             
@@ -183,6 +281,29 @@ def iniciar_folder_watcher():
             time.sleep(30)
 
 
+def ejecutar_backfill(carpeta: str = ""):
+    """
+    Procesa todos los archivos pendientes de una carpeta con la Batch API
+    de OpenAI y termina. Por defecto usa fuentes.carpeta_ruta.
+    """
+    global config, cost_tracker
+    from watcher.batch_backfill import BatchBackfill
+    
+    config = cargar_config()
+    verificar_licencia(config)
+    cost_tracker = CostTracker(markup=config.get("billing", {}).get("markup", 2.0))
+    
+    carpeta = carpeta or config.get("fuentes", {}).get("carpeta_ruta", "")
+    if not carpeta or not os.path.exists(carpeta):
+        logger.error(f"Carpeta no existe o no configurada: {carpeta}")
+        sys.exit(1)
+    
+    backfill = BatchBackfill(FolderWatcher(carpeta=carpeta), config, cost_tracker)
+    resumen = backfill.ejecutar()
+    logger.info(f"📊 Backfill terminado: {resumen}")
+    mostrar_resumen_costos()
+
+
 def mostrar_resumen_costos():
     """Muestra el resumen de costos actual."""
     global cost_tracker
@@ -267,4 +388,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # Necesario para el pool de renderizado PDF en el ejecutable de Windows
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == "--backfill":
+        ejecutar_backfill(sys.argv[2] if len(sys.argv) > 2 else "")
+    else:
+        main()
@@ -0,0 +1,324 @@
+"""
+Índice de duplicados compartido por el Excel local y Google Sheets.
+
+Una transferencia se considera duplicada si ya hay otra:
+- con la misma fecha de operación (normalizada: "1/2/2025" == "01/02/2025")
+  y un monto a menos de $1, salvo que las dos tengan CBU emisor y sean
+  distintos; o
+- con la misma referencia del banco y el mismo CBU emisor.
+
+Los montos se agrupan por (fecha, parte entera del monto): la tolerancia
+de $1 sólo obliga a mirar el bucket propio y los dos vecinos, así que cada
+consulta es O(1) sin importar el tamaño de la planilla.
+
+El índice se persiste como JSONL append-only (una línea por fila de la
+planilla más líneas de control con el estado del origen), así al reiniciar
+sólo se indexan las filas agregadas desde la última vez.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Diferencia de monto por debajo de la cual dos transferencias se consideran iguales
+TOLERANCIA_MONTO = 1.0
+
+# Formatos de fecha que aparecen en comprobantes y planillas
+_FORMATOS_FECHA = ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%d-%m-%Y", "%d-%m-%y", "%d.%m.%Y")
+
+# Referencias demasiado cortas o genéricas para identificar una transferencia
+_LARGO_MIN_REFERENCIA = 4
+
+# (fecha, monto, referencia, cbu) de una fila
+Claves = Tuple[str, Optional[float], str, str]
+
+
+@lru_cache(maxsize=4096)
+def normalizar_fecha(valor) -> str:
+    """Fecha en ISO (YYYY-MM-DD) si se reconoce el formato; si no, el texto limpio."""
+    texto = str(valor or "").strip()
+    if not texto:
+        return ""
+    # "01/02/2025 14:30" o "2025-02-01T14:30:00": sólo la fecha
+    fecha = re.split(r"[\sT]", texto, maxsplit=1)[0]
+    for formato in _FORMATOS_FECHA:
+        try:
+            return datetime.strptime(fecha, formato).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return texto.lower()
+
+
+def normalizar_monto(valor) -> Optional[float]:
+    """Monto de una celda (número o texto tipo "$1,234.50"); None si no es número."""
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    try:
+        return float(str(valor).replace('$', '').replace(',', '').strip())
+    except (ValueError, TypeError):
+        return None
+
+
+def normalizar_referencia(valor) -> str:
+    referencia = re.sub(r"\s+", "", str(valor or "")).upper()
+    if len(referencia) < _LARGO_MIN_REFERENCIA or not referencia.strip("0"):
+        return ""
+    return referencia
+
+
+def normalizar_cbu(valor) -> str:
+    return re.sub(r"\D", "", str(valor or ""))
+
+
+def claves_de(fecha, monto, referencia="", cbu="") -> Claves:
+    """Claves normalizadas de una fila."""
+    return (normalizar_fecha(fecha), normalizar_monto(monto), normalizar_referencia(referencia), normalizar_cbu(cbu))
+
+
+class IndiceDuplicados:
+    """Índice de duplicados de una planilla, opcionalmente persistido en disco."""
+
+    def __init__(self, ruta: Optional[str] = None):
+        """
+        Args:
+            ruta: Archivo JSONL donde se persiste (None = sólo en memoria)
+        """
+        self.ruta = ruta
+        self._lock = threading.RLock()
+        self._montos: Dict[Tuple[str, int], List[Tuple[float, str]]] = {}
+        self._referencias: Set[Tuple[str, str]] = set()
+        self._archivo = None
+        # Filas de la planilla indexadas y estado del origen al último guardado
+        self.filas = 0
+        self.origen: Optional[str] = None
+        self._filas_guardadas = 0
+        self._cargado = False
+        # (número de fila, claves, referencia nueva) de las filas sin guardar, para deshacer
+        self._recientes: List[Tuple[int, Claves, bool]] = []
+
+    # --- Consultas ---
+
+    def _es_duplicado(self, claves: Claves) -> bool:
+        fecha, monto, referencia, cbu = claves
+        if referencia and (referencia, cbu) in self._referencias:
+            return True
+        if not fecha or monto is None:
+            return False
+        bucket = math.floor(monto)
+        for vecino in (bucket - 1, bucket, bucket + 1):
+            for otro_monto, otro_cbu in self._montos.get((fecha, vecino), ()):
+                if abs(otro_monto - monto) < TOLERANCIA_MONTO and not (cbu and otro_cbu and cbu != otro_cbu):
+                    return True
+        return False
+
+    def es_duplicado(self, fecha, monto, referencia="", cbu="") -> bool:
+        """True si ya hay una transferencia equivalente en el índice."""
+        with self._lock:
+            return self._es_duplicado(claves_de(fecha, monto, referencia, cbu))
+
+    # --- Altas ---
+
+    def _indexar(self, claves: Claves):
+        fecha, monto, referencia, cbu = claves
+        referencia_nueva = bool(referencia) and (referencia, cbu) not in self._referencias
+        if referencia:
+            self._referencias.add((referencia, cbu))
+        if fecha and monto is not None:
+            self._montos.setdefault((fecha, math.floor(monto)), []).append((monto, cbu))
+        self.filas += 1
+        self._recientes.append((self.filas, claves, referencia_nueva))
+
+    def _desindexar(self, claves: Claves, referencia_nueva: bool):
+        """Saca la última fila indexada con esas claves."""
+        fecha, monto, referencia, cbu = claves
+        if referencia_nueva:
+            self._referencias.discard((referencia, cbu))
+        if fecha and monto is not None:
+            bucket = (fecha, math.floor(monto))
+            lista = self._montos.get(bucket, [])
+            for i in range(len(lista) - 1, -1, -1):
+                if lista[i] == (monto, cbu):
+                    del lista[i]
+                    break
+            if not lista:
+                self._montos.pop(bucket, None)
+        self.filas -= 1
+
+    def _persistir(self, registro):
+        if self.ruta is None:
+            return
+        if self._archivo is None:
+            self._archivo = open(self.ruta, "a", encoding="utf-8")
+        self._archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+    def registrar(self, fecha, monto, referencia="", cbu="") -> bool:
+        """
+        Agrega una fila nueva de la planilla al índice.
+
+        Returns:
+            True si era duplicada de una fila anterior
+        """
+        claves = claves_de(fecha, monto, referencia, cbu)
+        with self._lock:
+            es_duplicado = self._es_duplicado(claves)
+            self._indexar(claves)
+            # Sin flush: hasta el próximo marcar_origen la fila no cuenta como guardada
+            self._persistir(list(claves))
+            return es_duplicado
+
+    def agregar_existentes(self, filas: Iterable[Claves]):
+        """Indexa filas que ya estaban en la planilla (claves_de), sin buscar duplicados."""
+        with self._lock:
+            self._agregar_filas(filas)
+
+    def _agregar_filas(self, filas: Iterable[Claves]):
+        for claves in filas:
+            self._indexar(claves)
+            self._persistir(list(claves))
+        if self._archivo is not None:
+            self._archivo.flush()
+
+    def deshacer(self, filas: int):
+        """
+        Saca las filas indexadas después de la número `filas` (un envío que
+        la planilla rechazó), sin reconstruir el índice. No baja de las
+        filas ya guardadas.
+        """
+        with self._lock:
+            deshechas = 0
+            while self._recientes and self._recientes[-1][0] > max(filas, self._filas_guardadas):
+                _, claves, referencia_nueva = self._recientes.pop()
+                self._desindexar(claves, referencia_nueva)
+                deshechas += 1
+            if deshechas:
+                self._persistir({"deshacer": deshechas})
+                if self._archivo is not None:
+                    self._archivo.flush()
+
+    # --- Persistencia y sincronización con la planilla ---
+
+    def _cargar(self):
+        """
+        Lee el índice persistido. Las filas indexadas después del último
+        marcar_origen no llegaron a la planilla (corte antes del guardado) y
+        se descartan; el archivo se compacta.
+        """
+        self._cargado = True
+        if self.ruta is None or not os.path.exists(self.ruta):
+            return
+        filas: List[Claves] = []
+        origen, guardadas = None, 0
+        with open(self.ruta, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(registro, dict) and "deshacer" in registro:
+                    del filas[max(0, len(filas) - registro["deshacer"]):]
+                elif isinstance(registro, dict):
+                    origen, guardadas = registro.get("origen"), registro.get("filas", 0)
+                elif isinstance(registro, list) and len(registro) == 4:
+                    filas.append(tuple(registro))
+        filas = filas[:guardadas]
+        for claves in filas:
+            self._indexar(claves)
+        self.origen, self._filas_guardadas = origen, len(filas)
+        self._recientes.clear()
+
+        # Compactar: filas guardadas + una sola línea de control
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for claves in filas:
+                f.write(json.dumps(list(claves), ensure_ascii=False) + "\n")
+            f.write(json.dumps({"origen": origen, "filas": len(filas)}) + "\n")
+        os.replace(temporal, self.ruta)
+
+    def _reiniciar(self):
+        self._montos.clear()
+        self._referencias.clear()
+        self.filas = 0
+        self.origen = None
+        self._filas_guardadas = 0
+        self._recientes.clear()
+        if self._archivo is not None:
+            self._archivo.close()
+            self._archivo = None
+        if self.ruta is not None and os.path.exists(self.ruta):
+            os.remove(self.ruta)
+
+    def sincronizar(self, origen: Optional[str], total_filas: Optional[int],
+                    leer_desde: Callable[[int], Iterable[Claves]]):
+        """
+        Pone el índice al día con la planilla leyendo sólo lo que falta.
+
+        Si el origen es el mismo que al último guardado y la planilla no
+        tiene menos filas que el índice, se indexan sólo las filas desde
+        la última indexada; si no (edición externa, filas borradas), se
+        reconstruye completo.
+
+        Args:
+            origen: Identificador del estado de la planilla (ej. mtime del
+                Excel); None si no se puede saber
+            total_filas: Filas de datos de la planilla (None = desconocido,
+                se asume append-only)
+            leer_desde: Función que recibe cuántas filas saltear y devuelve
+                las claves (claves_de) de las filas siguientes
+        """
+        with self._lock:
+            if not self._cargado:
+                self._cargar()
+            incremental = (origen is None or origen == self.origen) and \
+                (total_filas is None or total_filas >= self.filas)
+            if not incremental:
+                if self.filas:
+                    logger.info(f"Índice de duplicados {self.ruta}: planilla modificada, se reconstruye")
+                self._reiniciar()
+            if total_filas is None or total_filas > self.filas:
+                self._agregar_filas(leer_desde(self.filas))
+            self.marcar_origen(origen if origen is not None else self.origen)
+
+    def marcar_origen(self, origen: Optional[str], filas: Optional[int] = None):
+        """
+        Registra que la planilla quedó guardada con `filas` filas (por
+        defecto, todas las indexadas) en el estado `origen`.
+        """
+        with self._lock:
+            filas = self.filas if filas is None else filas
+            self._recientes = [r for r in self._recientes if r[0] > filas]
+            if origen == self.origen and filas == self._filas_guardadas:
+                return
+            self.origen, self._filas_guardadas = origen, filas
+            self._persistir({"origen": origen, "filas": filas})
+            if self._archivo is not None:
+                self._archivo.flush()
+
+    def invalidar(self):
+        """Descarta el índice: la próxima sincronización lo reconstruye completo."""
+        with self._lock:
+            self._reiniciar()
+            self._cargado = True
+
+    def cerrar(self):
+        with self._lock:
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+
+    def obtener_estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "filas": self.filas,
+                "buckets": len(self._montos),
+                "referencias": len(self._referencias),
+                "ruta": self.ruta
+            }
@@ -1,26 +1,40 @@
 """
 Almacenamiento de transferencias en Excel local usando openpyxl.
+
+Un ExcelWriter por archivo mantiene el libro abierto en memoria durante toda
+la vida del proceso: cada transferencia se agrega a la hoja (sin releer ni
+reescribir el archivo) y a un diario append-only junto al Excel, y un hilo
+guarda el libro cada EXCEL_FLUSH_SECONDS o al juntar EXCEL_FLUSH_ROWS filas.
+El guardado escribe un archivo temporal y lo renombra encima del original,
+así el Excel en disco siempre se puede abrir. Mientras se guarda el lock
+queda libre: las filas nuevas se numeran y van al diario, y sus celdas se
+escriben en la hoja al terminar el guardado.
+
+- Si el proceso se corta antes de guardar, las filas del diario se vuelven
+  a aplicar al abrir el Excel la próxima vez.
+- Si el Excel se modificó desde afuera (mtime distinto al del último
+  guardado propio), se recarga antes de seguir y se reaplican las filas
+  pendientes del diario.
+- Si el Excel está bloqueado (abierto en Excel de Windows), las filas quedan
+  en memoria y en el diario y se reintenta en el próximo guardado.
 """
+import atexit
+import json
 import os
 import threading
 import time
 import logging
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Tuple
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 from openpyxl.utils import get_column_letter
-from app.paths import resolve_appdata_path
+from app.paths import resolve_appdata_path, get_duplicate_index_path
+from app.config import EXCEL_FLUSH_SECONDS, EXCEL_FLUSH_ROWS
+from storage.duplicate_index import IndiceDuplicados, claves_de, normalizar_monto
 
 # Logger para este módulo
 logger = logging.getLogger(__name__)
 
-# Cola de entradas pendientes (cuando el Excel está bloqueado)
-_pending_entries: List[Dict[str, Any]] = []
-_pending_lock = threading.Lock()
-_retry_thread: Optional[threading.Thread] = None
-_retry_running = False
-
 
 # Headers del Excel - Actualizado con columnas de Receptor y WhatsApp
 HEADERS = [
@@ -43,46 +57,484 @@ HEADERS = [
     "WhatsApp"              # Link clickeable a WhatsApp Web
 ]
 
+# Columnas (base 1) usadas para detectar duplicados
+COL_FECHA = 3
+COL_MONTO = 4
+COL_CBU_EMISOR = 7
+COL_REFERENCIA = 13
+
 # Estilos
 HEADER_FONT = Font(bold=True, color="FFFFFF")
 HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
 DUPLICATE_FILL = PatternFill(start_color="FFFF99", end_color="FFFF99", fill_type="solid")
 
+# Filas llegadas durante un guardado que se pasan a la hoja por cada toma del lock
+LOTE_DIFERIDAS = 200
 
-def _crear_excel_con_headers(ruta: str) -> Workbook:
-    """Crea un nuevo archivo Excel con los headers formateados."""
+
+def _crear_excel_con_headers() -> Workbook:
+    """Crea un libro nuevo (en memoria) con los headers formateados."""
     wb = Workbook()
     ws = wb.active
     ws.title = "Transferencias"
-    
+
     # Agregar headers
     for col, header in enumerate(HEADERS, 1):
         cell = ws.cell(row=1, column=col, value=header)
         cell.font = HEADER_FONT
         cell.fill = HEADER_FILL
         cell.alignment = Alignment(horizontal="center")
-    
+
     # Ajustar anchos de columna (17 columnas)
     column_widths = [25, 12, 18, 15, 25, 15, 25, 18, 25, 15, 25, 18, 20, 25, 12, 30, 20]
     for i, width in enumerate(column_widths, 1):
         ws.column_dimensions[get_column_letter(i)].width = width
-    
-    wb.save(ruta)
+
     return wb
 
 
-def _detectar_duplicado(ws, fecha_deposito: str, monto: float) -> bool:
-    """Detecta si ya existe una transferencia con la misma fecha y monto."""
-    for row in ws.iter_rows(min_row=2, max_col=3, values_only=True):
-        if row[1] and row[2]:  # Fecha Depósito y Monto
-            row_fecha = str(row[1]).strip()
-            try:
-                row_monto = float(str(row[2]).replace('$', '').replace(',', '').strip())
-                if row_fecha == fecha_deposito and abs(row_monto - monto) < 1.0:
-                    return True
-            except (ValueError, TypeError):
+def _resolver_ruta_excel(ruta_excel: str) -> str:
+    """Resuelve la ruta (relativa a AppData), agrega .xlsx y crea el directorio."""
+    ruta_excel = resolve_appdata_path(ruta_excel, fallback_name="transferencias.xlsx")
+
+    # Asegurar que el archivo tenga extensión .xlsx
+    if not ruta_excel.lower().endswith('.xlsx'):
+        ruta_excel += '.xlsx'
+
+    # Crear directorio si no existe
+    directorio = os.path.dirname(ruta_excel)
+    if directorio and not os.path.exists(directorio):
+        os.makedirs(directorio)
+    return ruta_excel
+
+
+def _armar_fila(datos: dict, whatsapp_from: str) -> list:
+    """Valores de las 17 columnas para una transferencia."""
+    # Preparar datos
+    monto = datos.get("monto_numerico", 0)
+    fecha_deposito = str(datos.get("fecha_operacion", "")).strip()
+
+    # Lógica para nombre de emisor (Manejo de Depósitos)
+    emisor_nombre = datos.get("emisor_nombre", "")
+    if not emisor_nombre:
+        concepto = datos.get("concepto", "").lower()
+        if "deposito" in concepto or "efectivo" in concepto:
+            emisor_nombre = "DEPÓSITO EN EFECTIVO"
+
+    # Convertir confianza a etiqueta
+    confianza_val = datos.get("confianza", 0)
+    confianza_str = "OPTIMA" if confianza_val >= 0.90 else "REVEER"
+
+    # Preparar número de WhatsApp
+    numero_wa = whatsapp_from.replace("@c.us", "") if whatsapp_from else ""
+
+    # Errores de validación
+    errores_list = datos.get("errores", [])
+    errores_str = "; ".join(errores_list) if isinstance(errores_list, list) else str(errores_list or "")
+
+    return [
+        datos.get("archivo_origen", ""),      # A: Archivo
+        "WhatsApp" if numero_wa else "API",   # B: Fuente
+        fecha_deposito,                       # C: Fecha Operación
+        monto,                                # D: Monto
+        emisor_nombre,                        # E: Emisor Nombre
+        datos.get("emisor_cuil", ""),         # F: CUIT Emisor
+        datos.get("emisor_cbu", ""),          # G: CBU/CVU Emisor
+        datos.get("banco_emisor", ""),        # H: Banco Emisor
+        datos.get("receptor_nombre", ""),     # I: Receptor Nombre
+        datos.get("receptor_cuil", ""),       # J: CUIT Receptor
+        datos.get("receptor_cbu", ""),        # K: CBU/CVU Receptor
+        datos.get("banco_receptor", ""),      # L: Banco Receptor
+        datos.get("referencia", ""),          # M: Referencia
+        datos.get("concepto", ""),            # N: Concepto
+        confianza_str,                        # O: Confianza
+        errores_str,                          # P: Errores
+        numero_wa                             # Q: WhatsApp (se agrega hipervínculo después)
+    ]
+
+
+class ExcelWriter:
+    """
+    Escritor de larga vida para un archivo Excel: libro en memoria, diario
+    append-only de filas sin guardar y guardado atómico periódico.
+    """
+
+    def __init__(self, ruta_excel: str, intervalo_flush: float = EXCEL_FLUSH_SECONDS,
+                 max_pendientes: int = EXCEL_FLUSH_ROWS):
+        """
+        Args:
+            ruta_excel: Ruta ya resuelta del .xlsx
+            intervalo_flush: Segundos entre guardados (0 = guardar en cada escritura)
+            max_pendientes: Filas sin guardar que fuerzan un guardado anticipado
+        """
+        self.ruta = ruta_excel
+        self.ruta_diario = ruta_excel + ".pendientes.jsonl"
+        self.intervalo_flush = intervalo_flush
+        self.max_pendientes = max(1, max_pendientes)
+        self._lock = threading.RLock()
+        # Un solo guardado a la vez; se toma antes que _lock
+        self._lock_guardado = threading.Lock()
+        self._guardando = False
+        # (fila, valores, es_duplicado, datos, remitente) llegadas durante un guardado
+        self._diferidas: List[tuple] = []
+        self._wb: Optional[Workbook] = None
+        self._ws = None
+        self._ultima_fila = 0
+        self._indice = IndiceDuplicados(get_duplicate_index_path(ruta_excel))
+        self._mtime: Optional[int] = None
+        self._pendientes = 0
+        self._diario = None
+        self._evento = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._cerrado = False
+        self._estadisticas = {"filas": 0, "guardados": 0, "guardados_fallidos": 0, "recargas": 0}
+
+    # --- Carga ---
+
+    def _mtime_en_disco(self) -> Optional[int]:
+        try:
+            return os.stat(self.ruta).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _cargar(self):
+        """Abre (o crea) el libro, arma el índice y reaplica el diario (con el lock tomado)."""
+        if os.path.exists(self.ruta):
+            self._wb = load_workbook(self.ruta)
+            self._mtime = self._mtime_en_disco()
+        else:
+            self._wb = _crear_excel_con_headers()
+            self._mtime = None
+        self._ws = self._wb.active
+        self._ultima_fila = self._ws.max_row
+        # Índice persistido: si el Excel es el del último guardado propio sólo
+        # se indexan las filas que falten; si cambió, se reconstruye
+        self._indice.sincronizar(
+            str(self._mtime or ""), self._ultima_fila - 1, self._claves_desde
+        )
+
+        # Filas agregadas y no guardadas antes de un corte o de una recarga
+        self._pendientes = 0
+        reaplicadas = []
+        for entrada in self._leer_diario():
+            if self._ya_guardada(entrada):
                 continue
-    return False
+            datos, remitente = entrada["datos"], entrada.get("whatsapp_from", "")
+            fila, _ = self._agregar_fila(datos, remitente)
+            reaplicadas.append((fila, datos, remitente))
+        if reaplicadas:
+            logger.info(f"Excel {self.ruta}: {len(reaplicadas)} filas del diario reaplicadas")
+            # El diario se reescribe con los números de fila nuevos
+            self._reescribir_diario(reaplicadas)
+            self._pendientes = len(reaplicadas)
+            self._evento.set()
+
+        if self._mtime is None:
+            # Libro nuevo: se guarda enseguida para que el archivo exista
+            self._guardar()
+
+    def _claves_desde(self, saltear: int):
+        """Claves de duplicados de las filas de datos a partir de la número saltear + 1."""
+        for fila in self._ws.iter_rows(min_row=saltear + 2, max_col=COL_REFERENCIA, values_only=True):
+            yield claves_de(fila[COL_FECHA - 1], fila[COL_MONTO - 1],
+                            fila[COL_REFERENCIA - 1], fila[COL_CBU_EMISOR - 1])
+
+    def _leer_diario(self) -> List[dict]:
+        if not os.path.exists(self.ruta_diario):
+            return []
+        entradas = []
+        with open(self.ruta_diario, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    entradas.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir si el proceso se cortó
+                    continue
+        return entradas
+
+    def _ya_guardada(self, entrada: dict) -> bool:
+        """
+        True si la fila del diario ya está en el Excel (el proceso se cortó
+        entre el renombrado y el vaciado del diario).
+        """
+        fila = entrada.get("fila", 0)
+        if fila < 2 or fila > self._ultima_fila:
+            return False
+        valores = _armar_fila(entrada["datos"], entrada.get("whatsapp_from", ""))
+        return (self._ws.cell(row=fila, column=1).value or "") == (valores[0] or "") \
+            and normalizar_monto(self._ws.cell(row=fila, column=COL_MONTO).value) == normalizar_monto(valores[COL_MONTO - 1])
+
+    def _asegurar_actual(self):
+        """Carga el libro la primera vez y lo recarga si se editó desde afuera (con el lock tomado)."""
+        if self._wb is None:
+            self._cargar()
+            return
+        if self._guardando:
+            # El mtime cambia con el propio guardado en curso
+            return
+        mtime = self._mtime_en_disco()
+        if mtime is not None and mtime != self._mtime:
+            logger.warning(f"Excel {self.ruta} modificado desde afuera, recargando")
+            self._cerrar_diario()
+            self._estadisticas["recargas"] += 1
+            self._cargar()
+
+    # --- Escritura ---
+
+    def _agregar_fila(self, datos: dict, whatsapp_from: str) -> Tuple[int, bool]:
+        """Escribe la fila en la hoja en memoria. Returns (numero_de_fila, es_duplicado)."""
+        fila = _armar_fila(datos, whatsapp_from)
+        es_duplicado = self._indice.registrar(
+            fila[COL_FECHA - 1], fila[COL_MONTO - 1], fila[COL_REFERENCIA - 1], fila[COL_CBU_EMISOR - 1]
+        )
+
+        self._ultima_fila += 1
+        nueva_fila = self._ultima_fila
+        if self._guardando:
+            # La hoja se está guardando fuera del lock: las celdas se escriben al terminar
+            self._diferidas.append((nueva_fila, fila, es_duplicado, datos, whatsapp_from))
+        else:
+            self._escribir_celdas(nueva_fila, fila, es_duplicado)
+        return nueva_fila, es_duplicado
+
+    def _escribir_celdas(self, nueva_fila: int, fila: list, es_duplicado: bool):
+        # Celda por celda con número de fila explícito: ws.append/ws.max_row
+        # recorren todas las celdas de la hoja
+        for col, valor in enumerate(fila, 1):
+            cell = self._ws.cell(row=nueva_fila, column=col, value=valor)
+            # Marcar como duplicado si corresponde
+            if es_duplicado:
+                cell.fill = DUPLICATE_FILL
+
+        # Agregar hipervínculo de WhatsApp (columna Q = 17)
+        numero_wa = fila[-1]
+        if numero_wa:
+            wa_cell = self._ws.cell(row=nueva_fila, column=17)
+            # Crear link a WhatsApp Web
+            wa_cell.hyperlink = f"https://wa.me/{numero_wa}"
+            wa_cell.style = "Hyperlink"
+
+    def _anotar_en_diario(self, fila: int, datos: dict, whatsapp_from: str):
+        if self._diario is None:
+            self._diario = open(self.ruta_diario, "a", encoding="utf-8")
+        self._diario.write(json.dumps(
+            {"fila": fila, "datos": datos, "whatsapp_from": whatsapp_from},
+            ensure_ascii=False, default=str
+        ) + "\n")
+
+    def _reescribir_diario(self, entradas: List[tuple]):
+        """Reemplaza el diario (temporal + renombrado) por las filas (fila, datos, remitente)."""
+        self._cerrar_diario()
+        if not entradas:
+            self._borrar(self.ruta_diario)
+            return
+        temporal = self.ruta_diario + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for fila, datos, remitente in entradas:
+                f.write(json.dumps(
+                    {"fila": fila, "datos": datos, "whatsapp_from": remitente},
+                    ensure_ascii=False, default=str
+                ) + "\n")
+        os.replace(temporal, self.ruta_diario)
+
+    def agregar(self, lista_datos: List[dict], remitentes: List[str]) -> Tuple[List[int], List[bool]]:
+        """
+        Agrega transferencias a la hoja en memoria y al diario. El guardado
+        en disco queda para el hilo de flush (o se hace acá si intervalo_flush es 0).
+
+        Returns:
+            Tuple (numeros_de_fila, duplicados)
+        """
+        if not lista_datos:
+            return [], []
+        with self._lock:
+            self._asegurar_actual()
+            filas, duplicados = [], []
+            for datos, remitente in zip(lista_datos, remitentes):
+                fila, es_duplicado = self._agregar_fila(datos, remitente)
+                self._anotar_en_diario(fila, datos, remitente)
+                filas.append(fila)
+                duplicados.append(es_duplicado)
+            # Al sistema operativo: sobrevive a un corte del proceso
+            self._diario.flush()
+            self._pendientes += len(filas)
+            self._estadisticas["filas"] += len(filas)
+            if self._pendientes >= self.max_pendientes:
+                self._evento.set()
+
+        # Fuera del lock: flush toma _lock_guardado antes que _lock
+        if self.intervalo_flush <= 0:
+            self.flush()
+        else:
+            self._iniciar_hilo()
+        return filas, duplicados
+
+    # --- Guardado ---
+
+    def flush(self) -> bool:
+        """
+        Guarda el libro si hay filas pendientes (temporal + renombrado).
+
+        El lock se toma sólo para preparar y para cerrar el guardado: la
+        escritura del libro (segundos con hojas grandes) no frena a agregar.
+
+        Returns:
+            True si el Excel en disco quedó al día con las filas pendientes al empezar
+        """
+        with self._lock_guardado:
+            with self._lock:
+                if self._wb is None or not self._pendientes:
+                    return True
+                self._asegurar_actual()
+                if not self._pendientes:
+                    return True
+                self._guardando = True
+                filas_guardadas = self._ultima_fila
+                pendientes = self._pendientes
+
+            ok = False
+            try:
+                ok = self._escribir_libro(pendientes)
+            finally:
+                with self._lock:
+                    if ok:
+                        # Las filas llegadas durante el guardado quedan en el diario
+                        self._despues_de_guardar(
+                            filas_guardadas, [(f, d, r) for f, _, _, d, r in self._diferidas]
+                        )
+                    else:
+                        self._estadisticas["guardados_fallidos"] += 1
+                # Las celdas diferidas se escriben de a lotes para no frenar a agregar
+                while True:
+                    with self._lock:
+                        lote = self._diferidas[:LOTE_DIFERIDAS]
+                        del self._diferidas[:LOTE_DIFERIDAS]
+                        for fila, valores, es_duplicado, _, _ in lote:
+                            self._escribir_celdas(fila, valores, es_duplicado)
+                        if not self._diferidas:
+                            self._guardando = False
+                            break
+            return ok
+
+    def _guardar(self) -> bool:
+        """Guarda el libro con el lock tomado (libro recién creado, sin filas pendientes)."""
+        if not self._escribir_libro(self._pendientes):
+            self._estadisticas["guardados_fallidos"] += 1
+            return False
+        self._despues_de_guardar(self._ultima_fila, [])
+        return True
+
+    def _escribir_libro(self, pendientes: int) -> bool:
+        """Escribe el libro en un temporal y lo renombra encima del Excel."""
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        try:
+            self._wb.save(temporal)
+            os.replace(temporal, self.ruta)
+        except PermissionError:
+            # Excel abierto en Windows: las filas siguen en memoria y en el diario
+            logger.warning(f"⏳ Excel bloqueado, {pendientes} filas pendientes, se reintenta en el próximo guardado")
+            self._borrar(temporal)
+            return False
+        except Exception as e:
+            logger.error(f"Error guardando Excel {self.ruta}: {e}")
+            self._borrar(temporal)
+            return False
+        return True
+
+    def _despues_de_guardar(self, filas_guardadas: int, restantes: List[tuple]):
+        """Registra el guardado y deja en el diario sólo las filas que no entraron (con el lock tomado)."""
+        self._mtime = self._mtime_en_disco()
+        self._indice.marcar_origen(str(self._mtime), filas_guardadas - 1)
+        self._reescribir_diario(restantes)
+        self._pendientes = len(restantes)
+        self._estadisticas["guardados"] += 1
+
+    @staticmethod
+    def _borrar(ruta: str):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+    def _cerrar_diario(self):
+        if self._diario is not None:
+            self._diario.close()
+            self._diario = None
+
+    def _iniciar_hilo(self):
+        with self._lock:
+            if self._hilo is None and not self._cerrado:
+                self._hilo = threading.Thread(target=self._bucle_flush, name="excel-flush", daemon=True)
+                self._hilo.start()
+
+    def _bucle_flush(self):
+        """Guarda cada intervalo_flush segundos, o antes si se juntaron max_pendientes filas."""
+        duracion = 0.0
+        while not self._cerrado:
+            # Con libros grandes el guardado tarda segundos de CPU (y del GIL):
+            # se espera al menos el triple de lo que tardó el último
+            self._evento.wait(max(self.intervalo_flush, 3 * duracion))
+            self._evento.clear()
+            if self._cerrado:
+                return
+            inicio = time.perf_counter()
+            with self._lock:
+                pendientes = self._pendientes
+            if pendientes and self.flush():
+                duracion = time.perf_counter() - inicio
+                logger.debug(f"Excel guardado: {pendientes} filas en {duracion:.2f}s")
+
+    def cerrar(self):
+        """Guarda lo pendiente y detiene el hilo de flush."""
+        self._cerrado = True
+        self._evento.set()
+        self.flush()
+        with self._lock:
+            self._cerrar_diario()
+            self._indice.cerrar()
+
+    # --- Consultas ---
+
+    def filas_pendientes(self) -> int:
+        with self._lock:
+            return self._pendientes
+
+    def obtener_estadisticas(self) -> dict:
+        with self._lock:
+            return dict(
+                self._estadisticas,
+                ruta=self.ruta,
+                filas_en_hoja=max(0, self._ultima_fila - 1),
+                pendientes=self._pendientes,
+                indice=self._indice.obtener_estadisticas()
+            )
+
+
+# Un escritor por archivo, compartido por la API y el folder watcher
+_writers: Dict[str, ExcelWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_excel_writer(ruta_excel: str) -> ExcelWriter:
+    """Obtiene el escritor del Excel (lo crea la primera vez)."""
+    ruta_excel = _resolver_ruta_excel(ruta_excel)
+    with _writers_lock:
+        writer = _writers.get(ruta_excel)
+        if writer is None:
+            writer = _writers[ruta_excel] = ExcelWriter(ruta_excel)
+    return writer
+
+
+@atexit.register
+def cerrar_excel_writers():
+    """Guarda lo pendiente de todos los Excel (al cerrar el proceso)."""
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        try:
+            writer.cerrar()
+        except Exception as e:
+            logger.error(f"Error cerrando Excel {writer.ruta}: {e}")
 
 
 def guardar_en_excel(
@@ -94,139 +546,75 @@ def guardar_en_excel(
 ) -> dict:
     """
     Guarda una transferencia en un archivo Excel local.
-    
+
     Args:
         datos: Diccionario con los datos extraídos del comprobante
         ruta_excel: Ruta al archivo Excel
         whatsapp_from: Número de WhatsApp del remitente
         timestamp_recepcion: Timestamp de recepción del comprobante
         cuenta_destino: Nombre de la cuenta destino identificada
-        
+
     Returns:
         Dict con resultado de la operación
     """
     try:
-        # Resolver ruta (relativa a AppData)
-        ruta_excel = resolve_appdata_path(ruta_excel, fallback_name="transferencias.xlsx")
-        
-        # Asegurar que el archivo tenga extensión .xlsx
-        if not ruta_excel.lower().endswith('.xlsx'):
-            ruta_excel += '.xlsx'
-
-        # Crear directorio si no existe
-        directorio = os.path.dirname(ruta_excel)
-        if directorio and not os.path.exists(directorio):
-            os.makedirs(directorio)
-        
-        # Cargar o crear archivo
-        if os.path.exists(ruta_excel):
-            wb = load_workbook(ruta_excel)
-            ws = wb.active
-        else:
-            wb = _crear_excel_con_headers(ruta_excel)
-            ws = wb.active
-        
-        # Formatear fecha recepción
-        try:
-            fecha_recepcion = datetime.fromisoformat(timestamp_recepcion.replace("Z", "+00:00"))
-            fecha_formateada = fecha_recepcion.strftime("%d/%m/%Y %H:%M")
-        except:
-            fecha_formateada = timestamp_recepcion or datetime.now().strftime("%d/%m/%Y %H:%M")
-        
-        # Preparar datos
-        monto = datos.get("monto_numerico", 0)
-        fecha_deposito = str(datos.get("fecha_operacion", "")).strip()
-        
-        # Lógica para nombre de emisor (Manejo de Depósitos)
-        emisor_nombre = datos.get("emisor_nombre", "")
-        if not emisor_nombre:
-            concepto = datos.get("concepto", "").lower()
-            if "deposito" in concepto or "efectivo" in concepto:
-                emisor_nombre = "DEPÓSITO EN EFECTIVO"
-        
-        # Convertir confianza a etiqueta
-        confianza_val = datos.get("confianza", 0)
-        confianza_str = "OPTIMA" if confianza_val >= 0.90 else "REVEER"
-        
-        # Detectar duplicado
-        es_duplicado = _detectar_duplicado(ws, fecha_deposito, monto)
-        
-        # Preparar número de WhatsApp
-        numero_wa = whatsapp_from.replace("@c.us", "") if whatsapp_from else ""
-        
-        # Crear fila con las 16 columnas
-        # Errores de validación
-        errores_list = datos.get("errores", [])
-        errores_str = "; ".join(errores_list) if isinstance(errores_list, list) else str(errores_list or "")
-        
-        fila = [
-            datos.get("archivo_origen", ""),      # A: Archivo
-            "WhatsApp" if numero_wa else "API",   # B: Fuente
-            fecha_deposito,                       # C: Fecha Operación
-            monto,                                # D: Monto
-            emisor_nombre,                        # E: Emisor Nombre
-            datos.get("emisor_cuil", ""),         # F: CUIT Emisor
-            datos.get("emisor_cbu", ""),          # G: CBU/CVU Emisor
-            datos.get("banco_emisor", ""),        # H: Banco Emisor
-            datos.get("receptor_nombre", ""),     # I: Receptor Nombre
-            datos.get("receptor_cuil", ""),       # J: CUIT Receptor
-            datos.get("receptor_cbu", ""),        # K: CBU/CVU Receptor
-            datos.get("banco_receptor", ""),      # L: Banco Receptor
-            datos.get("referencia", ""),          # M: Referencia
-            datos.get("concepto", ""),            # N: Concepto
-            confianza_str,                        # O: Confianza
-            errores_str,                          # P: Errores
-            numero_wa                             # Q: WhatsApp (se agrega hipervínculo después)
-        ]
-        
-        # Agregar fila
-        ws.append(fila)
-        nueva_fila = ws.max_row
-        
-        # Marcar como duplicado si corresponde
-        if es_duplicado:
-            for col in range(1, len(HEADERS) + 1):
-                ws.cell(row=nueva_fila, column=col).fill = DUPLICATE_FILL
-        
-        # Agregar hipervínculo de WhatsApp (columna Q = 17)
-        if numero_wa:
-            wa_cell = ws.cell(row=nueva_fila, column=17)
-            # Crear link a WhatsApp Web
-            wa_link = f"https://wa.me/{numero_wa}"
-            wa_cell.hyperlink = wa_link
-            wa_cell.style = "Hyperlink"
-        
-        # Guardar
-        wb.save(ruta_excel)
-        
+        writer = get_excel_writer(ruta_excel)
+        filas, duplicados = writer.agregar([datos], [whatsapp_from])
+
         return {
             "success": True,
-            "message": "Guardado en Excel" + (" (Duplicado)" if es_duplicado else ""),
-            "ruta": ruta_excel,
-            "fila": nueva_fila,
-            "es_duplicado": es_duplicado
+            "message": "Guardado en Excel" + (" (Duplicado)" if duplicados[0] else ""),
+            "ruta": writer.ruta,
+            "fila": filas[0],
+            "es_duplicado": duplicados[0]
         }
-        
-    except PermissionError as e:
-        # El archivo está bloqueado (probablemente abierto en Excel)
-        # Agregar a la cola de reintentos
-        entry = {
-            "datos": datos,
-            "ruta_excel": ruta_excel,
-            "whatsapp_from": whatsapp_from,
-            "timestamp_recepcion": timestamp_recepcion,
-            "cuenta_destino": cuenta_destino,
-            "intentos": 0
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
         }
-        _add_to_pending_queue(entry)
-        logger.warning(f"⏳ Excel bloqueado, agregado a cola de reintentos ({len(_pending_entries)} pendientes)")
+
+
+def guardar_lote_en_excel(
+    lista_datos: List[dict],
+    ruta_excel: str,
+    whatsapp_from: str = "",
+    timestamp_recepcion: str = "",
+    cuentas_destino: Optional[List[str]] = None,
+    remitentes: Optional[List[str]] = None,
+    timestamps: Optional[List[str]] = None
+) -> dict:
+    """
+    Guarda varias transferencias en una sola escritura al Excel.
+
+    Args:
+        lista_datos: Datos extraídos de cada comprobante
+        ruta_excel: Ruta al archivo Excel
+        whatsapp_from: Número de WhatsApp del remitente
+        timestamp_recepcion: Timestamp de recepción
+        cuentas_destino: Cuenta destino de cada transferencia (mismo orden)
+        remitentes: WhatsApp de cada transferencia (reemplaza a whatsapp_from)
+        timestamps: Timestamp de cada transferencia (reemplaza a timestamp_recepcion)
+
+    Returns:
+        Dict con resultado de la operación ("filas" y "duplicados" por transferencia)
+    """
+    remitentes = remitentes or [whatsapp_from] * len(lista_datos)
+    try:
+        writer = get_excel_writer(ruta_excel)
+        filas, duplicados = writer.agregar(lista_datos, remitentes)
+
+        cantidad_duplicados = sum(duplicados)
         return {
-            "success": True,  # Reportamos éxito porque se reintentará
-            "message": "Excel bloqueado - guardado en cola para reintentar automáticamente",
-            "pending": True,
-            "pending_count": len(_pending_entries)
+            "success": True,
+            "message": f"{len(filas)} filas guardadas en Excel"
+                       + (f" ({cantidad_duplicados} duplicadas)" if cantidad_duplicados else ""),
+            "ruta": writer.ruta,
+            "filas": filas,
+            "duplicados": duplicados
         }
-        
+
     except Exception as e:
         return {
             "success": False,
@@ -234,63 +622,8 @@ def guardar_en_excel(
         }
 
 
-def _add_to_pending_queue(entry: Dict[str, Any]):
-    """Agrega una entrada a la cola de pendientes y arranca el thread de retry."""
-    global _retry_thread, _retry_running
-    
-    with _pending_lock:
-        _pending_entries.append(entry)
-        
-    # Iniciar thread de retry si no está corriendo
-    if not _retry_running:
-        _retry_running = True
-        _retry_thread = threading.Thread(target=_retry_pending_entries, daemon=True)
-        _retry_thread.start()
-
-
-def _retry_pending_entries():
-    """Thread que reintenta guardar las entradas pendientes cada 10 segundos."""
-    global _retry_running
-    
-    while True:
-        time.sleep(10)  # Esperar 10 segundos entre intentos
-        
-        with _pending_lock:
-            if not _pending_entries:
-                _retry_running = False
-                logger.info("✅ Cola de Excel vacía, deteniendo reintentos")
-                return
-            
-            # Tomar la primera entrada pendiente
-            entry = _pending_entries[0]
-        
-        # Intentar guardar
-        entry["intentos"] += 1
-        logger.info(f"🔄 Reintentando guardar en Excel (intento #{entry['intentos']}, {len(_pending_entries)} pendientes)...")
-        
-        result = guardar_en_excel(
-            datos=entry["datos"],
-            ruta_excel=entry["ruta_excel"],
-            whatsapp_from=entry["whatsapp_from"],
-            timestamp_recepcion=entry["timestamp_recepcion"],
-            cuenta_destino=entry["cuenta_destino"]
-        )
-        
-        if result.get("success") and not result.get("pending"):
-            # Guardado exitoso, remover de la cola
-            with _pending_lock:
-                if _pending_entries and _pending_entries[0] is entry:
-                    _pending_entries.pop(0)
-            logger.info(f"✅ Entrada guardada exitosamente en Excel (quedaban {len(_pending_entries)} pendientes)")
-        elif entry["intentos"] >= 30:  # Máximo 30 intentos (5 minutos)
-            # Demasiados intentos, descartar
-            with _pending_lock:
-                if _pending_entries and _pending_entries[0] is entry:
-                    _pending_entries.pop(0)
-            logger.error(f"❌ Descartando entrada después de {entry['intentos']} intentos fallidos")
-
-
 def get_pending_count() -> int:
-    """Retorna el número de entradas pendientes en la cola."""
-    with _pending_lock:
-        return len(_pending_entries)
+    """Retorna el número de filas agregadas que todavía no se guardaron en disco."""
+    with _writers_lock:
+        writers = list(_writers.values())
+    return sum(writer.filas_pendientes() for writer in writers)
@@ -0,0 +1,371 @@
+"""
+Cola de escritura a Google Sheets en segundo plano.
+
+Las cuotas de Sheets son por minuto: un append_row más un format por
+comprobante las agota en una ráfaga, y un 429 hacía fallar el guardado sin
+reintento. La cola junta las filas y un hilo las manda juntas:
+
+- un solo append_rows por envío y un solo batch_update (batch_format) para
+  marcar los duplicados;
+- se envía al juntar SHEETS_FLUSH_ROWS filas o cada SHEETS_FLUSH_SECONDS;
+- cada llamada a la API pasa por un TokenBucket con la cuota de escrituras
+  por minuto (SHEETS_WRITES_PER_MINUTE), y ante errores transitorios (429,
+  5xx, red) se reintenta con backoff (respetando Retry-After) sin descartar
+  filas;
+- ante errores permanentes (hoja borrada o sin permiso, rango inválido,
+  gspread no instalado) el lote no se reintenta: pasa a un JSONL de
+  descartadas con el error, se loguea y se informa en /health, y la cola
+  sigue con las filas siguientes;
+- cada fila encolada se escribe primero en un archivo JSONL en disco que
+  se vacía recién cuando la hoja la aceptó, así un corte del proceso no
+  pierde filas (al arrancar se reenvían las que quedaron). Si el proceso
+  se corta entre el append y el vaciado, esas filas se reenvían y el
+  espejo local de la hoja las marca como duplicadas.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.config import SHEETS_FLUSH_SECONDS, SHEETS_FLUSH_ROWS, SHEETS_WRITES_PER_MINUTE
+from app.paths import get_sheets_dead_letter_path, get_sheets_spill_path
+from app.resilience import TokenBucket, espera_reintento
+from storage.sheets_session import SheetsNoConfigurado, gspread
+from storage.sheets_storage import HEADERS, abrir_hoja, agregar_filas, armar_filas, invalidar_hoja
+
+logger = logging.getLogger(__name__)
+
+# Filas máximas por append_rows
+MAX_FILAS_POR_ENVIO = 500
+
+# Formato de las filas duplicadas
+FORMATO_DUPLICADO = {"backgroundColor": {"red": 1.0, "green": 1.0, "blue": 0.8}}
+
+# Códigos HTTP de Sheets que reintentar no arregla (rango inválido, sin permiso, hoja borrada)
+CODIGOS_PERMANENTES = {400, 403, 404}
+
+# Columna final de la hoja (A:K)
+_ULTIMA_COLUMNA = chr(ord('A') + len(HEADERS) - 1)
+
+# Cuota de escrituras compartida por todas las hojas (es por usuario/proyecto)
+_cuota = TokenBucket(max(1, SHEETS_WRITES_PER_MINUTE // 6), SHEETS_WRITES_PER_MINUTE / 60) \
+    if SHEETS_WRITES_PER_MINUTE > 0 else None
+
+
+def _esperar_cuota(llamadas: int = 1):
+    if _cuota is not None:
+        _cuota.adquirir(llamadas)
+
+
+def es_error_permanente(error: Exception) -> bool:
+    """Indica si un error de Sheets no se arregla reintentando (las filas se descartan)."""
+    if isinstance(error, (ImportError, SheetsNoConfigurado, FileNotFoundError)):
+        # Modo Lite, credenciales u hoja no configuradas, o credenciales inexistentes.
+        # Otros ValueError (ej. JSONDecodeError de una respuesta cortada) se reintentan
+        return True
+    if gspread is not None and isinstance(
+            error, (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound)):
+        return True
+    # gspread.exceptions.APIError: "code" en gspread 6, "response" en versiones anteriores
+    codigo = getattr(error, "code", None)
+    if not isinstance(codigo, int):
+        codigo = getattr(getattr(error, "response", None), "status_code", None)
+    return codigo in CODIGOS_PERMANENTES
+
+
+class ColaSheets:
+    """Filas pendientes de una hoja, con respaldo en disco y un hilo que las envía."""
+
+    def __init__(self, credentials_path: str, sheet_id: str, sheet_name: str,
+                 intervalo: float = SHEETS_FLUSH_SECONDS, max_filas: int = SHEETS_FLUSH_ROWS):
+        self.credentials_path = credentials_path
+        self.sheet_id = sheet_id
+        self.sheet_name = sheet_name
+        self.intervalo = intervalo
+        self.max_filas = max(1, max_filas)
+        self.ruta = get_sheets_spill_path(f"{sheet_id}/{sheet_name}")
+        self.ruta_descartadas = get_sheets_dead_letter_path(f"{sheet_id}/{sheet_name}")
+        self._lock = threading.Lock()
+        self._envio_lock = threading.Lock()
+        self._evento = threading.Event()
+        self._filas: List[list] = self._leer_respaldo()
+        self._hilo: Optional[threading.Thread] = None
+        self._cerrado = False
+        self._fallos_seguidos = 0
+        self._estadisticas = {
+            "filas_enviadas": 0, "envios": 0, "errores": 0, "ultimo_error": None,
+            "descartadas": self._contar_descartadas(), "ultimo_descarte": None
+        }
+        if self._filas:
+            logger.info(f"Sheets {sheet_name}: {len(self._filas)} filas pendientes de la ejecución anterior")
+            self._iniciar_hilo()
+            self._evento.set()
+
+    # --- Respaldo en disco ---
+
+    def _leer_respaldo(self) -> List[list]:
+        if not os.path.exists(self.ruta):
+            return []
+        filas = []
+        with open(self.ruta, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    filas.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir si el proceso se cortó
+                    continue
+        return filas
+
+    def _reescribir_respaldo(self):
+        """Deja en disco sólo las filas que siguen pendientes (con el lock tomado)."""
+        if not self._filas:
+            try:
+                os.remove(self.ruta)
+            except FileNotFoundError:
+                pass
+            return
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for fila in self._filas:
+                f.write(json.dumps(fila, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+
+    def _contar_descartadas(self) -> int:
+        if not os.path.exists(self.ruta_descartadas):
+            return 0
+        with open(self.ruta_descartadas, "r", encoding="utf-8") as f:
+            return sum(1 for _ in f)
+
+    def _descartar(self, lote: List[list], error: str):
+        """Pasa el lote al archivo de descartadas con el error (con el lock tomado)."""
+        fecha = datetime.now().isoformat(timespec="seconds")
+        with open(self.ruta_descartadas, "a", encoding="utf-8") as f:
+            for fila in lote:
+                f.write(json.dumps({"fila": fila, "error": error, "fecha": fecha},
+                                   ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._estadisticas["descartadas"] += len(lote)
+        self._estadisticas["ultimo_descarte"] = f"{fecha} {error}"
+
+    # --- Encolado ---
+
+    def encolar(self, filas: List[list]) -> int:
+        """
+        Agrega filas A:K (ya armadas) a la cola y al respaldo en disco.
+
+        Returns:
+            Filas pendientes después de encolar
+        """
+        with self._lock:
+            with open(self.ruta, "a", encoding="utf-8") as f:
+                for fila in filas:
+                    f.write(json.dumps(fila, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._filas.extend(filas)
+            pendientes = len(self._filas)
+        if pendientes >= self.max_filas:
+            self._evento.set()
+        self._iniciar_hilo()
+        return pendientes
+
+    # --- Envío ---
+
+    def enviar(self) -> bool:
+        """
+        Envía las filas pendientes (hasta MAX_FILAS_POR_ENVIO por llamada).
+        Un lote con error permanente se descarta y se sigue con el siguiente.
+
+        Returns:
+            True si no quedó nada pendiente
+
+        Raises:
+            La excepción del primer error transitorio (el lote queda en la cola)
+        """
+        with self._envio_lock:
+            while True:
+                with self._lock:
+                    lote = self._filas[:MAX_FILAS_POR_ENVIO]
+                if not lote:
+                    return True
+                try:
+                    self._enviar_lote(lote)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"[:200]
+                    self._estadisticas["errores"] += 1
+                    self._estadisticas["ultimo_error"] = error
+                    invalidar_hoja(self.credentials_path, self.sheet_id, self.sheet_name)
+                    if es_error_permanente(e):
+                        logger.error(
+                            f"Sheets ({self.sheet_name}) rechazó {len(lote)} filas, "
+                            f"pasan a {self.ruta_descartadas}: {error}"
+                        )
+                        with self._lock:
+                            self._descartar(lote, error)
+                            del self._filas[:len(lote)]
+                            self._reescribir_respaldo()
+                        continue
+                    self._fallos_seguidos += 1
+                    logger.warning(f"Error enviando {len(lote)} filas a Sheets ({self.sheet_name}), se reintenta: {e}")
+                    raise
+                self._fallos_seguidos = 0
+                with self._lock:
+                    del self._filas[:len(lote)]
+                    self._reescribir_respaldo()
+
+    def _enviar_lote(self, lote: List[list]):
+        """Un append_rows y, si hay duplicados, un solo batch_format."""
+        # Duplicados y número de fila salen del espejo local: sólo el append_rows
+        _esperar_cuota()
+        sheet = abrir_hoja(self.credentials_path, self.sheet_id, self.sheet_name)
+        primera_fila, duplicados = agregar_filas(sheet, self.sheet_id, self.sheet_name, lote)
+        self._estadisticas["filas_enviadas"] += len(lote)
+        self._estadisticas["envios"] += 1
+
+        formatos = [
+            {"range": f"A{primera_fila + i}:{_ULTIMA_COLUMNA}{primera_fila + i}", "format": FORMATO_DUPLICADO}
+            for i, es_duplicado in enumerate(duplicados) if es_duplicado
+        ]
+        if formatos:
+            # Las filas ya están en la hoja: si falla el formato no se reenvían
+            try:
+                _esperar_cuota()
+                sheet.batch_format(formatos)
+            except Exception as e:
+                logger.warning(f"No se pudieron marcar {len(formatos)} duplicados en Sheets: {e}")
+
+    # --- Hilo ---
+
+    def _iniciar_hilo(self):
+        with self._lock:
+            if self._hilo is None and not self._cerrado:
+                self._hilo = threading.Thread(target=self._bucle, name="sheets-cola", daemon=True)
+                self._hilo.start()
+
+    def _bucle(self):
+        """Envía cada intervalo o al juntar max_filas; ante errores transitorios espera con backoff."""
+        espera = self.intervalo
+        while not self._cerrado:
+            self._evento.wait(espera)
+            self._evento.clear()
+            if self._cerrado:
+                return
+            try:
+                self.enviar()
+                espera = self.intervalo
+            except Exception as e:
+                espera = max(self.intervalo, espera_reintento(self._fallos_seguidos, e))
+
+    def cerrar(self, timeout: float = 10.0):
+        """Último intento de envío; lo que no salga queda en disco para el próximo arranque."""
+        self._cerrado = True
+        self._evento.set()
+        if not self.filas_pendientes():
+            return
+        hilo = threading.Thread(target=self._enviar_al_cerrar, daemon=True)
+        hilo.start()
+        hilo.join(timeout)
+
+    def _enviar_al_cerrar(self):
+        try:
+            self.enviar()
+        except Exception:
+            pass
+
+    # --- Consultas ---
+
+    def filas_pendientes(self) -> int:
+        with self._lock:
+            return len(self._filas)
+
+    def obtener_estadisticas(self) -> dict:
+        estadisticas = dict(self._estadisticas, pendientes=self.filas_pendientes(), hoja=self.sheet_name)
+        if estadisticas["descartadas"]:
+            estadisticas["ruta_descartadas"] = self.ruta_descartadas
+        return estadisticas
+
+
+# Una cola por hoja, compartida por la API y el folder watcher
+_colas: Dict[Tuple[str, str, str], ColaSheets] = {}
+_colas_lock = threading.Lock()
+
+
+def get_cola_sheets(credentials_path: str, sheet_id: str, sheet_name: str) -> ColaSheets:
+    """Obtiene la cola de escritura de una hoja (la crea la primera vez)."""
+    clave = (credentials_path, sheet_id, sheet_name)
+    with _colas_lock:
+        cola = _colas.get(clave)
+        if cola is None:
+            cola = _colas[clave] = ColaSheets(credentials_path, sheet_id, sheet_name)
+    return cola
+
+
+def encolar_en_sheets(
+    lista_datos: List[dict],
+    credentials_path: str,
+    sheet_id: str,
+    sheet_name: str = "Hoja 1",
+    cuentas_destino: Optional[List[str]] = None,
+    remitentes: Optional[List[str]] = None,
+    timestamps: Optional[List[str]] = None
+) -> dict:
+    """
+    Encola transferencias para Google Sheets (mismos argumentos que
+    guardar_lote_en_sheets). Los duplicados se detectan y marcan al enviar.
+
+    Returns:
+        Dict con resultado de la operación ("pendientes" en la cola)
+    """
+    cantidad = len(lista_datos)
+    cuentas_destino = cuentas_destino or ["Cuenta Desconocida"] * cantidad
+    remitentes = remitentes or [""] * cantidad
+    timestamps = timestamps or [""] * cantidad
+    try:
+        filas = armar_filas(lista_datos, cuentas_destino, remitentes, timestamps)
+        pendientes = get_cola_sheets(credentials_path, sheet_id, sheet_name).encolar(filas)
+        return {
+            "success": True,
+            "message": f"{cantidad} filas encoladas para Google Sheets",
+            "pending": True,
+            "pendientes": pendientes
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+def get_sheets_pending_count() -> int:
+    """Filas encoladas que todavía no llegaron a Google Sheets."""
+    with _colas_lock:
+        colas = list(_colas.values())
+    return sum(cola.filas_pendientes() for cola in colas)
+
+
+def get_sheets_dead_letter_count() -> int:
+    """Filas que Google Sheets rechazó con un error permanente."""
+    with _colas_lock:
+        colas = list(_colas.values())
+    return sum(cola.obtener_estadisticas()["descartadas"] for cola in colas)
+
+
+def obtener_estadisticas_colas() -> List[dict]:
+    with _colas_lock:
+        colas = list(_colas.values())
+    return [cola.obtener_estadisticas() for cola in colas]
+
+
+@atexit.register
+def cerrar_colas_sheets():
+    """Intenta enviar lo pendiente al cerrar el proceso."""
+    with _colas_lock:
+        colas = list(_colas.values())
+    for cola in colas:
+        cola.cerrar()
@@ -0,0 +1,161 @@
+"""
+Sesión de Google Sheets de larga vida.
+
+Antes cada comprobante leía el archivo de la cuenta de servicio, volvía a
+autorizar gspread y abría el documento y la hoja (open_by_key, worksheet,
+row_values(1)) antes de escribir. La sesión guarda las credenciales y el
+cliente, reutiliza los handles de cada hoja y verifica los headers una sola
+vez por proceso, así una escritura cuesta sólo sus propias llamadas.
+
+El token OAuth se renueva antes de que venza (MARGEN_REFRESCO) al pedir una
+hoja, para no pagar el refresco en medio de una escritura. Si una llamada
+falla, invalidar() descarta el handle y la próxima vez se reabre la hoja.
+"""
+try:
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from google.auth.transport.requests import Request as GoogleRequest
+    SHEETS_AVAILABLE = True
+except ImportError:
+    SHEETS_AVAILABLE = False
+    gspread = None
+    Credentials = None
+    GoogleRequest = None
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Scopes necesarios para Google Sheets
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+# Se renueva el token si le queda menos que esto (los tokens duran 1 hora)
+MARGEN_REFRESCO = timedelta(minutes=5)
+
+
+class SheetsNoConfigurado(ValueError):
+    """Faltan las credenciales o la hoja en la configuración de Sheets."""
+
+
+def _tiempo_restante(expiry: datetime) -> timedelta:
+    """Tiempo hasta el vencimiento (google-auth guarda expiry como UTC sin zona)."""
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry - datetime.now(timezone.utc)
+
+
+class SesionSheets:
+    """Credenciales, cliente gspread y hojas abiertas de una cuenta de servicio."""
+
+    def __init__(self, credentials_path: str):
+        if not SHEETS_AVAILABLE:
+            raise ImportError("Librería gspread no instalada (Modo Lite).")
+        if not credentials_path:
+            raise SheetsNoConfigurado("credentials_path no configurado")
+        self.credentials_path = credentials_path
+        self._lock = threading.Lock()
+        self._credenciales = None
+        self._cliente = None
+        self._hojas: Dict[Tuple[str, str], object] = {}
+        self._headers_verificados: Set[Tuple[str, str]] = set()
+        self._estadisticas = {"autorizaciones": 0, "refrescos": 0, "aperturas": 0, "reusos": 0, "invalidaciones": 0}
+
+    def _autorizar(self):
+        """Lee la cuenta de servicio y autoriza gspread (con el lock tomado)."""
+        self._credenciales = Credentials.from_service_account_file(self.credentials_path, scopes=SCOPES)
+        self._cliente = gspread.authorize(self._credenciales)
+        self._hojas.clear()
+        self._estadisticas["autorizaciones"] += 1
+
+    def _refrescar_si_vence(self):
+        """Renueva el token si no hay o está por vencer (con el lock tomado)."""
+        credenciales = self._credenciales
+        if credenciales.token and credenciales.expiry and \
+                _tiempo_restante(credenciales.expiry) > MARGEN_REFRESCO:
+            return
+        credenciales.refresh(GoogleRequest())
+        self._estadisticas["refrescos"] += 1
+
+    @property
+    def cliente(self):
+        """Cliente gspread autorizado y con el token vigente."""
+        with self._lock:
+            if self._cliente is None:
+                self._autorizar()
+            self._refrescar_si_vence()
+            return self._cliente
+
+    def hoja(self, sheet_id: str, sheet_name: str, headers: Optional[List[str]] = None):
+        """
+        Worksheet abierta (reutilizada entre llamadas). Con headers, la
+        primera vez en el proceso se verifica la fila 1 y se corrige si hace falta.
+        """
+        if not sheet_id:
+            raise SheetsNoConfigurado("sheets_id no configurado")
+        cliente = self.cliente
+        clave = (sheet_id, sheet_name)
+        with self._lock:
+            hoja = self._hojas.get(clave)
+            if hoja is not None:
+                self._estadisticas["reusos"] += 1
+            else:
+                hoja = cliente.open_by_key(sheet_id).worksheet(sheet_name)
+                self._hojas[clave] = hoja
+                self._estadisticas["aperturas"] += 1
+            verificar = headers is not None and clave not in self._headers_verificados
+
+        if verificar:
+            try:
+                first_row = hoja.row_values(1)
+                if not first_row or first_row != headers:
+                    hoja.update(f"A1:{chr(ord('A') + len(headers) - 1)}1", [headers])
+                with self._lock:
+                    self._headers_verificados.add(clave)
+            except Exception as e:
+                # Si falla la lectura se sigue igual y se reintenta en la próxima escritura
+                logger.warning(f"No se pudieron verificar los headers de {sheet_name}: {e}")
+        return hoja
+
+    def invalidar(self, sheet_id: str, sheet_name: str):
+        """Descarta el handle de una hoja (ej. después de un error) para reabrirla."""
+        with self._lock:
+            if self._hojas.pop((sheet_id, sheet_name), None) is not None:
+                self._estadisticas["invalidaciones"] += 1
+            self._headers_verificados.discard((sheet_id, sheet_name))
+
+    def obtener_estado(self) -> dict:
+        """Estado de la sesión, sin llamadas a la red."""
+        with self._lock:
+            expiry = self._credenciales.expiry if self._credenciales is not None else None
+            return dict(
+                self._estadisticas,
+                autorizada=self._cliente is not None,
+                token_vence_en_segundos=int(_tiempo_restante(expiry).total_seconds()) if expiry else None,
+                hojas_abiertas=len(self._hojas)
+            )
+
+
+# Una sesión por archivo de credenciales, compartida por todo el proceso
+_sesiones: Dict[str, SesionSheets] = {}
+_sesiones_lock = threading.Lock()
+
+
+def get_sesion_sheets(credentials_path: str) -> SesionSheets:
+    """Obtiene la sesión de Sheets de esas credenciales (la crea la primera vez)."""
+    with _sesiones_lock:
+        sesion = _sesiones.get(credentials_path)
+        if sesion is None:
+            sesion = _sesiones[credentials_path] = SesionSheets(credentials_path)
+    return sesion
+
+
+def obtener_estado_sesiones() -> dict:
+    """Estado de todas las sesiones abiertas (para /health)."""
+    with _sesiones_lock:
+        sesiones = list(_sesiones.values())
+    return {s.credentials_path: s.obtener_estado() for s in sesiones}
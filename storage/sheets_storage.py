@@ -2,23 +2,18 @@
 Almacenamiento de transferencias en Google Sheets.
 Refactorizado desde app/sheets.py para el nuevo módulo storage.
 """
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    SHEETS_AVAILABLE = True
-except ImportError:
-    SHEETS_AVAILABLE = False
-    gspread = None
-    Credentials = None
+import logging
+import re
+import threading
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple
 
+from app.paths import get_duplicate_index_path
+from storage.duplicate_index import IndiceDuplicados, claves_de
+from storage.sheets_session import SheetsNoConfigurado, get_sesion_sheets
+
+logger = logging.getLogger(__name__)
 
-# Scopes necesarios para Google Sheets
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
 
 # Headers definidos
 HEADERS = [
@@ -30,45 +25,194 @@ HEADERS = [
 ]
 
 
-def _get_sheets_client(credentials_path: str):
-    """Obtiene un cliente autenticado de Google Sheets."""
-    if not SHEETS_AVAILABLE:
-        raise ImportError("Librería gspread no instalada (Modo Lite).")
+def abrir_hoja(credentials_path: str, sheet_id: str, sheet_name: str):
+    """Hoja de la sesión compartida (headers verificados una vez por proceso)."""
+    return get_sesion_sheets(credentials_path).hoja(sheet_id, sheet_name, HEADERS)
+
+
+def invalidar_hoja(credentials_path: str, sheet_id: str, sheet_name: str):
+    """Después de un error, la próxima escritura reabre la hoja."""
+    try:
+        get_sesion_sheets(credentials_path).invalidar(sheet_id, sheet_name)
+    except (ImportError, SheetsNoConfigurado):
+        pass
+
+
+# Espejo local de cada hoja ("sheet_id/sheet_name"): cantidad de filas y
+# claves de duplicados (fecha, monto, referencia, CBU), más el lock de escritura
+_espejos: Dict[str, IndiceDuplicados] = {}
+_bloqueos: Dict[str, threading.Lock] = {}
+_verificadas: Set[str] = set()
+_espejos_lock = threading.Lock()
+
+
+def _leer_claves(sheet, saltear: int, hasta: Optional[int] = None) -> list:
+    """
+    Claves de duplicados de las filas de datos desde la número saltear + 1
+    (columnas B:J), hasta la fila `hasta` de la hoja inclusive (None = hasta el final).
+    """
+    claves = []
+    for fila in sheet.get(f"B{saltear + 2}:J{hasta or ''}"):
+        fila = list(fila) + [""] * (9 - len(fila))
+        # B: Fecha Depósito, C: Monto, J: Referencia, F: CBU Emisor
+        claves.append(claves_de(fila[0], fila[1], fila[8], fila[4]))
+    return claves
+
+
+def _primera_fila_escrita(respuesta) -> Optional[int]:
+    """Primera fila donde quedó un append_rows, según updates.updatedRange ("'Hoja 1'!A12:K14")."""
+    try:
+        rango = respuesta["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    coincidencia = re.match(r"[A-Z]+(\d+)", rango.rsplit("!", 1)[-1])
+    return int(coincidencia.group(1)) if coincidencia else None
+
+
+def _espejo(clave: str):
+    with _espejos_lock:
+        if clave not in _espejos:
+            _espejos[clave] = IndiceDuplicados(get_duplicate_index_path(clave))
+            _bloqueos[clave] = threading.Lock()
+        return _espejos[clave], _bloqueos[clave]
+
+
+def _descartar_espejo(clave: str, espejo: IndiceDuplicados):
+    """La próxima escritura reconstruye el espejo leyendo la hoja completa."""
+    espejo.invalidar()
+    _verificadas.discard(clave)
+
+
+def _con_respuesta_http(error: Exception) -> bool:
+    """True si el error trae la respuesta HTTP de la API (gspread.exceptions.APIError)."""
+    if isinstance(getattr(error, "code", None), int):
+        return True
+    return getattr(getattr(error, "response", None), "status_code", None) is not None
+
+
+def agregar_filas(sheet, sheet_id: str, sheet_name: str, filas: List[list]) -> Tuple[int, List[bool]]:
+    """
+    Agrega filas A:K al final de la hoja con un solo append_rows.
+
+    Los duplicados y la fila donde va a quedar cada una salen del espejo
+    local, sin leer la hoja: la primera vez en el proceso se compara la
+    cantidad de filas (col_values de A) y se traen sólo las filas nuevas
+    desde la última sincronización. Después, la respuesta del append dice
+    dónde quedaron las filas: si alguien más agregó filas en el medio se
+    traen sólo esas, y si se borraron filas el espejo se reconstruye en la
+    próxima escritura. Si la API rechaza el append se sacan del espejo sólo
+    las filas de este envío; se reconstruye únicamente si no se sabe si el
+    append llegó a escribirse.
+
+    Returns:
+        Tuple (primera_fila_escrita, duplicados)
+    """
+    clave = f"{sheet_id}/{sheet_name}"
+    espejo, bloqueo = _espejo(clave)
+    with bloqueo:
+        if clave not in _verificadas:
+            total_filas = max(0, len(sheet.col_values(1)) - 1)
+            espejo.sincronizar(clave, total_filas, lambda saltear: _leer_claves(sheet, saltear))
+            _verificadas.add(clave)
+
+        filas_antes = espejo.filas
+        esperada = filas_antes + 2
+        enviado = False
+        try:
+            # El espejo incluye las filas anteriores del mismo lote
+            duplicados = [registrar_fila(espejo, fila) for fila in filas]
+            enviado = True
+            respuesta = sheet.append_rows(filas, value_input_option='USER_ENTERED')
+        except Exception as e:
+            if enviado and not _con_respuesta_http(e):
+                # Timeout o corte después de mandar el pedido: no se sabe si
+                # las filas quedaron en la hoja
+                _descartar_espejo(clave, espejo)
+            else:
+                # La hoja respondió con error (429, 5xx...): no se escribió
+                # nada, se sacan sólo las filas de este envío
+                espejo.deshacer(filas_antes)
+            raise
+
+        primera_fila = _primera_fila_escrita(respuesta) or esperada
+        if primera_fila > esperada:
+            # Filas agregadas desde afuera desde la última escritura: sólo esas
+            try:
+                espejo.agregar_existentes(_leer_claves(sheet, esperada - 2, hasta=primera_fila - 1))
+            except Exception as e:
+                logger.warning(f"No se pudieron leer las filas nuevas de {sheet_name}: {e}")
+                _descartar_espejo(clave, espejo)
+                return primera_fila, duplicados
+        elif primera_fila < esperada:
+            logger.info(f"Se borraron filas de {sheet_name}, el espejo local se reconstruye")
+            _descartar_espejo(clave, espejo)
+            return primera_fila, duplicados
+        espejo.marcar_origen(clave)
+        return primera_fila, duplicados
+
+
+def registrar_fila(espejo: IndiceDuplicados, fila: list) -> bool:
+    """Agrega una fila A:K al espejo; True si es duplicada."""
+    return espejo.registrar(fila[1], fila[2], fila[9], fila[5])
+
+
+def _formatear_fecha_aviso(timestamp_recepcion: str) -> str:
+    """Formatea el timestamp de recepción como DD/MM/YYYY HH:MM."""
+    try:
+        fecha_recepcion = datetime.fromisoformat(timestamp_recepcion.replace("Z", "+00:00"))
+        return fecha_recepcion.strftime("%d/%m/%Y %H:%M")
+    except:
+        return timestamp_recepcion or datetime.now().strftime("%d/%m/%Y %H:%M")
+
+
+def _armar_fila(datos: dict, fecha_formateada: str, whatsapp_from: str, cuenta_destino: str) -> list:
+    """Arma la fila A:K de una transferencia."""
+    monto = datos.get("monto_numerico", 0)
+    fecha_deposito = str(datos.get("fecha_operacion", "")).strip()
     
-    if not credentials_path:
-        raise ValueError("credentials_path no configurado")
+    # Lógica para nombre de emisor
+    emisor_nombre = datos.get("emisor_nombre", "")
+    if not emisor_nombre:
+        concepto = datos.get("concepto", "").lower()
+        if "deposito" in concepto or "efectivo" in concepto:
+            emisor_nombre = "DEPÓSITO EN EFECTIVO"
     
-    credentials = Credentials.from_service_account_file(
-        credentials_path,
-        scopes=SCOPES
-    )
-    return gspread.authorize(credentials)
-
-
-def _detectar_duplicado(todas_las_filas: list, fecha_deposito: str, monto: float) -> bool:
-    """Detecta si ya existe una transferencia con la misma fecha y monto."""
-    for i, row in enumerate(todas_las_filas):
-        if i == 0:
-            continue  # Saltear header
-        if len(row) >= 3:
-            row_fecha = str(row[1]).strip()
-            row_monto = row[2]
-            
-            fechas_match = (row_fecha and row_fecha == fecha_deposito)
-            
-            montos_match = False
-            try:
-                m_row_clean = str(row_monto).replace('$', '').replace(',', '').strip()
-                if m_row_clean:
-                    m_row_float = float(m_row_clean)
-                    if abs(m_row_float - monto) < 1.0:
-                        montos_match = True
-            except:
-                pass
-            
-            if fechas_match and montos_match:
-                return True
-    return False
+    # Convertir confianza a etiqueta
+    confianza_val = datos.get("confianza", 0)
+    confianza_str = "OPTIMA" if confianza_val >= 0.90 else "REVEER"
+    
+    # Preparar link de WhatsApp
+    whatsapp_link = ""
+    if whatsapp_from:
+        numero_limpio = whatsapp_from.replace("@c.us", "")
+        whatsapp_link = f'=HYPERLINK("https://wa.me/{numero_limpio}"; "{numero_limpio}")'
+    
+    return [
+        fecha_formateada,               # A: Fecha Aviso
+        fecha_deposito,                 # B: Fecha Depósito
+        monto,                          # C: Monto
+        emisor_nombre,                  # D: Nombre Emisor
+        datos.get("banco_emisor", ""),  # E: Banco
+        datos.get("emisor_cbu", ""),    # F: CBU Emisor
+        datos.get("emisor_cuil", ""),   # G: CUIL Emisor
+        cuenta_destino,                 # H: Cuenta Destino
+        whatsapp_link,                  # I: WhatsApp
+        datos.get("referencia", ""),    # J: Referencia
+        confianza_str                   # K: Confianza
+    ]
+
+
+def armar_filas(
+    lista_datos: List[dict],
+    cuentas_destino: List[str],
+    remitentes: List[str],
+    timestamps: List[str]
+) -> List[list]:
+    """Filas A:K de varias transferencias (mismo orden)."""
+    return [
+        _armar_fila(datos, _formatear_fecha_aviso(timestamp), remitente, cuenta_destino)
+        for datos, cuenta_destino, remitente, timestamp in zip(lista_datos, cuentas_destino, remitentes, timestamps)
+    ]
 
 
 def guardar_en_sheets(
@@ -96,70 +240,15 @@ def guardar_en_sheets(
         Dict con resultado de la operación
     """
     try:
-        client = _get_sheets_client(credentials_path)
-        sheet = client.open_by_key(sheet_id).worksheet(sheet_name)
-        
-        # Verificar/Actualizar Headers
-        try:
-            first_row = sheet.row_values(1)
-            if not first_row or first_row != HEADERS:
-                sheet.update('A1:K1', [HEADERS])
-        except Exception:
-            pass
-        
-        # Formatear fecha recepción
-        try:
-            fecha_recepcion = datetime.fromisoformat(timestamp_recepcion.replace("Z", "+00:00"))
-            fecha_formateada = fecha_recepcion.strftime("%d/%m/%Y %H:%M")
-        except:
-            fecha_formateada = timestamp_recepcion or datetime.now().strftime("%d/%m/%Y %H:%M")
-        
-        # Preparar datos
-        monto = datos.get("monto_numerico", 0)
-        fecha_deposito = str(datos.get("fecha_operacion", "")).strip()
-        
-        # Lógica para nombre de emisor
-        emisor_nombre = datos.get("emisor_nombre", "")
-        if not emisor_nombre:
-            concepto = datos.get("concepto", "").lower()
-            if "deposito" in concepto or "efectivo" in concepto:
-                emisor_nombre = "DEPÓSITO EN EFECTIVO"
-        
-        # Convertir confianza a etiqueta
-        confianza_val = datos.get("confianza", 0)
-        confianza_str = "OPTIMA" if confianza_val >= 0.90 else "REVEER"
-        
-        # Detectar duplicados
-        todas_las_filas = sheet.get_all_values()
-        es_duplicado = _detectar_duplicado(todas_las_filas, fecha_deposito, monto)
+        sheet = abrir_hoja(credentials_path, sheet_id, sheet_name)
         
-        # Preparar link de WhatsApp
-        whatsapp_link = ""
-        if whatsapp_from:
-            numero_limpio = whatsapp_from.replace("@c.us", "")
-            whatsapp_link = f'=HYPERLINK("https://wa.me/{numero_limpio}"; "{numero_limpio}")'
+        fila = _armar_fila(datos, _formatear_fecha_aviso(timestamp_recepcion), whatsapp_from, cuenta_destino)
         
-        # Crear fila
-        fila = [
-            fecha_formateada,               # A: Fecha Aviso
-            fecha_deposito,                 # B: Fecha Depósito
-            monto,                          # C: Monto
-            emisor_nombre,                  # D: Nombre Emisor
-            datos.get("banco_emisor", ""),  # E: Banco
-            datos.get("emisor_cbu", ""),    # F: CBU Emisor
-            datos.get("emisor_cuil", ""),   # G: CUIL Emisor
-            cuenta_destino,                 # H: Cuenta Destino
-            whatsapp_link,                  # I: WhatsApp
-            datos.get("referencia", ""),    # J: Referencia
-            confianza_str                   # K: Confianza
-        ]
-        
-        # Guardar
-        sheet.append_row(fila, value_input_option='USER_ENTERED')
+        # Guardar (duplicados detectados con el espejo local)
+        nueva_fila_idx, (es_duplicado,) = agregar_filas(sheet, sheet_id, sheet_name, [fila])
         
         # Aplicar formato si es duplicado
         if es_duplicado:
-            nueva_fila_idx = len(todas_las_filas) + 1
             rango = f"A{nueva_fila_idx}:K{nueva_fila_idx}"
             sheet.format(rango, {
                 "backgroundColor": {
@@ -174,6 +263,64 @@ def guardar_en_sheets(
         }
         
     except Exception as e:
+        invalidar_hoja(credentials_path, sheet_id, sheet_name)
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+def guardar_lote_en_sheets(
+    lista_datos: List[dict],
+    credentials_path: str,
+    sheet_id: str,
+    sheet_name: str = "Hoja 1",
+    whatsapp_from: str = "",
+    timestamp_recepcion: str = "",
+    cuentas_destino: Optional[List[str]] = None,
+    remitentes: Optional[List[str]] = None,
+    timestamps: Optional[List[str]] = None
+) -> dict:
+    """
+    Guarda varias transferencias con un solo append_rows.
+    
+    Los duplicados se buscan en el espejo local de la hoja, que incluye las
+    filas anteriores del mismo lote. remitentes y timestamps (uno por
+    transferencia) reemplazan a whatsapp_from y timestamp_recepcion en lotes
+    de varios remitentes.
+    
+    Returns:
+        Dict con resultado de la operación ("duplicados" por transferencia)
+    """
+    cuentas_destino = cuentas_destino or ["Cuenta Desconocida"] * len(lista_datos)
+    remitentes = remitentes or [whatsapp_from] * len(lista_datos)
+    timestamps = timestamps or [timestamp_recepcion] * len(lista_datos)
+    try:
+        sheet = abrir_hoja(credentials_path, sheet_id, sheet_name)
+        
+        filas = armar_filas(lista_datos, cuentas_destino, remitentes, timestamps)
+        
+        primera_fila, duplicados = agregar_filas(sheet, sheet_id, sheet_name, filas)
+        
+        # Aplicar formato a los duplicados (un solo batch_update)
+        formatos = [
+            {"range": f"A{primera_fila + offset}:K{primera_fila + offset}",
+             "format": {"backgroundColor": {"red": 1.0, "green": 1.0, "blue": 0.8}}}
+            for offset, es_duplicado in enumerate(duplicados) if es_duplicado
+        ]
+        if formatos:
+            sheet.batch_format(formatos)
+        
+        cantidad_duplicados = sum(duplicados)
+        return {
+            "success": True,
+            "message": f"{len(filas)} filas guardadas en Google Sheets"
+                       + (f" ({cantidad_duplicados} duplicadas)" if cantidad_duplicados else ""),
+            "duplicados": duplicados
+        }
+        
+    except Exception as e:
+        invalidar_hoja(credentials_path, sheet_id, sheet_name)
         return {
             "success": False,
             "error": str(e)
@@ -183,14 +330,14 @@ def guardar_en_sheets(
 def verificar_conexion_sheets(credentials_path: str, sheet_id: str, sheet_name: str) -> dict:
     """Verifica que la conexión con Google Sheets funcione."""
     try:
-        client = _get_sheets_client(credentials_path)
-        sheet = client.open_by_key(sheet_id).worksheet(sheet_name)
+        sheet = abrir_hoja(credentials_path, sheet_id, sheet_name)
         sheet.acell('A1').value
         return {
             "success": True,
             "message": "Conexión exitosa con Google Sheets"
         }
     except Exception as e:
+        invalidar_hoja(credentials_path, sheet_id, sheet_name)
         return {
             "success": False,
             "error": str(e)
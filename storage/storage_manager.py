@@ -4,12 +4,16 @@ Decide dónde guardar según configuración: Excel, Sheets, o ambos.
 También agrega los datos al acumulador de sesión.
 """
 import logging
-from typing import Optional
-from storage.excel_storage import guardar_en_excel
-from storage.sheets_storage import guardar_en_sheets
+from typing import List, Optional
+from storage.excel_storage import guardar_en_excel, guardar_lote_en_excel
+from storage.sheets_storage import guardar_en_sheets, guardar_lote_en_sheets, verificar_conexion_sheets
+from storage.sheets_session import obtener_estado_sesiones
+from storage.sheets_queue import encolar_en_sheets
+from app.config import SHEETS_QUEUE_ENABLED
 from storage.session_accumulator import get_accumulator
 from app.validator import identificar_cuenta_destino
 from app.paths import resolve_appdata_path
+from app.metrics import medir_etapa, registrar_error
 
 logger = logging.getLogger(__name__)
 
@@ -46,25 +50,28 @@ def guardar_transferencia(
     storage_config = config.get("storage", {})
     errores = []
     exitos = []
+    encolados = []
     
     # Guardar en Excel si está habilitado
     if storage_config.get("excel_enabled", False):
         ruta_excel = storage_config.get("excel_path", "transferencias.xlsx")
         logger.info(f"Guardando en Excel: {ruta_excel}")
         
-        resultado_excel = guardar_en_excel(
-            datos=datos,
-            ruta_excel=ruta_excel,
-            whatsapp_from=whatsapp_from,
-            timestamp_recepcion=timestamp_recepcion,
-            cuenta_destino=nombre_cuenta_destino
-        )
+        with medir_etapa("excel"):
+            resultado_excel = guardar_en_excel(
+                datos=datos,
+                ruta_excel=ruta_excel,
+                whatsapp_from=whatsapp_from,
+                timestamp_recepcion=timestamp_recepcion,
+                cuenta_destino=nombre_cuenta_destino
+            )
         
         resultados["excel"] = resultado_excel
         
         if resultado_excel.get("success"):
             exitos.append("Excel")
         else:
+            registrar_error("excel", "guardado_fallido")
             errores.append(f"Excel: {resultado_excel.get('error', 'Error desconocido')}")
     
     # Guardar en Google Sheets si está habilitado
@@ -78,58 +85,221 @@ def guardar_transferencia(
         else:
             logger.info(f"Guardando en Google Sheets: {sheet_id}")
             
-            resultado_sheets = guardar_en_sheets(
-                datos=datos,
-                credentials_path=credentials_path,
-                sheet_id=sheet_id,
-                sheet_name=sheet_name,
-                whatsapp_from=whatsapp_from,
-                timestamp_recepcion=timestamp_recepcion,
-                cuenta_destino=nombre_cuenta_destino
-            )
+            with medir_etapa("sheets"):
+                if SHEETS_QUEUE_ENABLED:
+                    resultado_sheets = encolar_en_sheets(
+                        lista_datos=[datos],
+                        credentials_path=credentials_path,
+                        sheet_id=sheet_id,
+                        sheet_name=sheet_name,
+                        cuentas_destino=[nombre_cuenta_destino],
+                        remitentes=[whatsapp_from],
+                        timestamps=[timestamp_recepcion]
+                    )
+                else:
+                    resultado_sheets = guardar_en_sheets(
+                        datos=datos,
+                        credentials_path=credentials_path,
+                        sheet_id=sheet_id,
+                        sheet_name=sheet_name,
+                        whatsapp_from=whatsapp_from,
+                        timestamp_recepcion=timestamp_recepcion,
+                        cuenta_destino=nombre_cuenta_destino
+                    )
             
             resultados["sheets"] = resultado_sheets
             
-            if resultado_sheets.get("success"):
+            if resultado_sheets.get("pending"):
+                # Encolado: todavía no está en la hoja
+                encolados.append("Google Sheets")
+            elif resultado_sheets.get("success"):
                 exitos.append("Google Sheets")
             else:
+                registrar_error("sheets", "guardado_fallido")
                 errores.append(f"Sheets: {resultado_sheets.get('error', 'Error desconocido')}")
     
     # Determinar resultado final
-    if exitos:
-        resultados["success"] = True
-        resultados["message"] = f"Guardado en: {', '.join(exitos)}"
-        if errores:
-            resultados["message"] += f" | Errores: {'; '.join(errores)}"
-    else:
-        if errores:
-            resultados["message"] = f"Errores: {'; '.join(errores)}"
-        else:
-            resultados["message"] = "No hay destinos de almacenamiento habilitados"
+    _resumir(resultados, exitos, encolados, errores, "Guardado en", "Encolado para")
     
     resultados["cuenta_destino"] = nombre_cuenta_destino
     
     # Agregar al acumulador de sesión (siempre, para ver en el dashboard)
+    _agregar_al_acumulador(datos, whatsapp_from, nombre_cuenta_destino)
+    
+    return resultados
+
+
+def guardar_transferencias(
+    lista_datos: List[dict],
+    config: dict,
+    whatsapp_from: str = "",
+    timestamp_recepcion: str = "",
+    remitentes: Optional[List[str]] = None,
+    timestamps: Optional[List[str]] = None
+) -> dict:
+    """
+    Guarda varias transferencias (ej. un PDF con un comprobante por página)
+    con una sola escritura por destino.
+    
+    Args:
+        lista_datos: Datos extraídos de cada comprobante
+        config: Diccionario de configuración con opciones de storage
+        whatsapp_from: Número de WhatsApp del remitente
+        timestamp_recepcion: Timestamp de recepción
+        remitentes: WhatsApp de cada transferencia (lotes de varios remitentes);
+            si se pasa, reemplaza a whatsapp_from
+        timestamps: Timestamp de recepción de cada transferencia; si se pasa,
+            reemplaza a timestamp_recepcion
+        
+    Returns:
+        Dict con resultados de cada destino y "cuentas_destino" por transferencia
+    """
+    resultados = {
+        "excel": None,
+        "sheets": None,
+        "success": False,
+        "message": "",
+        "cantidad": len(lista_datos)
+    }
+    
+    cuentas = [identificar_cuenta_destino(d.get("receptor_cbu", "")) for d in lista_datos]
+    nombres_cuentas = [c["nombre"] if c else "Cuenta Desconocida" for c in cuentas]
+    resultados["cuentas_destino"] = nombres_cuentas
+    
+    if not lista_datos:
+        resultados["message"] = "No hay transferencias para guardar"
+        return resultados
+    
+    remitentes = remitentes or [whatsapp_from] * len(lista_datos)
+    timestamps = timestamps or [timestamp_recepcion] * len(lista_datos)
+    
+    storage_config = config.get("storage", {})
+    errores = []
+    exitos = []
+    encolados = []
+    
+    if storage_config.get("excel_enabled", False):
+        ruta_excel = storage_config.get("excel_path", "transferencias.xlsx")
+        logger.info(f"Guardando {len(lista_datos)} transferencias en Excel: {ruta_excel}")
+        
+        with medir_etapa("excel"):
+            resultado_excel = guardar_lote_en_excel(
+                lista_datos=lista_datos,
+                ruta_excel=ruta_excel,
+                cuentas_destino=nombres_cuentas,
+                remitentes=remitentes,
+                timestamps=timestamps
+            )
+        resultados["excel"] = resultado_excel
+        
+        if resultado_excel.get("success"):
+            exitos.append("Excel")
+        else:
+            registrar_error("excel", "guardado_fallido")
+            errores.append(f"Excel: {resultado_excel.get('error', 'Error desconocido')}")
+    
+    if storage_config.get("sheets_enabled", False):
+        credentials_path = resolve_appdata_path(config.get("google_credentials_path", ""))
+        sheet_id = storage_config.get("sheets_id", "")
+        sheet_name = storage_config.get("sheets_name", "Hoja 1")
+        
+        if not credentials_path or not sheet_id:
+            errores.append("Sheets: Credenciales o ID de Sheet no configurados")
+        else:
+            logger.info(f"Guardando {len(lista_datos)} transferencias en Google Sheets: {sheet_id}")
+            
+            with medir_etapa("sheets"):
+                # Con la escritura diferida se encola y un hilo envía en lotes
+                guardar_lote = encolar_en_sheets if SHEETS_QUEUE_ENABLED else guardar_lote_en_sheets
+                resultado_sheets = guardar_lote(
+                    lista_datos=lista_datos,
+                    credentials_path=credentials_path,
+                    sheet_id=sheet_id,
+                    sheet_name=sheet_name,
+                    cuentas_destino=nombres_cuentas,
+                    remitentes=remitentes,
+                    timestamps=timestamps
+                )
+            resultados["sheets"] = resultado_sheets
+            
+            if resultado_sheets.get("pending"):
+                # Encolado: todavía no está en la hoja
+                encolados.append("Google Sheets")
+            elif resultado_sheets.get("success"):
+                exitos.append("Google Sheets")
+            else:
+                registrar_error("sheets", "guardado_fallido")
+                errores.append(f"Sheets: {resultado_sheets.get('error', 'Error desconocido')}")
+    
+    _resumir(
+        resultados, exitos, encolados, errores,
+        f"{len(lista_datos)} transferencias guardadas en", f"{len(lista_datos)} transferencias encoladas para"
+    )
+    
+    for datos, remitente, nombre_cuenta in zip(lista_datos, remitentes, nombres_cuentas):
+        _agregar_al_acumulador(datos, remitente, nombre_cuenta)
+    
+    return resultados
+
+
+def verificar_sheets(config: dict) -> dict:
+    """
+    Verifica la conexión con el Sheet configurado usando la sesión compartida
+    (sin volver a autorizar) y agrega el estado de la sesión.
+    
+    Returns:
+        Dict con "success" y "sesion" (autorizaciones, refrescos, hojas abiertas...)
+    """
+    storage_config = config.get("storage", {})
+    credentials_path = resolve_appdata_path(config.get("google_credentials_path", ""))
+    sheet_id = storage_config.get("sheets_id", "")
+    if not config.get("google_credentials_path") or not sheet_id:
+        return {"success": False, "error": "Credenciales o ID de Sheet no configurados"}
+    
+    resultado = verificar_conexion_sheets(credentials_path, sheet_id, storage_config.get("sheets_name", "Hoja 1"))
+    resultado["sesion"] = obtener_estado_sesiones().get(credentials_path)
+    return resultado
+
+
+def _resumir(resultados: dict, exitos: List[str], encolados: List[str], errores: List[str],
+             guardado: str, encolado: str):
+    """
+    Arma "success" y "message" del guardado. Un destino encolado (Sheets
+    con escritura diferida) cuenta como éxito pero no se informa como
+    guardado: las filas recién están en la cola.
+    """
+    partes = []
+    if exitos:
+        partes.append(f"{guardado}: {', '.join(exitos)}")
+    if encolados:
+        partes.append(f"{encolado}: {', '.join(encolados)} (pendiente de envío)")
+    if errores:
+        partes.append(f"Errores: {'; '.join(errores)}")
+    resultados["success"] = bool(exitos or encolados)
+    resultados["message"] = " | ".join(partes) or "No hay destinos de almacenamiento habilitados"
+
+
+def _agregar_al_acumulador(datos: dict, whatsapp_from: str, nombre_cuenta_destino: str):
+    """Agrega una transferencia al acumulador de sesión (dashboard)."""
     try:
         accumulator = get_accumulator()
-        accumulator.add_entry({
-            'archivo': datos.get('archivo', 'Sin nombre'),
-            'fuente': 'WhatsApp' if whatsapp_from else 'Carpeta',
-            'fecha_operacion': datos.get('fecha_deposito', ''),
-            'monto': datos.get('monto_numerico', datos.get('monto', 0)),
-            'banco_origen': datos.get('banco_origen', datos.get('emisor_nombre', '')),
-            'banco_destino': datos.get('banco_destino', ''),
-            'cbu_origen': datos.get('emisor_cbu', ''),
-            'cbu_destino': datos.get('receptor_cbu', ''),
-            'ordenante': datos.get('ordenante', datos.get('emisor_nombre', '')),
-            'receptor_nombre': datos.get('receptor_nombre', ''),
-            'receptor_cuit': datos.get('receptor_cuit', ''),
-            'numero_comprobante': datos.get('numero_comprobante', ''),
-            'whatsapp_from': whatsapp_from,
-            'cuenta_destino': nombre_cuenta_destino
-        })
+        with medir_etapa("acumulador"):
+            accumulator.add_entry({
+                'archivo': datos.get('archivo', 'Sin nombre'),
+                'fuente': 'WhatsApp' if whatsapp_from else 'Carpeta',
+                'fecha_operacion': datos.get('fecha_deposito', ''),
+                'monto': datos.get('monto_numerico', datos.get('monto', 0)),
+                'banco_origen': datos.get('banco_origen', datos.get('emisor_nombre', '')),
+                'banco_destino': datos.get('banco_destino', ''),
+                'cbu_origen': datos.get('emisor_cbu', ''),
+                'cbu_destino': datos.get('receptor_cbu', ''),
+                'ordenante': datos.get('ordenante', datos.get('emisor_nombre', '')),
+                'receptor_nombre': datos.get('receptor_nombre', ''),
+                'receptor_cuit': datos.get('receptor_cuit', ''),
+                'numero_comprobante': datos.get('numero_comprobante', ''),
+                'whatsapp_from': whatsapp_from,
+                'cuenta_destino': nombre_cuenta_destino
+            })
         logger.info(f"Comprobante agregado al acumulador de sesión")
     except Exception as e:
         logger.error(f"Error agregando al acumulador: {e}")
-    
-    return resultados
@@ -7,6 +7,8 @@ import os
 import json
 
 API_URL = "http://localhost:8000"
+# Clave de la API (config "api_key"), si está configurada
+HEADERS = {"X-API-Key": os.environ["API_KEY"]} if os.environ.get("API_KEY") else {}
 
 def test_receipt(file_path: str):
     """Prueba un comprobante"""
@@ -37,7 +39,7 @@ def test_receipt(file_path: str):
     try:
         response = httpx.post(
             f"{API_URL}/extract-only/",  # Usamos extract-only para no guardar en sheets
-            json=payload,
+            json=payload, headers=HEADERS,
             timeout=60.0
         )
         result = response.json()
@@ -6,6 +6,8 @@ import json
 from datetime import datetime
 
 API_URL = "http://localhost:8000"
+# Clave de la API (config "api_key"), si está configurada
+HEADERS = {"X-API-Key": os.environ["API_KEY"]} if os.environ.get("API_KEY") else {}
 FILENAME = "WhatsApp Image 2026-01-22 at 16.25.01.jpeg"
 FILEPATH = f"/Users/leguillo/Downloads/comprobantes/{FILENAME}"
 
@@ -30,7 +32,7 @@ def debug_single():
     # 1. Extracción PURA (sin guardar)
     print("\n[1] Probando /extract-only/...")
     try:
-        resp = httpx.post(f"{API_URL}/extract-only/", json=payload, timeout=60.0)
+        resp = httpx.post(f"{API_URL}/extract-only/", json=payload, headers=HEADERS, timeout=60.0)
         print(f"Status: {resp.status_code}")
         data = resp.json()
         print(json.dumps(data, indent=2, ensure_ascii=False))
@@ -40,7 +42,7 @@ def debug_single():
     # 2. Procesamiento COMPLETO (guardar)
     print("\n[2] Probando /process-receipt/ (Guardado)...")
     try:
-        resp = httpx.post(f"{API_URL}/process-receipt/", json=payload, timeout=60.0)
+        resp = httpx.post(f"{API_URL}/process-receipt/", json=payload, headers=HEADERS, timeout=60.0)
         print(f"Status: {resp.status_code}")
         data = resp.json()
         print(json.dumps(data, indent=2, ensure_ascii=False))
@@ -9,6 +9,8 @@ import os
 from datetime import datetime
 
 API_URL = "http://localhost:8000"
+# Clave de la API (config "api_key"), si está configurada
+HEADERS = {"X-API-Key": os.environ["API_KEY"]} if os.environ.get("API_KEY") else {}
 
 def test_file_save(file_path: str, index: int, total: int):
     """Procesa un archivo y lo GUARDA en Google Sheets"""
@@ -39,7 +41,7 @@ def test_file_save(file_path: str, index: int, total: int):
     try:
         response = httpx.post(
             f"{API_URL}/process-receipt/",  # Este endpoint GUARDA en Sheets
-            json=payload,
+            json=payload, headers=HEADERS,
             timeout=120.0
         )
         result = response.json()
@@ -5,6 +5,8 @@ import httpx
 import os
 
 API_URL = "http://localhost:8000"
+# Clave de la API (config "api_key"), si está configurada
+HEADERS = {"X-API-Key": os.environ["API_KEY"]} if os.environ.get("API_KEY") else {}
 
 def test_pdf(file_path: str):
     print(f"\n📄 Probando: {os.path.basename(file_path)}")
@@ -21,7 +23,7 @@ def test_pdf(file_path: str):
     
     response = httpx.post(
         f"{API_URL}/extract-only/",
-        json=payload,
+        json=payload, headers=HEADERS,
         timeout=120.0
     )
     result = response.json()
@@ -6,6 +6,8 @@ import os
 from datetime import datetime
 
 API_URL = "http://localhost:8000"
+# Clave de la API (config "api_key"), si está configurada
+HEADERS = {"X-API-Key": os.environ["API_KEY"]} if os.environ.get("API_KEY") else {}
 
 def test_file(file_path: str, index: int):
     """Prueba un archivo y devuelve los datos"""
@@ -35,7 +37,7 @@ def test_file(file_path: str, index: int):
     try:
         response = httpx.post(
             f"{API_URL}/extract-only/",
-            json=payload,
+            json=payload, headers=HEADERS,
             timeout=120.0
         )
         result = response.json()
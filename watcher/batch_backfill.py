@@ -0,0 +1,377 @@
+"""
+Backfill de carpetas con la Batch API de OpenAI.
+
+Para archivos históricos (miles de comprobantes) procesar de a uno con el
+folder watcher tarda horas. Este modo arma un JSONL con exactamente las
+mismas solicitudes que haría extraer_datos_comprobante, lo sube como un
+lote, consulta hasta que termina y después pasa todos los resultados por
+_validar_y_enriquecer y los guarda en bloque con guardar_transferencias.
+
+Lo que se resuelve localmente (cache de extracciones, PDFs con capa de
+texto) no se manda al lote. El estado de los lotes queda en
+data/backfill/estado.json, así un corte no pierde lotes ya enviados.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from openai import OpenAI
+
+from app.config import (
+    OPENAI_API_KEY, OPENAI_BATCH_BASE_URL, BATCH_POLL_SECONDS, BATCH_MAX_REQUESTS
+)
+from app.extractor import (
+    _consultar_cache, _guardar_en_cache, _extraer_desde_texto_pdf, _preparar_imagen,
+    _construir_parametros_modelo, _procesar_respuesta, _resultado_error, _es_pdf
+)
+from app.model_router import obtener_niveles, uso_respuesta
+from billing.cost_tracker import FACTOR_BATCH
+from app.paths import get_backfill_dir
+from storage.storage_manager import guardar_transferencias
+from watcher.folder_watcher import FolderWatcher
+
+logger = logging.getLogger(__name__)
+
+# Límite de tamaño del JSONL de entrada (la API acepta hasta 200 MB)
+MAX_BYTES_LOTE = 180 * 1024 * 1024
+# Transferencias por llamada a guardar_transferencias
+TAMANO_GUARDADO = 200
+
+ENDPOINT = "/v1/chat/completions"
+ESTADOS_FINALES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchBackfill:
+    """
+    Procesa los archivos nuevos de una carpeta con la Batch API.
+    """
+
+    def __init__(
+        self,
+        watcher: FolderWatcher,
+        config: dict,
+        cost_tracker=None,
+        cliente: Optional[OpenAI] = None,
+        intervalo_consulta: float = BATCH_POLL_SECONDS
+    ):
+        """
+        Args:
+            watcher: FolderWatcher de la carpeta (lista archivos y marca procesados)
+            config: Configuración completa (opciones de storage)
+            cost_tracker: CostTracker para registrar cada comprobante (opcional)
+            cliente: Cliente OpenAI (default: batch_base_url o la API real)
+            intervalo_consulta: Segundos entre consultas del estado del lote
+        """
+        self.watcher = watcher
+        self.config = config
+        self.cost_tracker = cost_tracker
+        self.cliente = cliente or OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BATCH_BASE_URL)
+        self.intervalo_consulta = intervalo_consulta
+        self.directorio = get_backfill_dir()
+        self.ruta_estado = os.path.join(self.directorio, "estado.json")
+        # En el lote va el nivel completo: la Batch API ya cuesta la mitad
+        # y no hay forma de escalar dentro de un mismo lote
+        self.nivel = obtener_niveles()[-1]
+
+    # --- Estado persistente ---
+
+    def _cargar_estado(self) -> dict:
+        try:
+            with open(self.ruta_estado, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"lotes": []}
+
+    def _guardar_estado(self, estado: dict):
+        temporal = self.ruta_estado + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(estado, f, indent=2, ensure_ascii=False)
+        os.replace(temporal, self.ruta_estado)
+
+    # --- Armado de lotes ---
+
+    def _preparar_archivos(self, archivos: List[str]) -> tuple:
+        """
+        Resuelve localmente lo que se pueda y escribe el resto en JSONL.
+
+        Returns:
+            Tuple (resueltos, lotes). resueltos: lista de (info, resultado);
+            lotes: lista de (ruta_jsonl, {custom_id: info})
+        """
+        resueltos = []
+        lotes = []
+        actual: Dict[str, dict] = {}
+        # custom_id -> info de todos los lotes, para reconocer copias del mismo archivo
+        enviados: Dict[str, dict] = {}
+        ruta_actual = None
+        salida = None
+        bytes_actual = 0
+
+        def cerrar_actual():
+            nonlocal salida, actual, bytes_actual
+            if salida is not None:
+                salida.close()
+                lotes.append((ruta_actual, actual))
+            salida, actual, bytes_actual = None, {}, 0
+
+        try:
+            for ruta in archivos:
+                nombre = os.path.basename(ruta)
+                with open(ruta, 'rb') as f:
+                    contenido = f.read()
+                mime_type = self.watcher._obtener_mime_type(ruta)
+                claves, cacheado = _consultar_cache(contenido, mime_type)
+                info = {"ruta": ruta, "nombre": nombre, "claves": claves}
+
+                if cacheado is not None:
+                    resueltos.append((info, cacheado))
+                    continue
+                try:
+                    if _es_pdf(mime_type):
+                        resultado = _extraer_desde_texto_pdf(contenido)
+                        if resultado is not None:
+                            _guardar_en_cache(claves, resultado)
+                            resueltos.append((info, resultado))
+                            continue
+                    imagen, mime_imagen, _ = _preparar_imagen(contenido, mime_type)
+                except Exception as e:
+                    resueltos.append((info, _resultado_error(str(e))))
+                    continue
+
+                custom_id = claves["hash"] or f"{len(enviados)}-{nombre}"
+                if custom_id in enviados:
+                    # Mismo archivo dos veces en la carpeta: se marca con el resultado del original
+                    enviados[custom_id].setdefault("copias", []).append(ruta)
+                    continue
+                linea = json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": ENDPOINT,
+                    "body": _construir_parametros_modelo(
+                        imagen, mime_imagen, self.nivel["modelo"], self.nivel["detalle"]
+                    )
+                }, ensure_ascii=False) + "\n"
+                tamano = len(linea.encode("utf-8"))
+
+                if salida is not None and (len(actual) >= BATCH_MAX_REQUESTS or bytes_actual + tamano > MAX_BYTES_LOTE):
+                    cerrar_actual()
+                if salida is None:
+                    ruta_actual = os.path.join(
+                        self.directorio, f"lote_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(lotes)}.jsonl"
+                    )
+                    salida = open(ruta_actual, 'w', encoding='utf-8')
+                salida.write(linea)
+                bytes_actual += tamano
+                actual[custom_id] = enviados[custom_id] = info
+        finally:
+            cerrar_actual()
+
+        return resueltos, lotes
+
+    def _enviar_lote(self, ruta_jsonl: str, archivos: Dict[str, dict]) -> dict:
+        """Sube el JSONL y crea el lote. Retorna el registro de estado del lote."""
+        with open(ruta_jsonl, 'rb') as f:
+            archivo = self.cliente.files.create(file=f, purpose="batch")
+        lote = self.cliente.batches.create(
+            input_file_id=archivo.id,
+            endpoint=ENDPOINT,
+            completion_window="24h",
+            metadata={"origen": "backfill_carpeta"}
+        )
+        logger.info(f"📦 Lote {lote.id} enviado con {len(archivos)} comprobantes")
+        return {
+            "batch_id": lote.id,
+            "input_file_id": archivo.id,
+            "jsonl": ruta_jsonl,
+            "enviado_en": datetime.now().isoformat(),
+            "estado": lote.status,
+            "archivos": archivos
+        }
+
+    # --- Seguimiento y resultados ---
+
+    def _esperar(self, batch_id: str):
+        """Consulta el lote hasta que llega a un estado final."""
+        while True:
+            lote = self.cliente.batches.retrieve(batch_id)
+            if lote.status in ESTADOS_FINALES:
+                return lote
+            conteo = getattr(lote, "request_counts", None)
+            if conteo is not None:
+                logger.info(f"⏳ Lote {batch_id}: {lote.status} ({conteo.completed}/{conteo.total})")
+            time.sleep(self.intervalo_consulta)
+
+    def _leer_resultados(self, lote, archivos: Dict[str, dict]) -> tuple:
+        """
+        Descarga la salida del lote y la convierte en resultados de extracción.
+
+        Returns:
+            Tuple (resueltos, reintentar). reintentar: archivos que fallaron por
+            error de la API y no se marcan como procesados
+        """
+        resueltos = []
+        vistos = set()
+        if lote.output_file_id:
+            texto = self.cliente.files.content(lote.output_file_id).text
+            for linea in texto.splitlines():
+                if not linea.strip():
+                    continue
+                item = json.loads(linea)
+                info = archivos.get(item.get("custom_id"))
+                if info is None:
+                    continue
+                respuesta = item.get("response") or {}
+                if item.get("error") or respuesta.get("status_code") != 200:
+                    continue
+                vistos.add(item["custom_id"])
+                uso = uso_respuesta(self.nivel["modelo"], respuesta.get("body"), FACTOR_BATCH)
+                try:
+                    content = respuesta["body"]["choices"][0]["message"]["content"]
+                    resultado = _procesar_respuesta(content)
+                    resultado["metodo"] = "batch"
+                    resultado["modelo"] = self.nivel["modelo"]
+                    resultado["uso"] = uso
+                    _guardar_en_cache(info["claves"], resultado)
+                except Exception as e:
+                    resultado = _resultado_error(f"Respuesta de lote inválida: {e}")
+                    resultado["uso"] = uso
+                resueltos.append((info, resultado))
+
+        reintentar = [info for custom_id, info in archivos.items() if custom_id not in vistos]
+        return resueltos, reintentar
+
+    def _guardar_resultados(self, resueltos: list) -> dict:
+        """
+        Guarda en bloque las transferencias, registra costos y marca procesados.
+        Los archivos de un tramo que no se pudo guardar no se marcan: el
+        próximo backfill los resuelve desde el cache de extracciones y
+        reintenta el guardado.
+        """
+        exitosos = [(info, r) for info, r in resueltos if r.get("success")]
+        guardados = 0
+        sin_guardar = set()
+        for inicio in range(0, len(exitosos), TAMANO_GUARDADO):
+            tramo = exitosos[inicio:inicio + TAMANO_GUARDADO]
+            lista_datos = []
+            for info, resultado in tramo:
+                datos = resultado["data"]
+                datos.setdefault("archivo_origen", info["nombre"])
+                lista_datos.append(datos)
+            resultado_guardado = guardar_transferencias(
+                lista_datos=lista_datos,
+                config=self.config,
+                whatsapp_from="",
+                timestamp_recepcion=datetime.now().isoformat()
+            )
+            if resultado_guardado.get("success"):
+                guardados += len(tramo)
+            else:
+                sin_guardar.update(info["ruta"] for info, _ in tramo)
+                logger.error(
+                    f"Error guardando lote de backfill, {len(tramo)} archivos quedan para el próximo "
+                    f"backfill: {resultado_guardado.get('message')}"
+                )
+
+        if self.cost_tracker:
+            for info, resultado in resueltos:
+                datos = resultado.get("data") or {}
+                self.cost_tracker.registrar_procesamiento(
+                    archivo=info["nombre"],
+                    exito=bool(resultado.get("success")),
+                    monto_extraido=datos.get("monto_numerico"),
+                    emisor=datos.get("emisor_nombre"),
+                    fuente="carpeta",
+                    uso=resultado.get("uso")
+                )
+
+        # Las copias de un archivo no se guardan de nuevo, sólo se marcan
+        self.watcher.marcar_procesados([
+            (ruta, bool(resultado.get("success")), resultado.get("data") or {"error": resultado.get("error")})
+            for info, resultado in resueltos
+            if info["ruta"] not in sin_guardar
+            for ruta in [info["ruta"], *info.get("copias", [])]
+        ])
+        return {
+            "exitosos": len(exitosos),
+            "guardados": guardados,
+            "sin_guardar": len(sin_guardar),
+            "fallidos": len(resueltos) - len(exitosos)
+        }
+
+    def _borrar_archivos_lote(self, registro: dict):
+        """Borra el JSONL local y el archivo subido (tienen las imágenes de los comprobantes)."""
+        try:
+            os.remove(registro["jsonl"])
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"No se pudo borrar {registro['jsonl']}: {e}")
+        try:
+            self.cliente.files.delete(registro["input_file_id"])
+        except Exception as e:
+            logger.warning(f"No se pudo borrar el archivo del lote {registro['batch_id']} en OpenAI: {e}")
+
+    def _completar_lote(self, registro: dict, estado: dict) -> dict:
+        """Espera un lote enviado, guarda sus resultados y lo cierra en el estado."""
+        lote = self._esperar(registro["batch_id"])
+        resueltos, reintentar = self._leer_resultados(lote, registro["archivos"])
+        resumen = self._guardar_resultados(resueltos)
+        resumen["reintentar"] = len(reintentar)
+        registro["estado"] = lote.status
+        registro["resumen"] = resumen
+        self._guardar_estado(estado)
+        self._borrar_archivos_lote(registro)
+        if reintentar:
+            logger.warning(f"Lote {lote.id}: {len(reintentar)} comprobantes sin respuesta, se reintentan en el próximo backfill")
+        logger.info(f"✅ Lote {lote.id} ({lote.status}): {resumen}")
+        return resumen
+
+    def reanudar(self) -> List[dict]:
+        """Completa los lotes enviados que quedaron sin cerrar (ej. tras un reinicio)."""
+        estado = self._cargar_estado()
+        resumenes = []
+        for registro in estado["lotes"]:
+            if registro["estado"] not in ESTADOS_FINALES:
+                resumenes.append(self._completar_lote(registro, estado))
+        return resumenes
+
+    def ejecutar(self) -> dict:
+        """
+        Procesa todos los archivos nuevos de la carpeta con la Batch API.
+
+        Returns:
+            Dict con totales: archivos, resueltos localmente, lotes y resúmenes
+        """
+        self.reanudar()
+        estado = self._cargar_estado()
+        en_vuelo = {
+            ruta
+            for registro in estado["lotes"] if registro["estado"] not in ESTADOS_FINALES
+            for info in registro["archivos"].values()
+            for ruta in [info["ruta"], *info.get("copias", [])]
+        }
+        archivos = [r for r in self.watcher.listar_archivos_nuevos() if r not in en_vuelo]
+        logger.info(f"📁 Backfill: {len(archivos)} archivos nuevos en {self.watcher.carpeta}")
+
+        resueltos, lotes = self._preparar_archivos(archivos)
+        resumen_local = self._guardar_resultados(resueltos) if resueltos else None
+        if resueltos:
+            logger.info(f"{len(resueltos)} comprobantes resueltos sin lote (cache o texto del PDF)")
+
+        registros = []
+        for ruta_jsonl, archivos_lote in lotes:
+            registro = self._enviar_lote(ruta_jsonl, archivos_lote)
+            estado["lotes"].append(registro)
+            self._guardar_estado(estado)
+            registros.append(registro)
+
+        resumenes = [self._completar_lote(registro, estado) for registro in registros]
+        return {
+            "archivos": len(archivos),
+            "resueltos_localmente": resumen_local,
+            "lotes": [r["batch_id"] for r in registros],
+            "resumenes": resumenes
+        }
@@ -4,7 +4,6 @@ Usa hash SHA256 para evitar reprocesar archivos ya vistos.
 """
 import os
 import json
-import hashlib
 import base64
 import time
 import logging
@@ -16,6 +15,8 @@ logger = logging.getLogger(__name__)
 
 # Ruta del archivo de archivos procesados
 from app.paths import get_processed_files_path
+from app.extraction_cache import calcular_hash_archivo
+from app.resilience import es_reintentable
 DEFAULT_PROCESSED_FILE = get_processed_files_path()
 
 # Extensiones válidas
@@ -73,12 +74,8 @@ class FolderWatcher:
             json.dump(data, f, indent=2, ensure_ascii=False)
     
     def _calcular_hash(self, ruta_archivo: str) -> str:
-        """Calcula el hash SHA256 de un archivo."""
-        sha256 = hashlib.sha256()
-        with open(ruta_archivo, 'rb') as f:
-            for bloque in iter(lambda: f.read(65536), b''):
-                sha256.update(bloque)
-        return sha256.hexdigest()
+        """Calcula el hash SHA256 de un archivo (mismo hash que usa el cache de extracciones)."""
+        return calcular_hash_archivo(ruta_archivo)
     
     def _archivo_a_base64(self, ruta_archivo: str) -> str:
         """Lee un archivo y lo convierte a base64."""
@@ -132,7 +129,29 @@ class FolderWatcher:
         
         self._guardar_procesados(procesados)
         logger.info(f"Archivo marcado como procesado: {ruta_archivo}")
-    
+
+    def marcar_procesados(self, archivos: List[tuple]):
+        """
+        Marca varios archivos como procesados con una sola escritura del JSON.
+
+        Args:
+            archivos: Lista de tuplas (ruta_archivo, exito, datos)
+        """
+        if not archivos:
+            return
+        procesados = self._cargar_procesados()
+        ahora = datetime.now().isoformat()
+        for ruta_archivo, exito, datos in archivos:
+            procesados["archivos"][self._calcular_hash(ruta_archivo)] = {
+                "nombre": os.path.basename(ruta_archivo),
+                "ruta_original": ruta_archivo,
+                "procesado_en": ahora,
+                "exito": exito,
+                "datos": datos
+            }
+        self._guardar_procesados(procesados)
+        logger.info(f"{len(archivos)} archivos marcados como procesados")
+
     def listar_archivos_nuevos(self) -> List[str]:
         """
         Lista archivos nuevos (no procesados) en la carpeta.
@@ -200,24 +219,36 @@ class FolderWatcher:
                 # Procesar
                 resultado = procesar_fn(file_base64, mime_type, nombre)
                 
-                # Marcar como procesado
-                exito = resultado.get("success", False)
-                self.marcar_procesado(ruta, exito=exito, datos=resultado.get("data"))
-                
                 resultados.append({
                     "archivo": nombre,
                     "ruta": ruta,
                     "resultado": resultado
                 })
                 
+                # Error transitorio de OpenAI (rate limit, 5xx, circuito abierto) o
+                # sin cupo en el control de admisión: no se marca y se corta el
+                # escaneo; se reintenta en el próximo
+                if resultado.get("reintentable"):
+                    logger.warning(
+                        f"Error transitorio procesando {nombre} ({resultado.get('error')}), se reintenta en el próximo "
+                        f"escaneo ({len(archivos_nuevos) - archivos_nuevos.index(ruta) - 1} archivos en espera)"
+                    )
+                    break
+                
+                # Marcar como procesado
+                exito = resultado.get("success", False)
+                self.marcar_procesado(ruta, exito=exito, datos=resultado.get("data"))
+                
             except Exception as e:
                 logger.error(f"Error procesando {nombre}: {e}")
-                self.marcar_procesado(ruta, exito=False, datos={"error": str(e)})
                 resultados.append({
                     "archivo": nombre,
                     "ruta": ruta,
                     "resultado": {"success": False, "error": str(e)}
                 })
+                if es_reintentable(e):
+                    break
+                self.marcar_procesado(ruta, exito=False, datos={"error": str(e)})
             
             # Esperar entre archivos
             if archivos_nuevos.index(ruta) < len(archivos_nuevos) - 1: